@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Advert, Driver, Customer, User, Booking, ServiceBooking, RideOffer
+from .models import Advert, Driver, Customer, User, Booking, ServiceBooking, RideOffer, DispatchJob, DriverAvailability, TripTrailSegment, ServiceZone
 from .models_site import SiteSetting
 
 # Register SiteSetting for admin logo management
@@ -61,3 +61,36 @@ class RideOfferAdmin(admin.ModelAdmin):
     search_fields = ('booking__id', 'driver__full_name')
     date_hierarchy = 'offered_at'
     readonly_fields = ('offered_at', 'responded_at', 'seconds_remaining')
+
+
+@admin.register(DispatchJob)
+class DispatchJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'booking', 'status', 'attempts', 'enqueued_at', 'started_at', 'finished_at')
+    list_filter = ('status', 'enqueued_at')
+    search_fields = ('booking__id',)
+    readonly_fields = ('enqueued_at', 'started_at', 'finished_at')
+
+
+@admin.register(DriverAvailability)
+class DriverAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('driver', 'state', 'updated_at')
+    list_filter = ('state',)
+    search_fields = ('driver__full_name', 'driver__phone')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(TripTrailSegment)
+class TripTrailSegmentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'booking', 'driver', 'point_count', 'started_at', 'ended_at')
+    search_fields = ('booking__id', 'driver__full_name')
+    exclude = ('data',)
+    readonly_fields = ('booking', 'driver', 'point_count', 'started_at', 'ended_at', 'created_at')
+
+
+@admin.register(ServiceZone)
+class ServiceZoneAdmin(admin.ModelAdmin):
+    list_display = ('name', 'priority', 'is_active', 'updated_at')
+    list_filter = ('is_active',)
+    search_fields = ('name',)
+    filter_horizontal = ('provider_services', 'service_providers')
+    readonly_fields = ('created_at', 'updated_at')
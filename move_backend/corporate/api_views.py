@@ -7,15 +7,18 @@
 # 4) Left your business logic intact (sequential offers + push + OTP etc.)
 # ------------------------------------------------------------
 
+import json
 import math
 import random
 import logging
+from decimal import Decimal
 
 from django.conf import settings
 from django.core.mail import send_mail
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -51,7 +54,11 @@ from .push_notifications import (
     notify_all_drivers_push,
 )
 
-from . import dispatch_service
+from . import (
+    candidate_queue, chat_service, dispatch_queue, dispatch_service, driver_presence, driver_state,
+    location_cadence, location_store, nearby_vehicles, offer_push, trip_meter, trip_trail, trip_tracking, zone_index,
+)
+from .spatial_index import driver_index, sync_driver
 
 
 # ============================================================
@@ -544,6 +551,13 @@ class DriverSetOnlineAPIView(APIView):
 
         driver.is_online = is_online
         driver.save()
+        driver_state.set_online(driver.id, bool(is_online))
+        if is_online:
+            driver_presence.went_online(driver.id)
+        else:
+            driver_presence.went_offline(driver.id)
+        location_store.apply_to([driver])
+        sync_driver(driver)
         return Response({'is_online': driver.is_online, 'message': 'Status updated successfully'})
 
 
@@ -559,8 +573,6 @@ class DriverRideRequestsAPIView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request, driver_id):
-        from .models import RideOffer  # keep local if model exists in your app
-
         try:
             driver = Driver.objects.get(id=driver_id)
         except Driver.DoesNotExist:
@@ -574,50 +586,20 @@ class DriverRideRequestsAPIView(APIView):
             if not driver.otp_verified:
                 return Response({'error': 'Verification required', 'message': 'Please verify your account.', 'rides': []}, status=403)
 
-        dispatch_service.expire_pending_offers()
+        driver_presence.heartbeat(driver.id)
 
-        pending_offer = RideOffer.objects.filter(
-            driver=driver,
-            status='pending'
-        ).select_related('booking', 'booking__customer').first()
+        # Expired offers are handled by the offer scheduler; this endpoint only reads
+        pending_offer = dispatch_service.get_pending_offer_for_driver(driver)
 
         active_bookings = Booking.objects.filter(
             driver=driver,
             status__in=['driver_assigned', 'driver_arrived', 'in_progress']
-        ).order_by('-created_at')
+        ).select_related('customer').order_by('-created_at')
 
         rides = []
 
-        if pending_offer and not pending_offer.is_expired:
-            booking = pending_offer.booking
-            rides.append({
-                'id': booking.id,
-                'offer_id': pending_offer.id,
-                'pickup_address': booking.pickup_location,
-                'destination_address': booking.destination,
-                'pickup_latitude': float(booking.pickup_latitude) if booking.pickup_latitude else None,
-                'pickup_longitude': float(booking.pickup_longitude) if booking.pickup_longitude else None,
-                'destination_latitude': float(booking.destination_latitude) if booking.destination_latitude else None,
-                'destination_longitude': float(booking.destination_longitude) if booking.destination_longitude else None,
-                'fare': str(booking.fare) if booking.fare else '0',
-                'distance': str(booking.distance) if booking.distance else '0',
-                'duration': booking.duration,
-                'ride_type': booking.ride_type,
-                'status': 'pending_offer',
-                'customer_id': booking.customer_id,
-                'customer_name': booking.customer.full_name if booking.customer else 'Customer',
-                'customer_phone': booking.contact_phone or (booking.customer.phone if booking.customer else ''),
-                'created_at': booking.created_at.isoformat() if booking.created_at else None,
-                'is_assigned_to_me': False,
-                'is_offer': True,
-                'seconds_remaining': pending_offer.seconds_remaining,
-                'expires_at': pending_offer.expires_at.isoformat(),
-                'distance_to_pickup_km': float(pending_offer.distance_km) if pending_offer.distance_km else None,
-            })
-        elif pending_offer and pending_offer.is_expired:
-            pending_offer.status = 'expired'
-            pending_offer.save()
-            dispatch_service.dispatch_ride(pending_offer.booking)
+        if pending_offer:
+            rides.append(offer_push.offer_payload(pending_offer))
 
         for booking in active_bookings:
             rides.append({
@@ -645,7 +627,8 @@ class DriverRideRequestsAPIView(APIView):
                 'distance_to_pickup_km': None,
             })
 
-        return Response(rides)
+        # Offers are pushed over the WebSocket; polling is only a safety net
+        return Response(rides, headers={'X-Poll-Interval': str(offer_push.OFFER_SAFETY_POLL_SECONDS)})
 
 
 # ============================================================
@@ -839,13 +822,19 @@ class DriverAcceptRideAPIView(APIView):
                 if booking.driver and booking.driver.id != driver_id:
                     return Response({'error': 'This ride has been assigned to another driver'}, status=400)
 
-                booking.driver = driver
-                booking.status = 'driver_assigned'
-                booking.save()
+                # A retried accept (e.g. after a dropped response) finds the
+                # driver already assigned and on_trip; it succeeds again
+                if booking.driver_id != driver.id:
+                    if not driver_state.mark_on_trip(driver.id):
+                        return Response({'error': 'You are not available for rides right now'}, status=400)
+                    booking.driver = driver
+                    booking.status = 'driver_assigned'
+                    booking.save()
+                    trip_trail.start_trip(booking.id, driver.id)
 
                 return Response({
                     'message': 'Ride accepted successfully',
-                    'status': 'driver_assigned',
+                    'status': booking.status,
                     'booking_id': booking.id,
                     'pickup': booking.pickup_location,
                     'destination': booking.destination,
@@ -919,7 +908,9 @@ class DriverRejectRideAPIView(APIView):
                     booking.driver = None
                     booking.status = 'searching_driver'
                     booking.save()
-                    dispatch_service.dispatch_ride(booking)
+                    driver_state.end_trip(driver_id)
+                    trip_trail.end_trip(booking.id, driver_id)
+                    dispatch_service.request_dispatch(booking)
 
                 return Response({'message': 'Ride rejected', 'status': 'rejected'})
         else:
@@ -950,23 +941,54 @@ class BookingListCreateAPIView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         logger = logging.getLogger(__name__)
-        booking = serializer.save(status='searching_driver')
+        pickup_lat = serializer.validated_data.get('pickup_latitude')
+        pickup_lon = serializer.validated_data.get('pickup_longitude')
+        service_zone_id = zone_index.zone_for(pickup_lat, pickup_lon)
+        # Bookings without pickup coordinates cannot be placed and are not rejected
+        has_pickup = pickup_lat is not None and pickup_lon is not None
+        if service_zone_id is None and has_pickup and zone_index.has_zones():
+            raise serializers.ValidationError({'pickup_location': 'Pickup location is outside our service area'})
+        booking = serializer.save(status='searching_driver', service_zone_id=service_zone_id)
+
+        if getattr(settings, 'DISPATCH_USE_WORKER', True):
+            # The dispatch worker picks this up; the customer gets a fast 201
+            dispatch_queue.enqueue_dispatch(booking)
+            return
 
         try:
-            offer = dispatch_service.dispatch_ride(booking)
+            offer = dispatch_service.request_dispatch(booking)
             if offer:
                 logger.info(f"Booking #{booking.id} - Offer sent to driver #{offer.driver_id}")
+            elif dispatch_service.is_batch_mode():
+                logger.info(f"Booking #{booking.id} - Waiting for next batch dispatch cycle")
             else:
                 logger.warning(f"Booking #{booking.id} - No available drivers found")
         except Exception as e:
             logger.error(f"Booking #{booking.id} - Dispatch error: {str(e)}")
 
 
+class DispatchQueueStatsAPIView(APIView):
+    """
+    Dispatch queue depth and lag, for monitoring.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(dispatch_queue.queue_stats())
+
+
 class BookingDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
     permission_classes = [AllowAny]
 
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        booking = serializer.save()
+        if booking.status == 'picked_up' and previous_status != 'picked_up':
+            # The fare covers the ride itself, not the drive to the pickup
+            trip_meter.start(booking.id)
+
 
 class CustomerBookingsAPIView(generics.ListAPIView):
     serializer_class = BookingSerializer
@@ -1138,7 +1160,16 @@ class CompleteBookingAPIView(APIView):
         booking.status = 'completed'
         booking.completed_at = timezone.now()
         booking.payment_completed = True
+        # Server-measured distance/time replace the client's estimate when the
+        # trip was metered with enough fixes over enough of its duration
+        metered = trip_meter.finish(booking.id, booking.completed_at.timestamp())
+        if metered and metered['reliable']:
+            booking.distance = Decimal(str(metered['distance_km']))
+            booking.duration = metered['duration_minutes']
         booking.save()
+        if booking.driver_id:
+            driver_state.end_trip(booking.driver_id)
+            trip_trail.end_trip(booking.id, booking.driver_id)
 
         if booking.customer:
             notify_customer_push(booking.customer.id, "Ride Completed", "Your ride has been completed. Thank you for riding with us!")
@@ -1151,7 +1182,10 @@ class CompleteBookingAPIView(APIView):
             'message': 'Booking completed successfully',
             'booking_id': booking.id,
             'receipt_sent': receipt_sent,
-            'status': booking.status
+            'status': booking.status,
+            'distance': float(booking.distance),
+            'duration': booking.duration,
+            'metered': bool(metered and metered['reliable'])
         })
 
 
@@ -1174,6 +1208,7 @@ class CancelBookingAPIView(APIView):
         booking.status = 'cancelled'
         booking.driver = None
         booking.save()
+        trip_meter.discard(booking.id)
 
         if booking.customer:
             notify_customer_push(booking.customer.id, "Booking Cancelled", "Your ride has been cancelled.")
@@ -1192,10 +1227,14 @@ class CancelBookingAPIView(APIView):
                 message=f'The customer has cancelled their ride from {booking.pickup_location} to {booking.destination}. You are now available for new rides.'
             )
 
-            assigned_driver.is_online = True
-            assigned_driver.save()
+            driver_state.end_trip(assigned_driver.id)
+            trip_trail.end_trip(booking.id, assigned_driver.id)
 
-        RideOffer.objects.filter(booking=booking, status='pending').update(status='expired')
+        pending_offers = RideOffer.objects.filter(booking=booking, status='pending')
+        offered_driver_ids = list(pending_offers.values_list('driver_id', flat=True))
+        pending_offers.update(status='expired')
+        driver_state.release_offered(offered_driver_ids)
+        candidate_queue.discard(booking.id)
 
         return Response({
             'message': 'Booking cancelled successfully',
@@ -1211,46 +1250,37 @@ class CancelBookingAPIView(APIView):
 
 class BookingTrackingAPIView(APIView):
     """
-    Get real-time tracking info for a booking
+    Get real-time tracking info for a booking.
+    Live updates are pushed over the ride notification socket; sending the
+    resume_token from this response in a 'track' message picks up from here.
     """
     permission_classes = [AllowAny]
 
     def get(self, request, booking_id):
         try:
-            booking = Booking.objects.get(id=booking_id)
+            booking = Booking.objects.select_related('driver').get(id=booking_id)
         except Booking.DoesNotExist:
             return Response({'error': 'Booking not found'}, status=404)
 
-        response_data = {
-            'booking_id': booking.id,
-            'status': booking.status,
-            'pickup': {
-                'address': booking.pickup_location,
-                'latitude': float(booking.pickup_latitude) if booking.pickup_latitude else None,
-                'longitude': float(booking.pickup_longitude) if booking.pickup_longitude else None,
-            },
-            'destination': {
-                'address': booking.destination,
-                'latitude': float(booking.destination_latitude) if booking.destination_latitude else None,
-                'longitude': float(booking.destination_longitude) if booking.destination_longitude else None,
-            },
-        }
+        return Response(trip_tracking.snapshot(booking))
 
-        if booking.driver:
-            response_data['driver_location'] = {
-                'latitude': float(booking.driver.current_latitude) if booking.driver.current_latitude else None,
-                'longitude': float(booking.driver.current_longitude) if booking.driver.current_longitude else None,
-            }
-            response_data['driver'] = {
-                'id': booking.driver.id,
-                'name': booking.driver.full_name,
-                'phone': booking.driver.phone,
-                'vehicle_type': booking.driver.vehicle_type,
-                'vehicle_number': booking.driver.vehicle_number or 'MOV-0000',
-                'rating': float(booking.driver.rating) if booking.driver.rating else 5.0,
-            }
 
-        return Response(response_data)
+class BookingTrailAPIView(APIView):
+    """
+    Stream the recorded path of a booking as newline-delimited JSON,
+    one {"t", "lat", "lon"} object per point, oldest first.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, booking_id):
+        if not Booking.objects.filter(id=booking_id).exists():
+            return Response({'error': 'Booking not found'}, status=404)
+
+        lines = (
+            json.dumps({'t': recorded_at.isoformat(), 'lat': lat, 'lon': lon}) + '\n'
+            for recorded_at, lat, lon in trip_trail.iter_trail(booking_id)
+        )
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
 
 
 # ============================================================
@@ -1281,17 +1311,15 @@ class AssignNearestDriverAPIView(APIView):
         if not booking.pickup_latitude or not booking.pickup_longitude:
             return Response({'error': 'Pickup coordinates required'}, status=400)
 
-        available_drivers = Driver.objects.filter(
-            is_online=True,
+        available_drivers = location_store.apply_to(Driver.objects.filter(
+            availability__state='idle',
             is_approved=True,
             is_active=True,
             current_latitude__isnull=False,
             current_longitude__isnull=False
-        ).exclude(
-            bookings__status__in=['driver_assigned', 'picked_up', 'driver_arrived']
-        )
+        ))
 
-        if not available_drivers.exists():
+        if not available_drivers:
             booking.status = 'searching_driver'
             booking.save()
             return Response({'message': 'No drivers available at the moment', 'status': 'searching_driver'}, status=202)
@@ -1311,9 +1339,12 @@ class AssignNearestDriverAPIView(APIView):
         if not nearest_driver:
             return Response({'error': 'No suitable driver found'}, status=404)
 
+        if not driver_state.mark_on_trip(nearest_driver.id):
+            return Response({'error': 'The nearest driver was just taken, please retry'}, status=409)
         booking.driver = nearest_driver
         booking.status = 'driver_assigned'
         booking.save()
+        trip_trail.start_trip(booking.id, nearest_driver.id)
 
         if booking.customer:
             notify_customer_push(
@@ -1342,9 +1373,10 @@ class UpdateDriverLocationAPIView(APIView):
     permission_classes = [AllowAny]
 
     def patch(self, request, driver_id):
-        try:
-            driver = Driver.objects.get(id=driver_id)
-        except Driver.DoesNotExist:
+        # Only the flags the spatial index needs; the fix itself goes to the
+        # live location store and is persisted by its write-behind flush
+        flags = Driver.objects.filter(id=driver_id).values_list('is_online', 'is_approved').first()
+        if flags is None:
             return Response({'error': 'Driver not found'}, status=404)
 
         latitude = request.data.get('latitude')
@@ -1353,18 +1385,89 @@ class UpdateDriverLocationAPIView(APIView):
         if latitude is None or longitude is None:
             return Response({'error': 'Latitude and longitude required'}, status=400)
 
-        driver.current_latitude = latitude
-        driver.current_longitude = longitude
-        driver.location_updated_at = timezone.now()
-        driver.save()
+        try:
+            lat, lon, _ = location_store.parse_fix({'latitude': latitude, 'longitude': longitude})
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        location_store.record(driver_id, lat, lon)
+        is_online, is_approved = flags
+        if is_online and is_approved:
+            driver_index.update(driver_id, lat, lon)
 
         return Response({
             'message': 'Location updated successfully',
-            'latitude': driver.current_latitude,
-            'longitude': driver.current_longitude
+            'latitude': latitude,
+            'longitude': longitude,
+            # When and how far to move before the device should report again
+            'next_update': location_cadence.recommend(driver_id, lat, lon),
         })
 
 
+class DriverLocationBatchAPIView(APIView):
+    """
+    Upload fixes a driver device buffered while offline, in one request.
+    Body: {"fixes": [{"latitude", "longitude", "timestamp"}, ...]}
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request, driver_id):
+        flags = Driver.objects.filter(id=driver_id).values_list('is_online', 'is_approved').first()
+        if flags is None:
+            return Response({'error': 'Driver not found'}, status=404)
+
+        fixes = request.data.get('fixes')
+        if not isinstance(fixes, list) or not fixes:
+            return Response({'error': 'fixes must be a non-empty list'}, status=400)
+
+        result = location_store.ingest_batch(driver_id, fixes)
+
+        applied = result['applied']
+        is_online, is_approved = flags
+        if applied and is_online and is_approved:
+            driver_index.update(driver_id, applied[0], applied[1])
+
+        return Response({
+            'message': 'Fixes received',
+            'accepted': result['accepted'],
+            'discarded': result['discarded'],
+            'position_updated': applied is not None,
+            'next_update': location_cadence.recommend(
+                driver_id,
+                *(applied[:2] if applied else (None, None))
+            ),
+        })
+
+
+class NearbyVehiclesAPIView(APIView):
+    """
+    Free vehicles around the customer for the home-screen map.
+    Query params: lat, lon. Answers are shared per map tile for a few seconds.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            lat, lon, _ = location_store.parse_fix({
+                'latitude': request.query_params.get('lat'),
+                'longitude': request.query_params.get('lon'),
+            })
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        return Response(nearby_vehicles.nearby_vehicles(lat, lon))
+
+
+class LocationIngestStatsAPIView(APIView):
+    """
+    Driver location ingest rate, for monitoring the effect of adaptive cadence.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(location_cadence.ingest_stats())
+
+
 # ============================================================
 # SERVICE BOOKINGS
 # ============================================================
@@ -1405,18 +1508,19 @@ class ChatSendMessageAPIView(APIView):
         if not booking_id or not sender_type or not message:
             return Response({'error': 'booking_id, sender_type, and message are required'}, status=400)
 
-        try:
-            booking = Booking.objects.get(id=booking_id)
-        except Booking.DoesNotExist:
+        if not Booking.objects.filter(id=booking_id).exists():
             return Response({'error': 'Booking not found'}, status=404)
 
-        chat_message = ChatMessage.objects.create(
-            booking=booking,
-            sender_type=sender_type,
-            sender_customer_id=sender_customer_id if sender_type == 'customer' else None,
-            sender_driver_id=sender_driver_id if sender_type == 'driver' else None,
-            message=message
-        )
+        # Stored and pushed to the booking's chat socket group in one step
+        try:
+            chat_message = chat_service.send_message(
+                booking_id,
+                sender_type,
+                sender_customer_id if sender_type == 'customer' else sender_driver_id,
+                message
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
 
         serializer = ChatMessageSerializer(chat_message)
         return Response(serializer.data, status=201)
@@ -1431,7 +1535,17 @@ class ChatMessagesAPIView(APIView):
         except Booking.DoesNotExist:
             return Response({'error': 'Booking not found'}, status=404)
 
-        messages = ChatMessage.objects.filter(booking=booking).order_by('created_at')
+        # ?after_id=<last message id seen> returns only newer messages
+        after_id = request.query_params.get('after_id')
+        if after_id is not None:
+            try:
+                messages = chat_service.messages_after(booking.id, int(after_id))
+            except ValueError:
+                return Response({'error': 'after_id must be a message id'}, status=400)
+        else:
+            messages = ChatMessage.objects.filter(booking=booking).select_related(
+                'sender_customer', 'sender_driver'
+            ).order_by('created_at')
         serializer = ChatMessageSerializer(messages, many=True)
         return Response(serializer.data)
 
@@ -1444,25 +1558,21 @@ class ChatMarkReadAPIView(APIView):
         if not message_ids:
             return Response({'error': 'message_ids array is required'}, status=400)
 
-        ChatMessage.objects.filter(id__in=message_ids).update(is_read=True)
-        return Response({'message': 'Messages marked as read'})
+        marked = chat_service.mark_read_ids(message_ids)
+        return Response({'message': 'Messages marked as read', 'marked': marked})
 
 
 class ChatUnreadCountAPIView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request, booking_id):
-        try:
-            booking = Booking.objects.get(id=booking_id)
-        except Booking.DoesNotExist:
-            return Response({'error': 'Booking not found'}, status=404)
-
         receiver_type = request.query_params.get('receiver_type')  # customer / driver
-        if receiver_type == 'customer':
-            unread_count = ChatMessage.objects.filter(booking=booking, sender_type='driver', is_read=False).count()
-        elif receiver_type == 'driver':
-            unread_count = ChatMessage.objects.filter(booking=booking, sender_type='customer', is_read=False).count()
-        else:
+        if receiver_type not in chat_service.SENDER_TYPES:
             return Response({'error': 'receiver_type (customer or driver) is required'}, status=400)
 
+        # Maintained on send/mark-read; also pushed as chat_unread frames
+        unread_count = chat_service.unread_count(booking_id, receiver_type)
+        if unread_count is None:
+            return Response({'error': 'Booking not found'}, status=404)
+
         return Response({'unread_count': unread_count})
@@ -0,0 +1,298 @@
+"""
+Batch Dispatch
+
+Global matching mode for busy periods. Instead of each booking greedily
+taking its best driver, a cycle collects every 'searching_driver' booking
+without a pending offer plus the idle drivers around them, and solves a
+min-cost assignment over the score matrix (cost = -score). Offers for the
+whole cycle are created with a single bulk insert.
+
+When service zones are configured the cycle is partitioned by zone: a
+booking only considers drivers in its pickup zone, and each zone's
+assignment is solved separately, which keeps the matrices small.
+
+Enabled with settings.DISPATCH_BATCH_MODE and driven by
+`python manage.py run_batch_dispatch`.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+import logging
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import dispatch_service
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # pragma: no cover - depends on the deployment
+    linear_sum_assignment = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_BOOKINGS_PER_CYCLE = 200       # Oldest bookings first; the rest wait a cycle
+CANDIDATES_PER_BOOKING = 5         # Best drivers per booking that enter the matrix
+
+
+def solve_assignment(cost):
+    """
+    Solve a rectangular min-cost assignment (Hungarian algorithm).
+    cost is a list of rows; every row and column is used at most once and
+    min(rows, cols) pairs are returned.
+
+    Uses scipy when installed, otherwise a pure-Python O(n^2 * m) version.
+
+    Returns: sorted list of (row, col) pairs
+    """
+    if not cost or not cost[0]:
+        return []
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(cost)
+        return sorted(zip(rows.tolist(), cols.tolist()))
+
+    transposed = len(cost) > len(cost[0])
+    if transposed:
+        cost = [list(column) for column in zip(*cost)]
+    n, m = len(cost), len(cost[0])
+
+    # Shortest augmenting path with row/column potentials (1-indexed)
+    INF = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match = [0] * (m + 1)   # match[col] = row assigned to col
+    way = [0] * (m + 1)
+
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        min_slack = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[col0] = True
+            row0 = match[col0]
+            delta = INF
+            col1 = 0
+            for col in range(1, m + 1):
+                if not used[col]:
+                    slack = cost[row0 - 1][col - 1] - u[row0] - v[col]
+                    if slack < min_slack[col]:
+                        min_slack[col] = slack
+                        way[col] = col0
+                    if min_slack[col] < delta:
+                        delta = min_slack[col]
+                        col1 = col
+            for col in range(m + 1):
+                if used[col]:
+                    u[match[col]] += delta
+                    v[col] -= delta
+                else:
+                    min_slack[col] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+
+    pairs = [(match[col] - 1, col - 1) for col in range(1, m + 1) if match[col]]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted(pairs)
+
+
+def collect_pending_bookings(booking_ids=None):
+    """
+    Bookings still searching for a driver that have no live offer,
+    optionally limited to booking_ids.
+    """
+    from .models import Booking
+
+    bookings = Booking.objects.filter(
+        status='searching_driver',
+        pickup_latitude__isnull=False,
+        pickup_longitude__isnull=False
+    )
+    if booking_ids is not None:
+        bookings = bookings.filter(id__in=booking_ids)
+    return list(
+        bookings
+        .exclude(ride_offers__status='pending')
+        .select_related('customer')
+        .order_by('created_at')[:MAX_BOOKINGS_PER_CYCLE]
+    )
+
+
+def run_batch_cycle(booking_ids=None):
+    """
+    Run one batch dispatch cycle, over every pending booking or only the
+    given booking_ids (the dispatch simulator's own bookings).
+
+    Returns: list of RideOffers created in this cycle
+    """
+    from .models import Booking, Driver, RideOffer
+    from .spatial_index import find_nearby_driver_ids
+    from . import driver_state, location_store, offer_push, zone_index
+
+    dispatch_service.expire_pending_offers()
+
+    bookings = collect_pending_bookings(booking_ids)
+    if not bookings:
+        return []
+    booking_ids = [booking.id for booking in bookings]
+
+    # Offers already made per booking (for exclusions and offer_order)
+    offered_pairs = set(
+        RideOffer.objects.filter(booking_id__in=booking_ids)
+        .values_list('booking_id', 'driver_id')
+    )
+    offer_counts = {}
+    for booking_id, _ in offered_pairs:
+        offer_counts[booking_id] = offer_counts.get(booking_id, 0) + 1
+
+    exhausted = [
+        booking_id for booking_id in booking_ids
+        if offer_counts.get(booking_id, 0) >= dispatch_service.MAX_OFFERS_PER_BOOKING
+    ]
+    if exhausted:
+        Booking.objects.filter(id__in=exhausted).update(status='no_driver_found')
+        bookings = [booking for booking in bookings if booking.id not in exhausted]
+
+    # Idle drivers near any of the bookings
+    nearby_ids = set()
+    for booking in bookings:
+        nearby_ids |= find_nearby_driver_ids(
+            booking.pickup_latitude,
+            booking.pickup_longitude,
+            dispatch_service.MAX_SEARCH_RADIUS_KM
+        )
+
+    drivers = location_store.apply_to(Driver.objects.filter(
+        id__in=nearby_ids,
+        availability__state='idle',
+        is_approved=True,
+        current_latitude__isnull=False,
+        current_longitude__isnull=False
+    )) if nearby_ids else []
+    stats_by_driver = dispatch_service.load_driver_stats(driver.id for driver in drivers)
+
+    # Zone partitions (everything shares partition None when no zones exist)
+    partitioned = zone_index.has_zones()
+    booking_zones = {booking.id: None for booking in bookings}
+    driver_zones = {driver.id: None for driver in drivers}
+    if partitioned:
+        for booking in bookings:
+            booking_zones[booking.id] = booking.service_zone_id or zone_index.zone_for(
+                booking.pickup_latitude, booking.pickup_longitude
+            )
+        driver_zones = dict(zip(
+            (driver.id for driver in drivers),
+            zone_index.zones_for_points((driver.current_latitude, driver.current_longitude) for driver in drivers)
+        ))
+
+    # Best few candidates per booking become the matrix entries
+    candidates = {}
+    for booking in bookings:
+        eligible = [
+            driver for driver in drivers
+            if (booking.id, driver.id) not in offered_pairs
+            and driver_zones[driver.id] == booking_zones[booking.id]
+        ]
+        candidates[booking.id] = {
+            driver.id: (driver, score, distance_km)
+            for driver, score, distance_km in dispatch_service.score_drivers(
+                eligible,
+                stats_by_driver,
+                booking.pickup_latitude,
+                booking.pickup_longitude,
+                limit=CANDIDATES_PER_BOOKING
+            )
+        }
+
+    no_candidates = [
+        booking.id for booking in bookings
+        if not candidates[booking.id] and offer_counts.get(booking.id, 0) > 0
+    ]
+    if no_candidates:
+        Booking.objects.filter(id__in=no_candidates).update(status='no_driver_found')
+
+    bookings = [booking for booking in bookings if candidates[booking.id]]
+    if not bookings:
+        return []
+
+    partitions = {}
+    for booking in bookings:
+        partitions.setdefault(booking_zones[booking.id], []).append(booking)
+
+    expires_at = timezone.now() + timedelta(seconds=dispatch_service.OFFER_TIMEOUT_SECONDS)
+    offers = []
+    column_count = 0
+    for zone_bookings in partitions.values():
+        column_ids = sorted({
+            driver_id for booking in zone_bookings for driver_id in candidates[booking.id]
+        })
+        column_count += len(column_ids)
+
+        # Maximize total score; pairs that are not candidates cost 0 and are dropped
+        cost = [
+            [
+                -candidates[booking.id][driver_id][1] if driver_id in candidates[booking.id] else 0.0
+                for driver_id in column_ids
+            ]
+            for booking in zone_bookings
+        ]
+
+        for row, col in solve_assignment(cost):
+            booking = zone_bookings[row]
+            match = candidates[booking.id].get(column_ids[col])
+            if match is None:
+                continue
+            driver, score, distance_km = match
+            offers.append(RideOffer(
+                booking=booking,
+                driver=driver,
+                driver_score=Decimal(str(score)) if score else None,
+                distance_km=Decimal(str(distance_km)) if distance_km else None,
+                offer_order=offer_counts.get(booking.id, 0) + 1,
+                status='pending',
+                expires_at=expires_at
+            ))
+
+    # Claim each driver (idle -> offered) and insert the offers in one
+    # transaction; a driver taken by a sequential dispatch since the
+    # candidates were loaded waits for the next cycle. If a concurrent
+    # dispatch inserted a pending offer for one of these drivers or booking
+    # slots meanwhile, the rollback releases every claim and the offers are
+    # created one by one, skipping the conflicting ones.
+    planned = offers
+    try:
+        with transaction.atomic():
+            offers = [offer for offer in planned if driver_state.mark_offered([offer.driver_id])]
+            RideOffer.objects.bulk_create(offers)
+    except IntegrityError:
+        logger.info("Batch dispatch: bulk insert hit a concurrent offer; creating offers one by one")
+        offers = [
+            offer for offer in (
+                dispatch_service.create_ride_offer(
+                    planned_offer.booking,
+                    planned_offer.driver,
+                    score=planned_offer.driver_score,
+                    distance_km=planned_offer.distance_km,
+                    offer_order=planned_offer.offer_order
+                )
+                for planned_offer in planned
+            )
+            if offer is not None
+        ]
+    else:
+        offer_push.push_offers(offers)
+
+    logger.info(
+        f"Batch dispatch: {len(offers)} offer(s) for {len(bookings)} booking(s) "
+        f"across {column_count} candidate driver(s) in {len(partitions)} partition(s)"
+    )
+
+    return offers
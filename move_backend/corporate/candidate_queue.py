@@ -0,0 +1,94 @@
+"""
+Ranked Candidate Queue
+
+Keeps the ranked driver list computed for a booking so follow-up offers
+(after a decline or expiry) can pop the next driver instead of re-scoring
+the whole fleet.
+
+A queue is thrown away and the booking re-ranked when:
+- it is older than CANDIDATE_QUEUE_TTL_SECONDS, or
+- the next driver has moved more than CANDIDATE_MOVE_THRESHOLD_KM since ranking.
+
+Queues live in the Django cache, because the follow-ups run elsewhere than
+the ranking: the dispatch worker ranks, declines are handled by web workers
+and expiries by run_offer_scheduler. With a process-local cache each of them
+only sees its own queues and re-ranks from scratch. Two processes popping
+the same queue at once can both get the same driver; the offer claim in
+dispatch_service.create_ride_offer lets only one of them offer the ride.
+"""
+
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CANDIDATE_QUEUE_TTL_SECONDS = 60      # Re-rank after this long regardless
+CANDIDATE_MOVE_THRESHOLD_KM = 0.5     # Re-rank if a candidate moved further than this
+CACHE_KEY_PREFIX = 'candidate_queue:'
+
+
+def _key(booking_id):
+    return f"{CACHE_KEY_PREFIX}{booking_id}"
+
+
+def store(booking_id, scored_drivers):
+    """
+    Keep the ranked (driver, score, distance_km) list for a booking.
+    The queue expires CANDIDATE_QUEUE_TTL_SECONDS after ranking.
+    """
+    entries = [
+        (driver.id, score, distance_km, float(driver.current_latitude), float(driver.current_longitude))
+        for driver, score, distance_km in scored_drivers
+    ]
+    if not entries:
+        discard(booking_id)
+        return
+    cache.set(_key(booking_id), (time.time(), entries), CANDIDATE_QUEUE_TTL_SECONDS)
+
+
+def discard(booking_id):
+    cache.delete(_key(booking_id))
+
+
+def pop_next(booking_id, excluded_driver_ids=()):
+    """
+    Pop the next usable candidate for a booking.
+
+    Skips excluded drivers. If the queue is missing, expired, empty, or the
+    next driver moved past the threshold according to the live location
+    store, the queue is dropped and None is returned so the caller re-ranks.
+    Whether the driver is still free is left to the caller.
+
+    Returns: (driver_id, score, distance_km) or None
+    """
+    from .dispatch_service import haversine_distance
+    from . import location_store
+
+    key = _key(booking_id)
+    queue = cache.get(key)
+    if queue is None:
+        return None
+    built_at, entries = queue
+
+    while entries:
+        driver_id, score, distance_km, lat, lon = entries.pop(0)
+        if driver_id in excluded_driver_ids:
+            continue
+
+        fix = location_store.get(driver_id)
+        if fix and haversine_distance(lat, lon, fix[0], fix[1]) > CANDIDATE_MOVE_THRESHOLD_KM:
+            logger.debug(f"Driver #{driver_id} moved since booking #{booking_id} was ranked")
+            break
+
+        remaining = CANDIDATE_QUEUE_TTL_SECONDS - (time.time() - built_at)
+        if entries and remaining >= 1:
+            cache.set(key, (built_at, entries), int(remaining))
+        else:
+            cache.delete(key)
+        return driver_id, score, distance_km
+
+    cache.delete(key)
+    return None
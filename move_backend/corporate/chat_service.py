@@ -0,0 +1,258 @@
+"""
+Booking Chat
+
+Persists chat messages and fans them out to the booking's chat_<booking_id>
+Channels group in one step, so the other party receives them on the socket
+instead of re-downloading the conversation.
+
+- send_message() stores the ChatMessage and, once the transaction commits,
+  broadcasts it to everyone connected to the booking's chat. Both the REST
+  send endpoint and ChatConsumer go through it.
+- Receipts are watermarks: "everything the other party sent up to message
+  id N was delivered/read". One UPDATE marks the whole range and one
+  chat_receipt frame tells the sender.
+- messages_after() lets a (re)connecting client fetch only what it has not
+  seen yet.
+- Unread counts per booking and reader are kept in the cache, incremented
+  on send and decremented by exactly the rows a mark-read changed, and
+  pushed to the reader's customer_<id>/driver_<id> group as
+  {"type": "chat_unread", "booking_id", "unread_count"}. A missing counter
+  is rebuilt with one COUNT; the TTL bounds any drift.
+
+Frames sent to the group (handled by ChatConsumer):
+    {"type": "chat_message", "message": {...serialized ChatMessage...}, "client_id"?}
+    {"type": "chat_receipt", "booking_id", "receipt": "delivered" | "read",
+     "reader": "customer" | "driver", "up_to_id"}
+"""
+
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_MESSAGE_LENGTH = 2000
+HISTORY_PAGE_SIZE = 200
+SENDER_TYPES = ('customer', 'driver')
+UNREAD_TTL_SECONDS = 60 * 60
+UNREAD_CACHE_KEY_PREFIX = 'chat_unread:'
+
+
+def group_name(booking_id):
+    return f"chat_{booking_id}"
+
+
+def other_party(sender_type):
+    return 'driver' if sender_type == 'customer' else 'customer'
+
+
+def _broadcast(booking_id, data):
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            group_name(booking_id),
+            {"type": "chat_event", "data": data}
+        )
+    except Exception as e:
+        logger.error(f"Chat broadcast for booking #{booking_id} failed: {e}")
+
+
+def validate_message(text):
+    """
+    Returns: the message text, stripped
+    Raises: ValueError with a client-facing message
+    """
+    text = (text or '').strip() if isinstance(text, str) else ''
+    if not text:
+        raise ValueError('message is required')
+    if len(text) > MAX_MESSAGE_LENGTH:
+        raise ValueError(f"message is longer than {MAX_MESSAGE_LENGTH} characters")
+    return text
+
+
+def send_message(booking_id, sender_type, sender_id, text, client_id=None):
+    """
+    Store a message and broadcast it to the booking's chat group.
+    Returns: the ChatMessage
+    Raises: ValueError for an invalid sender type or message
+    """
+    from .models import ChatMessage
+    from .serializers import ChatMessageSerializer
+
+    if sender_type not in SENDER_TYPES:
+        raise ValueError('sender_type must be customer or driver')
+    text = validate_message(text)
+
+    chat_message = ChatMessage.objects.create(
+        booking_id=booking_id,
+        sender_type=sender_type,
+        sender_customer_id=sender_id if sender_type == 'customer' else None,
+        sender_driver_id=sender_id if sender_type == 'driver' else None,
+        message=text
+    )
+
+    data = {"type": "chat_message", "message": dict(ChatMessageSerializer(chat_message).data)}
+    if client_id is not None:
+        data["client_id"] = client_id  # Lets the sender match its optimistic copy
+    transaction.on_commit(lambda: _broadcast(booking_id, data))
+    transaction.on_commit(lambda: _change_unread(booking_id, other_party(sender_type), 1))
+    return chat_message
+
+
+def _mark(booking_id, reader_type, up_to_id, receipt):
+    from .models import ChatMessage
+
+    now = timezone.now()
+    messages = ChatMessage.objects.filter(
+        booking_id=booking_id,
+        sender_type=other_party(reader_type),
+        id__lte=up_to_id
+    )
+    if receipt == 'read':
+        # Reading implies delivery
+        messages.filter(delivered_at__isnull=True).update(delivered_at=now)
+        updated = messages.filter(read_at__isnull=True).update(read_at=now, is_read=True)
+        if updated:
+            transaction.on_commit(lambda: _change_unread(booking_id, reader_type, -updated))
+    else:
+        updated = messages.filter(delivered_at__isnull=True).update(delivered_at=now)
+
+    if updated:
+        data = {
+            "type": "chat_receipt",
+            "booking_id": booking_id,
+            "receipt": receipt,
+            "reader": reader_type,
+            "up_to_id": up_to_id,
+        }
+        transaction.on_commit(lambda: _broadcast(booking_id, data))
+    return updated
+
+
+def mark_delivered(booking_id, reader_type, up_to_id):
+    """
+    Mark the other party's messages up to `up_to_id` as delivered to `reader_type`.
+    Returns: number of messages newly marked
+    """
+    return _mark(booking_id, reader_type, up_to_id, 'delivered')
+
+
+def mark_read(booking_id, reader_type, up_to_id):
+    """
+    Mark the other party's messages up to `up_to_id` as read by `reader_type`.
+    Returns: number of messages newly marked
+    """
+    return _mark(booking_id, reader_type, up_to_id, 'read')
+
+
+def messages_after(booking_id, after_id=0, limit=HISTORY_PAGE_SIZE):
+    """Messages of a booking newer than `after_id`, oldest first."""
+    from .models import ChatMessage
+
+    return list(
+        ChatMessage.objects.filter(booking_id=booking_id, id__gt=after_id)
+        .select_related('sender_customer', 'sender_driver')
+        .order_by('id')[:limit]
+    )
+
+
+def mark_read_ids(message_ids):
+    """
+    Mark arbitrary messages read (legacy REST endpoint), keeping the unread
+    counters of every affected booking in step.
+    Returns: number of messages newly marked
+    """
+    from .models import ChatMessage
+
+    unread = ChatMessage.objects.filter(id__in=message_ids, is_read=False)
+    total = 0
+    for booking_id, sender_type in set(unread.values_list('booking_id', 'sender_type')):
+        # The UPDATE's row count is exact even if another request marks the same rows
+        updated = unread.filter(booking_id=booking_id, sender_type=sender_type).update(
+            is_read=True, read_at=timezone.now()
+        )
+        if updated:
+            reader_type = other_party(sender_type)
+            transaction.on_commit(lambda b=booking_id, r=reader_type, n=updated: _change_unread(b, r, -n))
+            total += updated
+    return total
+
+
+# ------------------------------------------------------------
+# Unread counters
+# ------------------------------------------------------------
+
+def _unread_key(booking_id, reader_type):
+    return f"{UNREAD_CACHE_KEY_PREFIX}{booking_id}:{reader_type}"
+
+
+def _count_unread(booking_id, reader_type):
+    from .models import Booking, ChatMessage
+
+    if not Booking.objects.filter(id=booking_id).exists():
+        return None
+    count = ChatMessage.objects.filter(
+        booking_id=booking_id, sender_type=other_party(reader_type), is_read=False
+    ).count()
+    cache.set(_unread_key(booking_id, reader_type), count, UNREAD_TTL_SECONDS)
+    return count
+
+
+def unread_count(booking_id, reader_type):
+    """
+    Unread messages for `reader_type` in a booking, from the cache.
+    Returns: the count, or None if the booking does not exist
+    """
+    count = cache.get(_unread_key(booking_id, reader_type))
+    return _count_unread(booking_id, reader_type) if count is None else max(0, count)
+
+
+def _change_unread(booking_id, reader_type, delta):
+    key = _unread_key(booking_id, reader_type)
+    try:
+        count = cache.incr(key, delta)
+    except ValueError:
+        count = _count_unread(booking_id, reader_type)  # Already includes this change
+    else:
+        if count < 0:
+            count = _count_unread(booking_id, reader_type)
+    if count is not None:
+        _push_unread(booking_id, reader_type, count)
+
+
+def _push_unread(booking_id, reader_type, count):
+    from .models import Booking
+
+    parties = Booking.objects.filter(id=booking_id).values_list('customer_id', 'driver_id').first()
+    reader_id = parties and (parties[0] if reader_type == 'customer' else parties[1])
+    if not reader_id:
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"{reader_type}_{reader_id}",
+            {
+                "type": "send_ride_notification",
+                "data": {"type": "chat_unread", "booking_id": booking_id, "unread_count": count},
+            }
+        )
+    except Exception as e:
+        logger.error(f"Unread count push for booking #{booking_id} failed: {e}")
+
+
+def participant_type(booking_id, user):
+    """
+    The side `user` is on in a booking's chat.
+    Returns: 'customer', 'driver', or None if the user is not part of the booking
+    """
+    from .models import Booking
+
+    parties = Booking.objects.filter(id=booking_id).values_list('customer_id', 'driver_id').first()
+    if parties is None:
+        return None
+    if hasattr(user, 'is_online'):
+        return 'driver' if parties[1] == user.id else None
+    return 'customer' if parties[0] == user.id else None
@@ -0,0 +1,174 @@
+"""
+Dispatch Queue
+
+Moves dispatch out of the booking-create request. Creating a booking only
+inserts a DispatchJob; a dedicated worker (`manage.py run_dispatch_worker`)
+claims queued jobs and runs dispatch for them.
+
+- Jobs are claimed one by one with a conditional update, so several workers
+  can consume the same queue.
+- Jobs stuck in 'processing' longer than STALE_JOB_SECONDS (worker died)
+  are put back in the queue, up to MAX_ATTEMPTS.
+- queue_stats() exposes queue depth and lag for monitoring.
+- Finished jobs are pruned by the worker: 'done' jobs after
+  DONE_RETENTION_HOURS, 'failed' ones (kept for inspection) after
+  FAILED_RETENTION_DAYS.
+"""
+
+from datetime import timedelta
+import logging
+import time
+
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import dispatch_service
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WORKER_POLL_SECONDS = 0.5    # Idle wait between polls when the queue is empty
+WORKER_BATCH_SIZE = 20       # Jobs claimed per poll
+STALE_JOB_SECONDS = 60       # Requeue jobs a worker claimed but never finished
+MAX_ATTEMPTS = 3
+DONE_RETENTION_HOURS = 24
+FAILED_RETENTION_DAYS = 7
+PRUNE_INTERVAL_SECONDS = 10 * 60
+PRUNE_BATCH_SIZE = 1000      # Rows deleted per statement
+
+
+def enqueue_dispatch(booking):
+    """Queue a booking for the dispatch worker."""
+    from .models import DispatchJob
+
+    job = DispatchJob.objects.create(booking=booking)
+    logger.info(f"Queued dispatch job #{job.id} for booking #{booking.id}")
+    return job
+
+
+def claim_jobs(limit=WORKER_BATCH_SIZE):
+    """
+    Claim up to `limit` queued jobs, oldest first.
+    Returns: list of claimed DispatchJobs
+    """
+    from .models import DispatchJob
+
+    candidate_ids = list(
+        DispatchJob.objects.filter(status='queued')
+        .order_by('enqueued_at')
+        .values_list('id', flat=True)[:limit]
+    )
+
+    claimed_ids = []
+    now = timezone.now()
+    for job_id in candidate_ids:
+        # Another worker may have claimed it in the meantime
+        if DispatchJob.objects.filter(id=job_id, status='queued').update(
+            status='processing',
+            started_at=now,
+            attempts=F('attempts') + 1
+        ):
+            claimed_ids.append(job_id)
+
+    return list(DispatchJob.objects.filter(id__in=claimed_ids).select_related('booking'))
+
+
+def process_job(job):
+    """Dispatch the job's booking if it is still looking for a driver."""
+    from .models import DispatchJob
+
+    booking = job.booking
+    try:
+        if booking.status == 'searching_driver':
+            offer = dispatch_service.request_dispatch(booking)
+            if offer:
+                logger.info(f"Booking #{booking.id} - Offer sent to driver #{offer.driver_id}")
+            elif not dispatch_service.is_batch_mode():
+                logger.warning(f"Booking #{booking.id} - No available drivers found")
+        DispatchJob.objects.filter(id=job.id).update(status='done', finished_at=timezone.now())
+    except Exception as e:
+        logger.error(f"Booking #{booking.id} - Dispatch error: {str(e)}")
+        DispatchJob.objects.filter(id=job.id).update(
+            status='queued' if job.attempts < MAX_ATTEMPTS else 'failed',
+            error=str(e),
+            finished_at=timezone.now()
+        )
+
+
+def requeue_stale_jobs():
+    """Put jobs whose worker disappeared back in the queue."""
+    from .models import DispatchJob
+
+    cutoff = timezone.now() - timedelta(seconds=STALE_JOB_SECONDS)
+    stale = DispatchJob.objects.filter(status='processing', started_at__lt=cutoff)
+    requeued = stale.filter(attempts__lt=MAX_ATTEMPTS).update(status='queued')
+    failed = stale.update(status='failed', error='Worker did not finish the job')
+
+    if requeued or failed:
+        logger.warning(f"Requeued {requeued} and failed {failed} stale dispatch job(s)")
+    return requeued
+
+
+def prune_finished_jobs(done_hours=DONE_RETENTION_HOURS, failed_days=FAILED_RETENTION_DAYS):
+    """
+    Delete finished jobs past their retention, PRUNE_BATCH_SIZE rows at a
+    time so the table is never locked for long.
+    Returns: number of jobs deleted
+    """
+    from .models import DispatchJob
+
+    now = timezone.now()
+    expired = (
+        DispatchJob.objects.filter(status='done', finished_at__lt=now - timedelta(hours=done_hours))
+        | DispatchJob.objects.filter(status='failed', enqueued_at__lt=now - timedelta(days=failed_days))
+    )
+
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:PRUNE_BATCH_SIZE])
+        if not ids:
+            break
+        deleted += DispatchJob.objects.filter(id__in=ids).delete()[0]
+
+    if deleted:
+        logger.info(f"Pruned {deleted} finished dispatch job(s)")
+    return deleted
+
+
+def queue_stats():
+    """
+    Snapshot of the dispatch queue for monitoring.
+    Returns: dict with queue depth, in-flight and failed counts, and the age
+    of the oldest queued job in seconds.
+    """
+    from .models import DispatchJob
+
+    queued = DispatchJob.objects.filter(status='queued')
+    oldest = queued.aggregate(oldest=Min('enqueued_at'))['oldest']
+
+    return {
+        'queued': queued.count(),
+        'processing': DispatchJob.objects.filter(status='processing').count(),
+        'failed': DispatchJob.objects.filter(status='failed').count(),
+        'oldest_queued_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0,
+    }
+
+
+def run_worker(poll_interval=WORKER_POLL_SECONDS, batch_size=WORKER_BATCH_SIZE):
+    """Consume the dispatch queue forever."""
+    last_stale_check = 0
+    last_prune = 0
+    while True:
+        if time.monotonic() - last_stale_check > STALE_JOB_SECONDS:
+            requeue_stale_jobs()
+            last_stale_check = time.monotonic()
+        if time.monotonic() - last_prune > PRUNE_INTERVAL_SECONDS:
+            prune_finished_jobs()
+            last_prune = time.monotonic()
+
+        jobs = claim_jobs(batch_size)
+        for job in jobs:
+            process_job(job)
+
+        if not jobs:
+            time.sleep(poll_interval)
@@ -12,10 +12,15 @@ Flow:
 4. If driver accepts -> assign driver to booking
 5. If driver declines or timeout -> mark offer as declined/expired, try next driver
 6. If no drivers available -> booking status becomes 'no_driver_found'
+
+With settings.DISPATCH_BATCH_MODE enabled, bookings are not dispatched one at
+a time. They wait for the next cycle of corporate.batch_dispatch, which
+matches all pending bookings to free drivers at once.
 """
 
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Q, Avg, Count
+from django.db.models import Q, Avg, Count, Max
 from datetime import timedelta
 from decimal import Decimal
 from math import radians, cos, sin, asin, sqrt
@@ -50,7 +55,54 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     return c * r
 
 
-def calculate_driver_score(driver, pickup_lat, pickup_lon):
+def load_driver_stats(driver_ids):
+    """
+    Load the per-driver numbers used by the scorer for a whole candidate set
+    in two grouped queries instead of three queries per driver.
+    
+    Returns: dict of driver_id -> {
+        'total_offers': offers in the last 7 days,
+        'accepted_offers': accepted offers in the last 7 days,
+        'last_completed_at': completion time of the latest ride (or None),
+    }
+    """
+    from .models import RideOffer, Booking
+    
+    driver_ids = list(driver_ids)
+    stats = {
+        driver_id: {'total_offers': 0, 'accepted_offers': 0, 'last_completed_at': None}
+        for driver_id in driver_ids
+    }
+    if not driver_ids:
+        return stats
+    
+    offer_counts = (
+        RideOffer.objects.filter(
+            driver_id__in=driver_ids,
+            offered_at__gte=timezone.now() - timedelta(days=7)
+        )
+        .values('driver_id')
+        .annotate(
+            total=Count('id'),
+            accepted=Count('id', filter=Q(status='accepted'))
+        )
+    )
+    for row in offer_counts:
+        stats[row['driver_id']]['total_offers'] = row['total']
+        stats[row['driver_id']]['accepted_offers'] = row['accepted']
+    
+    last_completed = (
+        Booking.objects.filter(driver_id__in=driver_ids, status='completed')
+        .values('driver_id')
+        .annotate(last_completed_at=Max('completed_at'))
+    )
+    for row in last_completed:
+        stats[row['driver_id']]['last_completed_at'] = row['last_completed_at']
+    
+    return stats
+
+
+def calculate_driver_score(driver, pickup_lat, pickup_lon, stats=None, time_factor=1.0):
     """
     Calculate a score for a driver based on multiple factors.
     Higher score = better match.
@@ -61,10 +113,14 @@ def calculate_driver_score(driver, pickup_lat, pickup_lon):
     - Acceptance rate (15% weight)
     - Idle time / time since last ride (10% weight)
     
+    stats is this driver's entry from load_driver_stats(). When omitted the
+    numbers are queried for this driver alone.
+    
+    time_factor (see eta_service.time_factors) scales the distance before it
+    is scored, so a driver stuck in slow traffic ranks as further away.
+    
     Returns: (score, distance_km)
     """
-    from .models import RideOffer, Booking
-    
     # 1. Distance score (50% weight) - closer is better
     distance_km = haversine_distance(
         driver.current_latitude or 0,
@@ -78,20 +134,19 @@ def calculate_driver_score(driver, pickup_lat, pickup_lon):
         return 0, distance_km
     
     # Normalize: 0km = 100 points, MAX_SEARCH_RADIUS_KM = 0 points
-    distance_score = max(0, 100 - (distance_km / MAX_SEARCH_RADIUS_KM * 100))
+    distance_score = max(0, 100 - (distance_km * time_factor / MAX_SEARCH_RADIUS_KM * 100))
     
     # 2. Rating score (25% weight)
     rating = float(driver.rating or 4.5)
     rating_score = (rating / 5.0) * 100
     
+    if stats is None:
+        stats = load_driver_stats([driver.id])[driver.id]
+    
     # 3. Acceptance rate (15% weight)
     # Calculate from recent offers
-    recent_offers = RideOffer.objects.filter(
-        driver=driver,
-        offered_at__gte=timezone.now() - timedelta(days=7)
-    )
-    total_offers = recent_offers.count()
-    accepted_offers = recent_offers.filter(status='accepted').count()
+    total_offers = stats['total_offers']
+    accepted_offers = stats['accepted_offers']
     
     if total_offers > 0:
         acceptance_rate = (accepted_offers / total_offers) * 100
@@ -99,13 +154,10 @@ def calculate_driver_score(driver, pickup_lat, pickup_lon):
         acceptance_rate = 80  # Default for new drivers
     
     # 4. Idle time score (10% weight) - longer idle = higher priority
-    last_ride = Booking.objects.filter(
-        driver=driver,
-        status='completed'
-    ).order_by('-completed_at').first()
+    last_completed_at = stats['last_completed_at']
     
-    if last_ride and last_ride.completed_at:
-        idle_minutes = (timezone.now() - last_ride.completed_at).total_seconds() / 60
+    if last_completed_at:
+        idle_minutes = (timezone.now() - last_completed_at).total_seconds() / 60
         # Cap at 60 minutes, normalize to 100 points
         idle_score = min(100, (idle_minutes / 60) * 100)
     else:
@@ -122,14 +174,17 @@ def calculate_driver_score(driver, pickup_lat, pickup_lon):
     return final_score, distance_km
 
 
-def get_available_drivers(booking, excluded_driver_ids=None):
+def get_available_drivers(booking, excluded_driver_ids=None, limit=None):
     """
     Get all available drivers sorted by score.
     Excludes drivers who have already been offered this ride.
+    If limit is given, only the best `limit` drivers are returned.
     
     Returns: List of (driver, score, distance_km) tuples, sorted by score descending
     """
     from .models import Driver, RideOffer
+    from .spatial_index import find_nearby_driver_ids
+    from . import location_store
     
     if excluded_driver_ids is None:
         excluded_driver_ids = []
@@ -143,22 +198,82 @@ def get_available_drivers(booking, excluded_driver_ids=None):
     # Combine exclusions
     all_excluded = set(excluded_driver_ids + already_offered_ids)
     
+    # Only consider drivers in grid cells around the pickup point
+    nearby_ids = find_nearby_driver_ids(
+        booking.pickup_latitude,
+        booking.pickup_longitude,
+        MAX_SEARCH_RADIUS_KM
+    ) - all_excluded
+    
+    if not nearby_ids:
+        return []
+    
     # Find available drivers
-    # Driver model uses: is_online (availability) and is_approved (verification)
+    # DriverAvailability.state (idle = free for offers) and is_approved (verification)
     available_drivers = Driver.objects.filter(
-        is_online=True,
+        id__in=nearby_ids,
+        availability__state='idle',
         is_approved=True,
         current_latitude__isnull=False,
         current_longitude__isnull=False
-    ).exclude(id__in=all_excluded)
+    )
+    
+    # Positions in the live location store are newer than the flushed columns
+    available_drivers = location_store.apply_to(available_drivers)
+    stats_by_driver = load_driver_stats(driver.id for driver in available_drivers)
+    
+    return score_drivers(
+        available_drivers,
+        stats_by_driver,
+        booking.pickup_latitude,
+        booking.pickup_longitude,
+        limit=limit
+    )
+
+
+def score_drivers(drivers, stats_by_driver, pickup_lat, pickup_lon, limit=None):
+    """
+    Score already-loaded drivers for one pickup point.
+    Drivers out of range are dropped.
+    
+    Uses the vectorized scoring kernel when NumPy is available and falls back
+    to calculate_driver_score otherwise. Distances are weighted by the
+    historical travel speed towards the pickup (eta_service).
+    
+    Returns: List of (driver, score, distance_km) tuples, sorted by score descending
+    """
+    from . import eta_service, scoring_kernel
+    
+    if scoring_kernel.HAS_NUMPY and drivers:
+        packed = scoring_kernel.pack_candidates(drivers, stats_by_driver)
+        scores, distances = scoring_kernel.score_candidates(
+            packed,
+            pickup_lat,
+            pickup_lon,
+            MAX_SEARCH_RADIUS_KM,
+            time_factors=eta_service.time_factors(packed['lats'], packed['lons'], pickup_lat, pickup_lon)
+        )
+        return [
+            (drivers[i], float(scores[i]), float(distances[i]))
+            for i in scoring_kernel.top_k_indices(scores, limit)
+        ]
+    
+    factors = eta_service.time_factors(
+        [float(driver.current_latitude or 0) for driver in drivers],
+        [float(driver.current_longitude or 0) for driver in drivers],
+        pickup_lat,
+        pickup_lon
+    )
     
     # Score each driver
     scored_drivers = []
-    for driver in available_drivers:
+    for driver, factor in zip(drivers, factors):
         score, distance_km = calculate_driver_score(
             driver,
-            float(booking.pickup_latitude),
-            float(booking.pickup_longitude)
+            float(pickup_lat),
+            float(pickup_lon),
+            stats=stats_by_driver[driver.id],
+            time_factor=factor
         )
         if score > 0:  # Only include drivers within range
             scored_drivers.append((driver, score, distance_km))
@@ -166,59 +281,154 @@ def get_available_drivers(booking, excluded_driver_ids=None):
     # Sort by score descending
     scored_drivers.sort(key=lambda x: x[1], reverse=True)
     
+    if limit is not None:
+        scored_drivers = scored_drivers[:limit]
+    
     return scored_drivers
 
 
-def create_ride_offer(booking, driver, score=None, distance_km=None, offer_order=1):
+def create_ride_offer(booking, driver, score=None, distance_km=None, offer_order=1, slot=0):
     """
     Create a new ride offer for a driver.
     Sets expiration time to OFFER_TIMEOUT_SECONDS from now.
+    
+    The driver is claimed (idle -> offered) before the offer is written, so
+    two dispatches cannot both offer the same idle driver; a driver that is
+    no longer idle is skipped.
+    
+    slot is the offer's position within its dispatch round. The database
+    allows one pending offer per driver and per (booking, slot), so when a
+    concurrent dispatch got there first no offer is created.
+    
+    Returns: the RideOffer, or None if the driver or slot was already taken
     """
+    from django.db import IntegrityError, transaction
     from .models import RideOffer
+    from . import driver_state, offer_push
+    
+    if not driver_state.mark_offered([driver.id]):
+        logger.info(f"Driver #{driver.id} is no longer idle; not offering booking #{booking.id}")
+        return None
     
     expires_at = timezone.now() + timedelta(seconds=OFFER_TIMEOUT_SECONDS)
     
-    offer = RideOffer.objects.create(
-        booking=booking,
-        driver=driver,
-        driver_score=Decimal(str(score)) if score else None,
-        distance_km=Decimal(str(distance_km)) if distance_km else None,
-        offer_order=offer_order,
-        status='pending',
-        expires_at=expires_at
-    )
+    try:
+        with transaction.atomic():
+            offer = RideOffer.objects.create(
+                booking=booking,
+                driver=driver,
+                driver_score=Decimal(str(score)) if score else None,
+                distance_km=Decimal(str(distance_km)) if distance_km else None,
+                offer_order=offer_order,
+                slot=slot,
+                status='pending',
+                expires_at=expires_at
+            )
+    except IntegrityError:
+        driver_state.release_offered([driver.id])
+        logger.info(f"Booking #{booking.id} slot {slot} or driver #{driver.id} already has a pending offer")
+        return None
+    offer_push.push_offers([offer])
     
     logger.info(f"Created ride offer #{offer.id} for booking #{booking.id} to driver #{driver.id}")
     
     return offer
 
 
+def next_queued_driver(booking, excluded_driver_ids):
+    """
+    Take the next driver from the booking's ranked candidate queue.
+    Candidates that are no longer idle are skipped.
+    
+    Returns: (driver, score, distance_km) or None if the booking needs re-ranking
+    """
+    from .models import Driver
+    from . import candidate_queue
+    
+    while True:
+        entry = candidate_queue.pop_next(booking.id, excluded_driver_ids)
+        if entry is None:
+            return None
+        driver_id, score, distance_km = entry
+        driver = Driver.objects.filter(id=driver_id, availability__state='idle', is_approved=True).first()
+        if driver:
+            return driver, score, distance_km
+
+
+def offers_per_round():
+    """
+    Number of drivers offered a booking at once.
+    1 in 'sequential' mode, DISPATCH_PARALLEL_OFFER_COUNT in 'parallel' mode.
+    """
+    if getattr(settings, 'DISPATCH_MODE', 'sequential') == 'parallel':
+        return max(1, getattr(settings, 'DISPATCH_PARALLEL_OFFER_COUNT', 3))
+    return 1
+
+
 def dispatch_ride(booking):
     """
-    Main dispatch function. Finds the best available driver and creates an offer.
+    Main dispatch function. Finds the best available driver(s) and creates offers.
+    
+    In 'sequential' mode one driver is offered the ride at a time. In 'parallel'
+    mode the top offers_per_round() drivers are offered it at once and the
+    first to accept wins (see accept_offer). A new round only starts once
+    every offer of the previous round has been answered or has expired.
+    
+    The ranked list from the first dispatch is kept in corporate.candidate_queue,
+    so follow-up offers pop the next driver and only re-rank when the list is
+    stale or drivers have moved.
     
     Returns:
-    - RideOffer if a driver was found and offer created
-    - None if no drivers available
+    - RideOffer (the best-ranked one of the round) if offers were created
+    - None if no drivers available or offers are still outstanding
     """
     from .models import RideOffer
+    from . import candidate_queue
     
     # First, expire any pending offers for this booking
     expire_pending_offers(booking)
     
-    # Count how many offers have been made for this booking
-    offer_count = RideOffer.objects.filter(booking=booking).count()
+    if RideOffer.objects.filter(booking=booking, status='pending').exists():
+        logger.info(f"Booking #{booking.id} still has outstanding offers")
+        return None
+    
+    # Drivers already offered this booking
+    offered_ids = list(
+        RideOffer.objects.filter(booking=booking).values_list('driver_id', flat=True)
+    )
+    offer_count = len(offered_ids)
     
     if offer_count >= MAX_OFFERS_PER_BOOKING:
         logger.warning(f"Booking #{booking.id} has reached max offers ({MAX_OFFERS_PER_BOOKING})")
+        candidate_queue.discard(booking.id)
         booking.status = 'no_driver_found'
         booking.save()
         return None
     
-    # Get available drivers
-    scored_drivers = get_available_drivers(booking)
+    round_size = min(offers_per_round(), MAX_OFFERS_PER_BOOKING - offer_count)
+    excluded_ids = set(offered_ids)
+    picks = []
+    
+    while len(picks) < round_size:
+        best = next_queued_driver(booking, excluded_ids)
+        if best is None:
+            break
+        picks.append(best)
+        excluded_ids.add(best[0].id)
+    
+    if len(picks) < round_size:
+        # Rank from scratch and keep the runners-up for follow-up offers;
+        # no more drivers than the booking can still be offered to
+        scored_drivers = get_available_drivers(
+            booking,
+            excluded_driver_ids=list(excluded_ids),
+            limit=MAX_OFFERS_PER_BOOKING - offer_count - len(picks)
+        )
+        needed = round_size - len(picks)
+        picks.extend(scored_drivers[:needed])
+        candidate_queue.store(booking.id, scored_drivers[needed:])
     
-    if not scored_drivers:
+    if not picks:
         logger.warning(f"No available drivers for booking #{booking.id}")
         if offer_count > 0:
             # We've tried but no more drivers available
@@ -226,19 +436,46 @@ def dispatch_ride(booking):
             booking.save()
         return None
     
-    # Get the best driver
-    best_driver, score, distance_km = scored_drivers[0]
-    
-    # Create the offer
-    offer = create_ride_offer(
-        booking=booking,
-        driver=best_driver,
-        score=score,
-        distance_km=distance_km,
-        offer_order=offer_count + 1
-    )
-    
-    return offer
+    # Create the offers, best driver first. A pick taken by a concurrent
+    # dispatch in the meantime is replaced from the candidate queue.
+    offers = []
+    while picks and len(offers) < round_size:
+        driver, score, distance_km = picks.pop(0)
+        slot = len(offers)
+        offer = create_ride_offer(
+            booking=booking,
+            driver=driver,
+            score=score,
+            distance_km=distance_km,
+            offer_order=offer_count + slot + 1,
+            slot=slot
+        )
+        if offer:
+            offers.append(offer)
+            continue
+        if RideOffer.objects.filter(booking=booking, status='pending', slot=slot).exists():
+            break  # Another dispatch of this booking is running the round
+        replacement = next_queued_driver(booking, excluded_ids)
+        if replacement:
+            picks.append(replacement)
+            excluded_ids.add(replacement[0].id)
+    
+    return offers[0] if offers else None
+
+
+def is_batch_mode():
+    return getattr(settings, 'DISPATCH_BATCH_MODE', False)
+
+
+def request_dispatch(booking):
+    """
+    Ask for a booking to be (re)dispatched.
+    In batch mode the booking is left 'searching_driver' for the next batch
+    cycle and None is returned; otherwise dispatch_ride runs immediately.
+    """
+    if is_batch_mode():
+        return None
+    return dispatch_ride(booking)
 
 
 def expire_pending_offers(booking=None):
@@ -248,6 +485,7 @@ def expire_pending_offers(booking=None):
     Otherwise check all bookings.
     """
     from .models import RideOffer
+    from . import driver_state
     
     query = RideOffer.objects.filter(
         status='pending',
@@ -257,7 +495,9 @@ def expire_pending_offers(booking=None):
     if booking:
         query = query.filter(booking=booking)
     
-    expired_count = query.update(status='expired')
+    driver_ids = list(query.values_list('driver_id', flat=True))
+    expired_count = query.filter(driver_id__in=driver_ids).update(status='expired')
+    driver_state.release_offered(driver_ids)
     
     if expired_count > 0:
         logger.info(f"Expired {expired_count} pending offer(s)")
@@ -269,39 +509,76 @@ def accept_offer(offer):
     """
     Driver accepts the ride offer.
     Assigns driver to booking and updates statuses.
+    
+    The offer and the booking are claimed with conditional updates, so when
+    several drivers hold offers for the same booking exactly one accept
+    succeeds. The remaining pending offers are then cancelled in bulk.
     """
     from django.db import transaction
+    from .models import RideOffer, Booking
+    from . import candidate_queue, driver_state, trip_trail
     
     with transaction.atomic():
-        # Refresh to get latest state
-        offer.refresh_from_db()
+        now = timezone.now()
         
-        # Check if offer is still valid
-        if offer.status != 'pending':
+        # Claim the offer only if it is still pending and not past its deadline
+        claimed = RideOffer.objects.filter(
+            id=offer.id,
+            status='pending',
+            expires_at__gt=now
+        ).update(status='accepted', responded_at=now)
+        
+        if not claimed:
+            offer.refresh_from_db()
+            if offer.status == 'pending':
+                offer.status = 'expired'
+                offer.save()
+                driver_state.release_offered([offer.driver_id])
+                return False, "Offer has expired"
             return False, f"Offer is no longer pending (status: {offer.status})"
         
-        if offer.is_expired:
-            offer.status = 'expired'
-            offer.save()
-            return False, "Offer has expired"
+        # Claim the booking - the first accepted offer wins
+        assigned = Booking.objects.filter(
+            id=offer.booking_id,
+            driver__isnull=True
+        ).exclude(
+            status__in=['completed', 'cancelled']
+        ).update(driver_id=offer.driver_id, status='driver_assigned', updated_at=now)
         
-        # Accept the offer
-        offer.status = 'accepted'
-        offer.responded_at = timezone.now()
-        offer.save()
+        if not assigned:
+            RideOffer.objects.filter(id=offer.id).update(status='cancelled')
+            driver_state.release_offered([offer.driver_id])
+            offer.refresh_from_db()
+            return False, "This ride has already been assigned to another driver"
         
-        # Assign driver to booking
-        booking = offer.booking
-        booking.driver = offer.driver
-        booking.status = 'driver_assigned'
-        booking.save()
+        # Withdraw the other drivers' offers for this booking
+        other_offers = RideOffer.objects.filter(booking_id=offer.booking_id, status='pending')
+        other_driver_ids = list(other_offers.values_list('driver_id', flat=True))
+        cancelled = other_offers.filter(driver_id__in=other_driver_ids).update(
+            status='cancelled',
+            responded_at=now
+        )
+        driver_state.release_offered(other_driver_ids)
         
-        # Mark driver as unavailable (busy with a ride)
+        offer.refresh_from_db()
+        booking = Booking.objects.get(id=offer.booking_id)
+        offer.booking = booking
+        
+        # Mark driver as unavailable (busy with a ride). A driver who is no
+        # longer idle or offered (e.g. switched offline by the presence
+        # sweep) cannot take the ride; undo the claims above.
         driver = offer.driver
-        driver.is_online = False  # Driver is now busy
-        driver.save()
+        if not driver_state.mark_on_trip(driver.id):
+            transaction.set_rollback(True)
+            logger.warning(f"Driver #{driver.id} is not available; accept of offer #{offer.id} rolled back")
+            return False, "You are not available for rides right now"
+        trip_trail.start_trip(booking.id, driver.id)
+        candidate_queue.discard(booking.id)
         
-        logger.info(f"Driver #{driver.id} accepted offer #{offer.id} for booking #{booking.id}")
+        logger.info(
+            f"Driver #{driver.id} accepted offer #{offer.id} for booking #{booking.id}"
+            f" ({cancelled} other offer(s) cancelled)"
+        )
         
         return True, "Offer accepted successfully"
 
@@ -314,6 +591,7 @@ def decline_offer(offer, dispatch_next=True):
     Returns: (success, message, next_offer or None)
     """
     from django.db import transaction
+    from . import driver_state
     
     with transaction.atomic():
         offer.refresh_from_db()
@@ -325,13 +603,14 @@ def decline_offer(offer, dispatch_next=True):
         offer.status = 'declined'
         offer.responded_at = timezone.now()
         offer.save()
+        driver_state.release_offered([offer.driver_id])
         
         logger.info(f"Driver #{offer.driver_id} declined offer #{offer.id} for booking #{offer.booking_id}")
         
         # Dispatch to next driver if requested
         next_offer = None
         if dispatch_next:
-            next_offer = dispatch_ride(offer.booking)
+            next_offer = request_dispatch(offer.booking)
         
         return True, "Offer declined", next_offer
 
@@ -339,17 +618,16 @@ def decline_offer(offer, dispatch_next=True):
 def get_pending_offer_for_driver(driver):
     """
     Get the current pending offer for a driver, if any.
-    Automatically expires stale offers.
+    Offers past their deadline are ignored; expiring them is left to
+    corporate.offer_scheduler so this read never writes.
     """
     from .models import RideOffer
     
-    # First expire any stale offers
-    expire_pending_offers()
-    
     # Get pending offer for this driver
     offer = RideOffer.objects.filter(
         driver=driver,
-        status='pending'
+        status='pending',
+        expires_at__gt=timezone.now()
     ).select_related('booking', 'booking__customer').first()
     
     return offer
@@ -358,9 +636,11 @@ def get_pending_offer_for_driver(driver):
 def process_expired_offers():
     """
     Background task to process expired offers and dispatch to next drivers.
-    This should be called periodically (e.g., every 5 seconds).
+    One-shot sweep kept for manual/cron use; the run_offer_scheduler command
+    fires each expiry at its deadline instead of polling.
     """
     from .models import RideOffer, Booking
+    from . import driver_state
     
     # Get all expired pending offers
     expired_offers = RideOffer.objects.filter(
@@ -371,9 +651,10 @@ def process_expired_offers():
     for offer in expired_offers:
         offer.status = 'expired'
         offer.save()
+        driver_state.release_offered([offer.driver_id])
         
         # Try to dispatch to next driver
         if offer.booking.status == 'searching_driver':
-            dispatch_ride(offer.booking)
+            request_dispatch(offer.booking)
     
     return len(expired_offers)
@@ -0,0 +1,321 @@
+"""
+Dispatch Simulator
+
+Benchmark harness for dispatch_service. Seeds a synthetic fleet around a
+city centre, replays a Poisson stream of bookings and simulates each
+offered driver accepting, declining or letting the offer time out.
+
+Time is simulated: arrivals, driver responses and trip completions are
+events on a simulated clock, while every dispatch call runs for real
+against the database and is timed on the wall clock. With
+settings.DISPATCH_BATCH_MODE on, bookings are not dispatched on arrival;
+batch_dispatch cycles run every DISPATCH_BATCH_INTERVAL_SECONDS of
+simulated time instead, as run_batch_dispatch would.
+
+Only the synthetic fleet is eligible for offers during a run, so real
+drivers are never offered simulated bookings, even with keep=True.
+
+Reported metrics:
+- dispatch latency percentiles (wall clock, ms)
+- queries per dispatch
+- offers per booking
+- time-to-assignment (simulated seconds)
+
+Used by `python manage.py simulate_dispatch`. By default everything the run
+creates is rolled back at the end.
+"""
+
+from datetime import timedelta
+from math import cos, pi, radians, sin, sqrt
+import heapq
+import random
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import batch_dispatch, candidate_queue, dispatch_service, driver_state, offer_scheduler, trip_trail
+from .spatial_index import KM_PER_DEGREE_LAT, restricted_to
+
+# Defaults (Kampala city centre)
+DEFAULT_CENTER_LAT = 0.3476
+DEFAULT_CENTER_LON = 32.5825
+DEFAULT_RADIUS_KM = 10
+
+
+def random_point(rng, center_lat, center_lon, radius_km):
+    """Uniform random point inside a circle around the centre."""
+    distance = radius_km * sqrt(rng.random())
+    angle = rng.random() * 2 * pi
+    dlat = distance * cos(angle) / KM_PER_DEGREE_LAT
+    dlon = distance * sin(angle) / (KM_PER_DEGREE_LAT * max(cos(radians(center_lat)), 0.01))
+    return round(center_lat + dlat, 7), round(center_lon + dlon, 7)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_drivers(count, rng, center_lat, center_lon, radius_km, run_tag):
+    """
+    Create `count` online, approved drivers scattered around the centre.
+    Returns: their ids
+    """
+    from .models import Driver, DriverAvailability
+
+    drivers = []
+    for i in range(count):
+        lat, lon = random_point(rng, center_lat, center_lon, radius_km)
+        drivers.append(Driver(
+            phone=f"sim-{run_tag}-{i}",
+            email=f"sim-{run_tag}-{i}@sim.invalid",
+            full_name=f"Sim Driver {i}",
+            is_online=True,
+            is_approved=True,
+            otp_verified=True,
+            rating=round(rng.uniform(3.5, 5.0), 2),
+            current_latitude=lat,
+            current_longitude=lon,
+            location_updated_at=timezone.now(),
+        ))
+    Driver.objects.bulk_create(drivers)
+    DriverAvailability.objects.bulk_create(
+        DriverAvailability(driver=driver, state='idle') for driver in drivers
+    )
+    return [driver.id for driver in drivers]
+
+
+class DispatchSimulation:
+    """
+    One simulation run.
+    Call run() to execute and get the report dict.
+    """
+
+    def __init__(self, drivers=500, bookings=200, bookings_per_minute=30,
+                 accept_probability=0.7, decline_probability=0.2,
+                 center_lat=DEFAULT_CENTER_LAT, center_lon=DEFAULT_CENTER_LON,
+                 radius_km=DEFAULT_RADIUS_KM, seed=None):
+        self.driver_count = drivers
+        self.booking_count = bookings
+        self.bookings_per_minute = bookings_per_minute
+        self.accept_probability = accept_probability
+        self.decline_probability = decline_probability
+        self.center_lat = center_lat
+        self.center_lon = center_lon
+        self.radius_km = radius_km
+        self.rng = random.Random(seed)
+
+        self._events = []
+        self._seq = 0
+        self._booking_created = {}    # booking id -> simulated creation time
+        self.batch_mode = dispatch_service.is_batch_mode()
+        self.batch_interval = getattr(settings, 'DISPATCH_BATCH_INTERVAL_SECONDS', 5)
+        self._batch_scheduled = False
+        self.dispatch_latencies_ms = []
+        self.dispatch_queries = []
+        self.assignment_times = []
+
+    def _push(self, at, kind, payload):
+        self._seq += 1
+        heapq.heappush(self._events, (at, self._seq, kind, payload))
+
+    def _timed(self, func, *args, **kwargs):
+        """Run a dispatch step, recording wall latency and query count."""
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        self.dispatch_latencies_ms.append(elapsed_ms)
+        self.dispatch_queries.append(len(queries.captured_queries))
+        return result
+
+    def _schedule_responses(self, now, booking_id, known_offer_ids):
+        """Schedule a driver response for every new pending offer of a booking."""
+        from .models import RideOffer
+
+        new_offers = RideOffer.objects.filter(
+            booking_id=booking_id,
+            status='pending'
+        ).exclude(id__in=known_offer_ids)
+
+        for offer in new_offers:
+            known_offer_ids.add(offer.id)
+            roll = self.rng.random()
+            if roll < self.accept_probability:
+                self._push(now + self.rng.uniform(2, 12), 'accept', offer.id)
+            elif roll < self.accept_probability + self.decline_probability:
+                self._push(now + self.rng.uniform(1, 8), 'decline', offer.id)
+            else:
+                self._push(now + dispatch_service.OFFER_TIMEOUT_SECONDS, 'timeout', offer.id)
+
+    def _schedule_batch(self, now):
+        """Make sure a batch cycle is coming up (batch mode only)."""
+        if self.batch_mode and not self._batch_scheduled:
+            self._batch_scheduled = True
+            self._push(now + self.batch_interval, 'batch', None)
+
+    def _run_batch(self, now, offer_ids):
+        from .models import Booking
+
+        self._batch_scheduled = False
+        offers = self._timed(batch_dispatch.run_batch_cycle, booking_ids=list(self._booking_created))
+        for booking_id in {offer.booking_id for offer in offers}:
+            self._schedule_responses(now, booking_id, offer_ids[booking_id])
+
+        # Keep cycling while bookings wait and something can still change
+        waiting = Booking.objects.filter(id__in=self._booking_created, status='searching_driver').exists()
+        if waiting and (offers or self._events):
+            self._schedule_batch(now)
+
+    def _create_booking(self):
+        from .models import Booking, Customer
+
+        customer, _ = Customer.objects.get_or_create(
+            email='sim-customer@sim.invalid',
+            defaults={'full_name': 'Sim Customer'}
+        )
+        pickup = random_point(self.rng, self.center_lat, self.center_lon, self.radius_km)
+        destination = random_point(self.rng, self.center_lat, self.center_lon, self.radius_km)
+        distance_km = dispatch_service.haversine_distance(*pickup, *destination)
+
+        return Booking.objects.create(
+            customer=customer,
+            pickup_location='Simulated pickup',
+            destination='Simulated destination',
+            ride_type='standard',
+            pickup_latitude=pickup[0],
+            pickup_longitude=pickup[1],
+            destination_latitude=destination[0],
+            destination_longitude=destination[1],
+            fare=round(2 + distance_km, 2),
+            distance=round(distance_km, 2),
+            duration=max(1, int(distance_km * 3)),
+            payment_method='card',
+            status='searching_driver',
+        )
+
+    def _handle(self, now, kind, payload, offer_ids):
+        from .models import Booking, RideOffer
+
+        if kind == 'batch':
+            self._run_batch(now, offer_ids)
+            return
+
+        if kind == 'booking':
+            booking = self._create_booking()
+            self._booking_created[booking.id] = now
+            offer_ids[booking.id] = set()
+            if self.batch_mode:
+                self._schedule_batch(now)
+                return
+            self._timed(dispatch_service.dispatch_ride, booking)
+            self._schedule_responses(now, booking.id, offer_ids[booking.id])
+            return
+
+        if kind == 'complete':
+            booking = Booking.objects.get(id=payload)
+            booking.status = 'completed'
+            booking.completed_at = timezone.now()
+            booking.save()
+            driver_state.end_trip(booking.driver_id)
+            trip_trail.end_trip(booking.id, booking.driver_id)
+            return
+
+        offer = RideOffer.objects.select_related('booking').get(id=payload)
+        if offer.status != 'pending':
+            return
+        booking = offer.booking
+
+        if kind == 'accept':
+            success, _ = dispatch_service.accept_offer(offer)
+            if success:
+                self.assignment_times.append(now - self._booking_created[booking.id])
+                self._push(now + booking.duration * 60, 'complete', booking.id)
+            return
+
+        if kind == 'decline':
+            self._timed(dispatch_service.decline_offer, offer, True)
+        elif kind == 'timeout':
+            # Simulated time runs ahead of the wall clock; force the deadline
+            RideOffer.objects.filter(id=offer.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+            self._timed(offer_scheduler.expire_offer, offer.id)
+
+        # In batch mode the booking waits for the next cycle
+        self._schedule_batch(now)
+        self._schedule_responses(now, booking.id, offer_ids[booking.id])
+
+    def run(self, keep=False):
+        """
+        Seed the fleet, replay the booking stream and return the report.
+        Unless keep is True, all rows created by the run are rolled back.
+        """
+        from .models import Booking, RideOffer
+
+        run_tag = f"{int(time.time())}{self.rng.randint(0, 999)}"
+        with transaction.atomic():
+            fleet_ids = seed_drivers(self.driver_count, self.rng, self.center_lat, self.center_lon,
+                                     self.radius_km, run_tag)
+
+            arrival = 0.0
+            for _ in range(self.booking_count):
+                arrival += self.rng.expovariate(self.bookings_per_minute / 60)
+                self._push(arrival, 'booking', None)
+
+            offer_ids = {}
+            with restricted_to(fleet_ids):
+                while self._events:
+                    now, _, kind, payload = heapq.heappop(self._events)
+                    self._handle(now, kind, payload, offer_ids)
+
+            booking_ids = list(self._booking_created)
+            offer_total = RideOffer.objects.filter(booking_id__in=booking_ids).count()
+            unassigned = Booking.objects.filter(
+                id__in=booking_ids,
+                driver__isnull=True
+            ).count()
+
+            if not keep:
+                transaction.set_rollback(True)
+
+        # Cached queues may still reference rolled-back rows; the spatial
+        # index is reloaded in full on its next use
+        for booking_id in self._booking_created:
+            candidate_queue.discard(booking_id)
+
+        return self.report(offer_total, unassigned)
+
+    def report(self, offer_total, unassigned):
+        latencies = self.dispatch_latencies_ms
+        queries = self.dispatch_queries
+        assigned = self.assignment_times
+        bookings = len(self._booking_created)
+
+        return {
+            'drivers': self.driver_count,
+            'bookings': bookings,
+            'assigned': len(assigned),
+            'unassigned': unassigned,
+            'dispatch_calls': len(latencies),
+            'dispatch_latency_ms': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': max(latencies) if latencies else 0,
+            },
+            'queries_per_dispatch': {
+                'mean': sum(queries) / len(queries) if queries else 0,
+                'max': max(queries) if queries else 0,
+            },
+            'offers_per_booking': offer_total / bookings if bookings else 0,
+            'time_to_assignment_s': {
+                'p50': percentile(assigned, 50),
+                'p90': percentile(assigned, 90),
+                'max': max(assigned) if assigned else 0,
+            },
+        }
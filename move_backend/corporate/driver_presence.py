@@ -0,0 +1,139 @@
+"""
+Driver Presence
+
+Decides whether an online driver is actually reachable, from heartbeats
+instead of whatever the app last sent to DriverSetOnlineAPIView.
+
+- Every location fix, WebSocket connect/frame and ride-request poll counts
+  as a heartbeat. A heartbeat stamps DriverAvailability.last_seen_at; writes
+  are throttled per process to one per driver every
+  HEARTBEAT_WRITE_SECONDS, well inside PRESENCE_TTL_SECONDS.
+- Presence is kept in the database rather than the cache so that
+  `python manage.py run_presence_sweeper`, a separate process, sees the
+  heartbeats received by every web worker even with the default
+  process-local cache.
+- sweep() switches online drivers whose last heartbeat is older than
+  PRESENCE_TTL_SECONDS (ghosts) offline in one UPDATE each for Driver and
+  DriverAvailability, and expires their pending offers at once so the
+  booking moves on instead of waiting out the offer timeout.
+- Ghosts are stamped with presence_lost_at. When they heartbeat again
+  within LOST_TTL_SECONDS they are switched back online in the next sweep,
+  again in one batch. Drivers who go offline themselves lose the stamp and
+  stay offline.
+- Drivers on a trip are left alone; a tunnel must not end a ride.
+"""
+
+from datetime import timedelta
+import logging
+import time
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PRESENCE_TTL_SECONDS = 90           # No heartbeat for this long = gone
+HEARTBEAT_WRITE_SECONDS = 30        # Per-process throttle on last_seen_at writes
+SWEEP_INTERVAL_SECONDS = 15
+LOST_TTL_SECONDS = 12 * 60 * 60     # How long a ghost is restored on return
+
+_last_write = {}    # driver id -> monotonic time of this process's last last_seen_at write
+
+
+def _touch(driver_id, **fields):
+    from .models import DriverAvailability
+
+    DriverAvailability.objects.filter(driver_id=driver_id).update(**fields)
+
+
+def heartbeat(driver_id):
+    """Record that the driver's app is alive."""
+    now = time.monotonic()
+    if now - _last_write.get(driver_id, float('-inf')) < HEARTBEAT_WRITE_SECONDS:
+        return
+    _last_write[driver_id] = now
+    _touch(driver_id, last_seen_at=timezone.now())
+
+
+def is_present(driver_id):
+    from .models import DriverAvailability
+
+    cutoff = timezone.now() - timedelta(seconds=PRESENCE_TTL_SECONDS)
+    return DriverAvailability.objects.filter(driver_id=driver_id, last_seen_at__gte=cutoff).exists()
+
+
+def went_online(driver_id):
+    """Driver switched online themselves; counts as a heartbeat."""
+    _last_write[driver_id] = time.monotonic()
+    _touch(driver_id, last_seen_at=timezone.now(), presence_lost_at=None)
+
+
+def went_offline(driver_id):
+    """Driver switched offline themselves; never restore them automatically."""
+    _last_write.pop(driver_id, None)
+    _touch(driver_id, presence_lost_at=None)
+
+
+def sweep():
+    """
+    Switch ghosts offline and returned ghosts back online, in batches.
+    Returns: (number switched offline, number restored)
+    """
+    from .models import Driver, DriverAvailability, RideOffer
+    from . import driver_state
+    from .offer_scheduler import expire_offer
+
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=PRESENCE_TTL_SECONDS)
+
+    # A row that never heartbeated counts from its last state change, so
+    # drivers are not all dropped on the first sweep after an upgrade
+    ghosts = set(
+        Driver.objects.filter(is_online=True)
+        .exclude(availability__state='on_trip')
+        .filter(
+            Q(availability__isnull=True)
+            | Q(availability__last_seen_at__lt=cutoff)
+            | Q(availability__last_seen_at__isnull=True, availability__updated_at__lt=cutoff)
+        )
+        .values_list('id', flat=True)
+    )
+
+    if ghosts:
+        Driver.objects.filter(id__in=ghosts, is_online=True).update(is_online=False)
+        driver_state.set_online_many(ghosts, False)
+        DriverAvailability.objects.filter(driver_id__in=ghosts).update(presence_lost_at=now)
+
+        offer_ids = list(
+            RideOffer.objects.filter(driver_id__in=ghosts, status='pending').values_list('id', flat=True)
+        )
+        if offer_ids:
+            RideOffer.objects.filter(id__in=offer_ids, status='pending').update(expires_at=now)
+            for offer_id in offer_ids:
+                expire_offer(offer_id)
+        logger.info(f"Presence sweep: {len(ghosts)} driver(s) without heartbeat switched offline")
+
+    # Ghosts that are heartbeating again and did not go offline themselves
+    lost = DriverAvailability.objects.filter(presence_lost_at__isnull=False)
+    returned = list(
+        lost.filter(
+            presence_lost_at__gte=now - timedelta(seconds=LOST_TTL_SECONDS),
+            last_seen_at__gte=cutoff,
+            last_seen_at__gt=F('presence_lost_at'),
+        ).values_list('driver_id', flat=True)
+    )
+
+    restored = []
+    if returned:
+        restored = list(
+            Driver.objects.filter(id__in=returned, is_online=False).values_list('id', flat=True)
+        )
+        Driver.objects.filter(id__in=restored).update(is_online=True)
+        driver_state.set_online_many(restored, True)
+        logger.info(f"Presence sweep: {len(restored)} returning driver(s) switched back online")
+
+    lost.filter(
+        Q(driver_id__in=returned) | Q(presence_lost_at__lt=now - timedelta(seconds=LOST_TTL_SECONDS))
+    ).update(presence_lost_at=None)
+    return len(ghosts), len(restored)
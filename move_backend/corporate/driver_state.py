@@ -0,0 +1,100 @@
+"""
+Driver Availability State
+
+Lifecycle of a driver from dispatch's point of view, stored in the
+DriverAvailability table:
+
+    offline -> idle -> offered -> on_trip -> idle
+                  ^       |
+                  +-------+  (offer declined / expired / cancelled)
+
+Every transition is a conditional UPDATE (`WHERE state IN from_states`), so
+concurrent requests cannot move a driver out of a state it is no longer in.
+"Who can take a ride right now" is the indexed lookup state='idle'.
+
+Driver.is_online only records whether the driver wants to work; it no
+longer doubles as "not busy".
+"""
+
+import logging
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _transition(driver_ids, to_state, from_states):
+    """
+    Move drivers currently in one of from_states to to_state.
+    Returns: number of drivers moved
+    """
+    from .models import DriverAvailability
+
+    driver_ids = [driver_id for driver_id in driver_ids if driver_id]
+    if not driver_ids:
+        return 0
+
+    return DriverAvailability.objects.filter(
+        driver_id__in=driver_ids,
+        state__in=from_states
+    ).update(state=to_state, updated_at=timezone.now())
+
+
+def get_state(driver_id):
+    from .models import DriverAvailability
+
+    return (
+        DriverAvailability.objects.filter(driver_id=driver_id)
+        .values_list('state', flat=True)
+        .first()
+    ) or 'offline'
+
+
+def set_online(driver_id, online):
+    """
+    Driver toggled online/offline.
+    Going online only leaves 'offline'; going offline only leaves 'idle' or
+    'offered', so a driver mid-trip stays 'on_trip'.
+    """
+    from .models import DriverAvailability
+
+    DriverAvailability.objects.get_or_create(driver_id=driver_id)
+    if online:
+        return _transition([driver_id], 'idle', ['offline'])
+    return _transition([driver_id], 'offline', ['idle', 'offered'])
+
+
+def set_online_many(driver_ids, online):
+    """
+    Batch form of set_online for drivers that already have an availability
+    row (presence sweeps).
+    """
+    if online:
+        return _transition(driver_ids, 'idle', ['offline'])
+    return _transition(driver_ids, 'offline', ['idle', 'offered'])
+
+
+def mark_offered(driver_ids):
+    """Drivers received a ride offer."""
+    return _transition(driver_ids, 'offered', ['idle'])
+
+
+def release_offered(driver_ids):
+    """Offers to these drivers were declined, expired or withdrawn."""
+    return _transition(driver_ids, 'idle', ['offered'])
+
+
+def mark_on_trip(driver_id):
+    """Driver was assigned to a booking."""
+    return _transition([driver_id], 'on_trip', ['idle', 'offered'])
+
+
+def end_trip(driver_id):
+    """
+    Driver's booking was completed or cancelled.
+    A driver who switched off during the trip goes straight to 'offline'.
+    """
+    from .models import Driver
+
+    online = Driver.objects.filter(id=driver_id, is_online=True).exists()
+    return _transition([driver_id], 'idle' if online else 'offline', ['on_trip'])
@@ -0,0 +1,273 @@
+"""
+Historical-Speed ETA Engine
+
+Estimates travel times without an external routing API, from average
+speeds learned per dispatch grid cell and hour of the week.
+
+- learn_speeds() walks the trip trails of recently completed bookings
+  (falling back to booking distance/duration for trips without a trail) and
+  stores one CellSpeed row per (cell, hour-of-week). Stationary trail steps
+  are left out, so waiting at a pickup does not count as slow traffic.
+- The table is held in process memory and reloaded every
+  TABLE_REFRESH_SECONDS. Lookups fall back from (cell, hour) to the cell's
+  all-week average, then the hour's city-wide average, then
+  DEFAULT_SPEED_KMH.
+- The speed between two cells is the harmonic mean of both cells' speeds,
+  cached per (origin cell, destination cell, hour).
+- pickup_etas() answers many origin -> one destination pairs in a single
+  vectorized call when NumPy is installed.
+
+ETA = straight-line distance * ROAD_FACTOR / cell-pair speed.
+
+Run `python manage.py learn_eta_speeds` periodically (e.g. nightly).
+"""
+
+from datetime import timedelta
+from math import floor
+import logging
+import threading
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .scoring_kernel import HAS_NUMPY, np
+from .spatial_index import GRID_CELL_SIZE_DEG
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DEFAULT_SPEED_KMH = 25.0          # City average when nothing has been learned
+ROAD_FACTOR = 1.3                 # Road distance / straight-line distance
+TABLE_REFRESH_SECONDS = 10 * 60
+LEARNING_WINDOW_DAYS = 28
+MIN_SAMPLE_SECONDS = 120          # Less observed travel time than this is ignored
+MIN_STEP_SECONDS = 1              # Trail steps outside this range are gaps or noise
+MAX_STEP_SECONDS = 120
+MAX_PLAUSIBLE_SPEED_KMH = 130
+MIN_STEP_KM = 0.015               # Shorter trail steps are GPS jitter around a stopped car
+MIN_STEP_SPEED_KMH = 2            # Slower steps are dwell (pickup, drop-off, parking), not travel
+PAIR_CACHE_MAX_ENTRIES = 100000
+
+
+def cell_for(lat, lon):
+    return int(floor(float(lat) / GRID_CELL_SIZE_DEG)), int(floor(float(lon) / GRID_CELL_SIZE_DEG))
+
+
+def hour_of_week(at=None):
+    at = timezone.localtime(at or timezone.now())
+    return at.weekday() * 24 + at.hour
+
+
+class SpeedTable:
+    """In-memory CellSpeed table with fallbacks and a cell-pair cache."""
+
+    def __init__(self):
+        self._speeds = {}      # (row, col, hour) -> kmh
+        self._cell_avg = {}    # (row, col) -> kmh
+        self._hour_avg = {}    # hour -> kmh
+        self._pair_cache = {}  # (origin cell, destination cell, hour) -> kmh
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def load(self, rows):
+        """Replace the table with (row, col, hour, speed_kmh, sample_seconds) rows."""
+        speeds = {}
+        cell_totals = {}
+        hour_totals = {}
+        for row, col, hour, speed, seconds in rows:
+            speeds[(row, col, hour)] = speed
+            km = speed * seconds / 3600
+            for totals, key in ((cell_totals, (row, col)), (hour_totals, hour)):
+                entry = totals.setdefault(key, [0.0, 0.0])
+                entry[0] += km
+                entry[1] += seconds
+
+        def averages(totals):
+            return {key: km / seconds * 3600 for key, (km, seconds) in totals.items() if seconds}
+
+        with self._lock:
+            self._speeds = speeds
+            self._cell_avg = averages(cell_totals)
+            self._hour_avg = averages(hour_totals)
+            self._pair_cache = {}
+            self.loaded_at = time.monotonic()
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > TABLE_REFRESH_SECONDS
+
+    def cell_speed(self, cell, hour):
+        speed = self._speeds.get((cell[0], cell[1], hour))
+        if speed is None:
+            speed = self._cell_avg.get(cell)
+        if speed is None:
+            speed = self._hour_avg.get(hour, DEFAULT_SPEED_KMH)
+        return speed
+
+    def pair_speed(self, origin_cell, dest_cell, hour):
+        key = (origin_cell, dest_cell, hour)
+        speed = self._pair_cache.get(key)
+        if speed is None:
+            a = self.cell_speed(origin_cell, hour)
+            b = self.cell_speed(dest_cell, hour)
+            speed = 2 / (1 / a + 1 / b)
+            with self._lock:
+                if len(self._pair_cache) >= PAIR_CACHE_MAX_ENTRIES:
+                    self._pair_cache = {}
+                self._pair_cache[key] = speed
+        return speed
+
+
+# Process-wide table used by dispatch and tracking
+speed_table = SpeedTable()
+
+
+def reload_speed_table():
+    from .models import CellSpeed
+
+    speed_table.load(
+        CellSpeed.objects.values_list('cell_row', 'cell_col', 'hour_of_week', 'speed_kmh', 'sample_seconds')
+    )
+
+
+def ensure_table_loaded():
+    if speed_table.is_stale():
+        reload_speed_table()
+
+
+def pair_speeds(lats, lons, dest_lat, dest_lon, at=None):
+    """
+    Cell-pair speed (km/h) from every origin to the destination.
+    Returns: NumPy array when NumPy is installed, otherwise a list
+    """
+    ensure_table_loaded()
+    hour = hour_of_week(at)
+    dest_cell = cell_for(dest_lat, dest_lon)
+
+    if not HAS_NUMPY:
+        return [speed_table.pair_speed(cell_for(lat, lon), dest_cell, hour) for lat, lon in zip(lats, lons)]
+
+    rows = np.floor(np.asarray(lats, dtype=float) / GRID_CELL_SIZE_DEG).astype(np.int64)
+    cols = np.floor(np.asarray(lons, dtype=float) / GRID_CELL_SIZE_DEG).astype(np.int64)
+    if rows.size == 0:
+        return np.empty(0)
+    # Candidates share a handful of cells; look each one up once
+    cells, inverse = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    speeds = np.array([
+        speed_table.pair_speed((int(row), int(col)), dest_cell, hour) for row, col in cells
+    ])
+    return speeds[inverse.reshape(-1)]
+
+
+def pickup_etas(lats, lons, dest_lat, dest_lon, at=None):
+    """
+    Estimated travel time in seconds from every (lat, lon) to the destination.
+    Returns: NumPy array when NumPy is installed, otherwise a list
+    """
+    from .dispatch_service import haversine_distance
+    from .scoring_kernel import haversine_km
+
+    speeds = pair_speeds(lats, lons, dest_lat, dest_lon, at)
+    if not HAS_NUMPY:
+        return [
+            haversine_distance(lat, lon, dest_lat, dest_lon) * ROAD_FACTOR / speed * 3600
+            for lat, lon, speed in zip(lats, lons, speeds)
+        ]
+    distances = haversine_km(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float), dest_lat, dest_lon)
+    return distances * ROAD_FACTOR / speeds * 3600
+
+
+def eta_seconds(lat, lon, dest_lat, dest_lon, at=None):
+    """Travel time estimate for a single pair."""
+    return float(pickup_etas([float(lat)], [float(lon)], dest_lat, dest_lon, at)[0])
+
+
+def time_factors(lats, lons, dest_lat, dest_lon, at=None):
+    """
+    How much slower than DEFAULT_SPEED_KMH each origin -> destination trip is
+    (2.0 = takes twice as long as it would at the default speed).
+    Used by dispatch scoring to rank candidates by time instead of distance.
+    """
+    speeds = pair_speeds(lats, lons, dest_lat, dest_lon, at)
+    if not HAS_NUMPY:
+        return [DEFAULT_SPEED_KMH / speed for speed in speeds]
+    return DEFAULT_SPEED_KMH / speeds
+
+
+def learn_speeds(days=LEARNING_WINDOW_DAYS):
+    """
+    Rebuild CellSpeed from trips completed in the last `days` days.
+    Returns: number of (cell, hour) rows written
+    """
+    from datetime import datetime, timezone as dt_timezone
+    from .dispatch_service import haversine_distance
+    from .models import Booking, CellSpeed, TripTrailSegment
+    from .trip_trail import decode_points
+
+    since = timezone.now() - timedelta(days=days)
+    totals = {}   # (row, col, hour) -> [km, seconds]
+
+    def add(lat, lon, at, km, seconds):
+        row, col = cell_for(lat, lon)
+        entry = totals.setdefault((row, col, hour_of_week(at)), [0.0, 0.0])
+        entry[0] += km
+        entry[1] += seconds
+
+    segments = TripTrailSegment.objects.filter(
+        booking__status='completed',
+        booking__completed_at__gte=since
+    ).values_list('booking_id', 'started_at', 'data')
+
+    trail_booking_ids = set()
+    for booking_id, started_at, data in segments.iterator():
+        trail_booking_ids.add(booking_id)
+        previous = None
+        for point in decode_points(bytes(data), started_at.timestamp()):
+            if previous is not None:
+                seconds = point[0] - previous[0]
+                if MIN_STEP_SECONDS <= seconds <= MAX_STEP_SECONDS:
+                    km = haversine_distance(previous[1], previous[2], point[1], point[2])
+                    if km >= MIN_STEP_KM and MIN_STEP_SPEED_KMH <= km / seconds * 3600 <= MAX_PLAUSIBLE_SPEED_KMH:
+                        add(
+                            (previous[1] + point[1]) / 2,
+                            (previous[2] + point[2]) / 2,
+                            datetime.fromtimestamp(previous[0], tz=dt_timezone.utc),
+                            km,
+                            seconds
+                        )
+            previous = point
+
+    # Trips recorded before trails existed: whole-trip average at the pickup cell
+    bookings = Booking.objects.filter(
+        status='completed',
+        completed_at__gte=since,
+        pickup_latitude__isnull=False,
+        pickup_longitude__isnull=False,
+        distance__gt=0,
+        duration__gt=0
+    ).exclude(id__in=trail_booking_ids).values_list(
+        'pickup_latitude', 'pickup_longitude', 'created_at', 'distance', 'duration'
+    )
+    for lat, lon, created_at, distance, duration in bookings.iterator():
+        seconds = float(duration) * 60
+        if float(distance) / seconds * 3600 <= MAX_PLAUSIBLE_SPEED_KMH:
+            add(lat, lon, created_at, float(distance), seconds)
+
+    rows = [
+        CellSpeed(
+            cell_row=row,
+            cell_col=col,
+            hour_of_week=hour,
+            speed_kmh=km / seconds * 3600,
+            sample_seconds=int(seconds)
+        )
+        for (row, col, hour), (km, seconds) in totals.items()
+        if seconds >= MIN_SAMPLE_SECONDS and km > 0
+    ]
+    with transaction.atomic():
+        CellSpeed.objects.all().delete()
+        CellSpeed.objects.bulk_create(rows, batch_size=1000)
+
+    reload_speed_table()
+    logger.info(f"Learned speeds for {len(rows)} cell/hour bucket(s) from the last {days} day(s)")
+    return len(rows)
@@ -0,0 +1,118 @@
+"""
+Adaptive Location Cadence
+
+Tells driver devices how often to report their position, so the backend
+only receives the fixes dispatch and tracking actually need.
+
+- The base recommendation depends on the driver's availability state:
+  on-trip and offered drivers report often, idle drivers rarely, offline
+  drivers almost never.
+- Idle drivers in a cell with open bookings are tightened, since they are
+  about to be matched there.
+- Open-booking counts per grid cell are computed in one query and cached
+  for DEMAND_REFRESH_SECONDS.
+
+record_ingest()/ingest_stats() keep per-minute counters of stored fixes in
+the cache, so the effect on ingest load can be watched.
+"""
+
+from math import floor
+import logging
+import time
+
+from django.core.cache import cache
+
+from .spatial_index import GRID_CELL_SIZE_DEG
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# state -> (interval seconds, minimum displacement metres)
+CADENCE_BY_STATE = {
+    'offline': (300, 500),
+    'idle': (30, 100),
+    'offered': (5, 20),
+    'on_trip': (4, 10),
+}
+HIGH_DEMAND_IDLE_CADENCE = (10, 30)   # Idle driver in a cell with open bookings
+HIGH_DEMAND_BOOKINGS = 1              # Open bookings in the cell to count as demand
+DEMAND_REFRESH_SECONDS = 30
+INGEST_WINDOW_MINUTES = 5
+DEMAND_CACHE_KEY = 'location_cadence:demand'
+INGEST_CACHE_KEY_PREFIX = 'location_ingest:'
+
+
+def _cell(lat, lon):
+    return int(floor(float(lat) / GRID_CELL_SIZE_DEG)), int(floor(float(lon) / GRID_CELL_SIZE_DEG))
+
+
+def demand_by_cell():
+    """
+    Open ('searching_driver') bookings per grid cell, cached.
+    Returns: {(row, col): count}
+    """
+    from .models import Booking
+
+    demand = cache.get(DEMAND_CACHE_KEY)
+    if demand is not None:
+        return demand
+
+    demand = {}
+    pickups = Booking.objects.filter(
+        status='searching_driver',
+        pickup_latitude__isnull=False,
+        pickup_longitude__isnull=False
+    ).values_list('pickup_latitude', 'pickup_longitude')
+    for lat, lon in pickups:
+        cell = _cell(lat, lon)
+        demand[cell] = demand.get(cell, 0) + 1
+
+    cache.set(DEMAND_CACHE_KEY, demand, DEMAND_REFRESH_SECONDS)
+    return demand
+
+
+def recommend(driver_id, lat=None, lon=None, state=None):
+    """
+    Recommended reporting cadence for a driver at (lat, lon).
+    Returns: dict with interval_seconds and min_distance_m
+    """
+    from . import driver_state
+
+    state = state or driver_state.get_state(driver_id)
+    interval, distance = CADENCE_BY_STATE.get(state, CADENCE_BY_STATE['idle'])
+
+    if state == 'idle' and lat is not None and lon is not None:
+        if demand_by_cell().get(_cell(lat, lon), 0) >= HIGH_DEMAND_BOOKINGS:
+            interval, distance = HIGH_DEMAND_IDLE_CADENCE
+
+    return {'interval_seconds': interval, 'min_distance_m': distance}
+
+
+def record_ingest(count=1):
+    """Count fixes written to the live location store in the current minute."""
+    key = f"{INGEST_CACHE_KEY_PREFIX}{int(time.time() // 60)}"
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        # First fix of the minute (a concurrent add just means we lost the race)
+        if not cache.add(key, count, (INGEST_WINDOW_MINUTES + 1) * 60):
+            cache.incr(key, count)
+
+
+def ingest_stats():
+    """
+    Location ingest rate over the last minutes.
+    Returns: dict with per-minute counts (oldest first) and fixes per second
+    """
+    current = int(time.time() // 60)
+    minutes = list(range(current - INGEST_WINDOW_MINUTES, current + 1))
+    counts = cache.get_many([f"{INGEST_CACHE_KEY_PREFIX}{minute}" for minute in minutes])
+    per_minute = [counts.get(f"{INGEST_CACHE_KEY_PREFIX}{minute}", 0) for minute in minutes]
+
+    # The current minute is still filling up; rates use completed minutes
+    completed = per_minute[:-1]
+    return {
+        'per_minute': per_minute,
+        'fixes_per_second_1m': completed[-1] / 60 if completed else 0,
+        'fixes_per_second_5m': sum(completed) / (60 * len(completed)) if completed else 0,
+    }
@@ -0,0 +1,333 @@
+"""
+Live Driver Location Store
+
+Latest GPS fix per driver, kept in the Django cache so every worker process
+sees the same positions, with write-behind persistence to the Driver table.
+
+- record() writes the fix to the cache and marks the driver dirty in this
+  process. Nothing is written to the database on the request path.
+- Dirty fixes are flushed with bulk UPDATEs of current_latitude,
+  current_longitude and location_updated_at at most every
+  FLUSH_INTERVAL_SECONDS (or once FLUSH_MAX_PENDING drivers are waiting),
+  and when the process exits. A background thread flushes whatever is still
+  pending once the interval has passed, so the last fix of a driver who
+  stopped sending is not left waiting for the next ping to this process.
+  The UPDATE only touches rows whose stored fix is older, so a process
+  flushing a stale buffer cannot overwrite a newer position written by
+  another process.
+- Readers (dispatch, tracking) overlay the store on the Driver rows they
+  load, so they see a position at most one ping old instead of one flush old.
+- Every fix is also handed to corporate.trip_trail, which keeps it if the
+  driver is on a trip, and then to corporate.trip_tracking, which pushes it
+  to the customer.
+- Buffered fixes replayed by a device arrive through ingest_batch(): only the
+  newest becomes the live position, all of them go to the trip trail as one
+  segment.
+
+The cache must be shared between workers (settings.CACHE_URL) for the store
+to be shared; with the default local-memory cache each process sees only the
+fixes it received itself and falls back to the database for the rest.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import atexit
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+LOCATION_TTL_SECONDS = 60 * 60     # Drop fixes from the cache after an hour of silence
+FLUSH_INTERVAL_SECONDS = 5         # Write-behind period
+FLUSH_MAX_PENDING = 500            # Flush early once this many drivers are dirty
+FLUSH_BATCH_SIZE = 100             # Drivers per UPDATE; keeps SQLite under its parameter limit
+MAX_CLOCK_SKEW_SECONDS = 60        # Reject fixes timestamped further ahead than this
+MAX_FIX_AGE_SECONDS = 24 * 60 * 60 # Reject fixes older than this
+EPOCH_MS_THRESHOLD = 1e11          # Numeric timestamps above this are epoch milliseconds
+MAX_BATCH_FIXES = 500              # Fixes accepted per batch upload; the rest are discarded
+CACHE_KEY_PREFIX = 'driver_location:'
+
+
+def _key(driver_id):
+    return f"{CACHE_KEY_PREFIX}{driver_id}"
+
+
+def _decode(value):
+    """Cached (lat, lon, epoch) -> (lat, lon, aware datetime)."""
+    lat, lon, epoch = value
+    return lat, lon, datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def parse_fix(data):
+    """
+    Validate a fix from a client payload with 'latitude', 'longitude' and an
+    optional 'timestamp' (ISO 8601, epoch seconds or epoch milliseconds;
+    defaults to now). Timestamps must lie within MAX_FIX_AGE_SECONDS in the
+    past and MAX_CLOCK_SKEW_SECONDS in the future.
+    Raises ValueError with a client-facing message when the fix is unusable.
+    Returns: (lat, lon, recorded_at)
+    """
+    try:
+        lat = float(data.get('latitude'))
+        lon = float(data.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError('Latitude and longitude must be numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Latitude or longitude out of range')
+
+    timestamp = data.get('timestamp')
+    now = timezone.now()
+    if timestamp is None or timestamp == '':
+        recorded_at = now
+    elif isinstance(timestamp, bool):
+        raise ValueError('Invalid timestamp')
+    elif isinstance(timestamp, (int, float)):
+        if abs(timestamp) > EPOCH_MS_THRESHOLD:
+            timestamp = timestamp / 1000
+        try:
+            recorded_at = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('Invalid timestamp')
+    else:
+        recorded_at = parse_datetime(str(timestamp))
+        if recorded_at is None:
+            raise ValueError('Invalid timestamp')
+        if timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at, dt_timezone.utc)
+
+    age = (now - recorded_at).total_seconds()
+    if age < -MAX_CLOCK_SKEW_SECONDS:
+        raise ValueError('Timestamp is in the future')
+    if age > MAX_FIX_AGE_SECONDS:
+        raise ValueError('Timestamp is too old')
+    return lat, lon, recorded_at
+
+
+_pending = {}        # driver id -> (lat, lon, epoch) waiting to be flushed
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flusher = None      # Background flush thread, started by the first record()
+
+
+def _flush_periodically():
+    from django.db import close_old_connections
+
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        if _pending and time.monotonic() - _last_flush >= FLUSH_INTERVAL_SECONDS:
+            try:
+                flush()
+            finally:
+                close_old_connections()
+
+
+def _start_flusher():
+    global _flusher
+    with _pending_lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_flush_periodically, name='location-flush', daemon=True)
+    _flusher.start()
+
+
+def record(driver_id, lat, lon, at=None):
+    """
+    Store a driver's latest fix.
+    The database is only touched when a write-behind flush is due.
+    """
+    from . import driver_presence, location_cadence, trip_meter, trip_trail, trip_tracking
+
+    at = at or timezone.now()
+    value = (float(lat), float(lon), at.timestamp())
+    cache.set(_key(driver_id), value, LOCATION_TTL_SECONDS)
+    booking_id = trip_trail.append(driver_id, [(value[2], value[0], value[1])])
+    if booking_id is not None:
+        trip_meter.add_fixes(booking_id, [(value[2], value[0], value[1])])
+        trip_tracking.on_fix(booking_id, driver_id, *value)
+    location_cadence.record_ingest()
+    driver_presence.heartbeat(driver_id)
+
+    if _flusher is None:
+        _start_flusher()
+    with _pending_lock:
+        _pending[driver_id] = value
+        due = (
+            len(_pending) >= FLUSH_MAX_PENDING
+            or time.monotonic() - _last_flush >= FLUSH_INTERVAL_SECONDS
+        )
+    if due:
+        flush()
+
+
+def get(driver_id):
+    """
+    Latest fix for a driver.
+    Returns: (lat, lon, recorded_at) or None if the store has nothing
+    """
+    value = cache.get(_key(driver_id))
+    return _decode(value) if value else None
+
+
+def get_many(driver_ids):
+    """
+    Latest fixes for several drivers in one cache round trip.
+    Returns: {driver_id: (lat, lon, recorded_at)} for drivers the store knows
+    """
+    keys = {_key(driver_id): driver_id for driver_id in driver_ids}
+    if not keys:
+        return {}
+    found = cache.get_many(list(keys))
+    return {keys[key]: _decode(value) for key, value in found.items()}
+
+
+def apply_to(drivers):
+    """
+    Overwrite the position fields of loaded Driver instances with newer
+    fixes from the store. Modifies the instances in place.
+    Returns: the same drivers
+    """
+    drivers = list(drivers)
+    fixes = get_many(driver.id for driver in drivers)
+    for driver in drivers:
+        fix = fixes.get(driver.id)
+        if fix is None:
+            continue
+        lat, lon, recorded_at = fix
+        if driver.location_updated_at is None or recorded_at >= driver.location_updated_at:
+            driver.current_latitude = lat
+            driver.current_longitude = lon
+            driver.location_updated_at = recorded_at
+    return drivers
+
+
+def _write_newer(rows):
+    """
+    One conditional UPDATE for (driver_id, lat, lon, recorded_at) rows; a
+    row is only written where the stored location_updated_at is older.
+    Returns: number of drivers written
+    """
+    from django.db.models import Case, Q, Value, When
+    from .models import Driver
+
+    def column(name, values):
+        field = Driver._meta.get_field(name)
+        return Case(
+            *[When(id=driver_id, then=Value(value, output_field=field)) for driver_id, value in values],
+            output_field=field
+        )
+
+    recorded_at = column('location_updated_at', [(row[0], row[3]) for row in rows])
+    return Driver.objects.filter(
+        Q(location_updated_at__isnull=True) | Q(location_updated_at__lt=recorded_at),
+        id__in=[row[0] for row in rows],
+    ).update(
+        current_latitude=column('current_latitude', [(row[0], row[1]) for row in rows]),
+        current_longitude=column('current_longitude', [(row[0], row[2]) for row in rows]),
+        location_updated_at=recorded_at,
+    )
+
+
+def flush():
+    """
+    Persist this process's pending fixes with bulk updates.
+    Returns: number of drivers written
+    """
+    global _last_flush
+
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    if not batch:
+        return 0
+
+    rows = [
+        (
+            driver_id,
+            Decimal(str(round(lat, 7))),
+            Decimal(str(round(lon, 7))),
+            datetime.fromtimestamp(epoch, tz=dt_timezone.utc),
+        )
+        for driver_id, (lat, lon, epoch) in batch.items()
+    ]
+    written = 0
+    try:
+        for start in range(0, len(rows), FLUSH_BATCH_SIZE):
+            written += _write_newer(rows[start:start + FLUSH_BATCH_SIZE])
+    except Exception as e:
+        # Put the fixes back unless a newer one arrived meanwhile
+        with _pending_lock:
+            for driver_id, value in batch.items():
+                _pending.setdefault(driver_id, value)
+        logger.error(f"Driver location flush failed: {e}")
+        return 0
+
+    logger.debug(f"Flushed {written} of {len(rows)} driver location(s)")
+    return written
+
+
+def ingest_batch(driver_id, items):
+    """
+    Ingest a batch of buffered fixes from a driver device.
+
+    Invalid, duplicate and over-limit fixes are discarded. The newest valid
+    fix becomes the live position unless the store or the Driver row already
+    holds a newer one; the older ones are written to the driver's trip trail
+    as one segment.
+
+    Returns: dict with accepted/discarded counts and the applied fix (or None)
+    """
+    from .models import Driver
+    from . import location_cadence, trip_meter, trip_trail
+
+    fixes = {}
+    discarded = max(0, len(items) - MAX_BATCH_FIXES)
+    for item in items[:MAX_BATCH_FIXES]:
+        try:
+            lat, lon, recorded_at = parse_fix(item)
+        except (AttributeError, TypeError, ValueError, OverflowError, OSError):
+            discarded += 1
+            continue
+        if recorded_at in fixes:
+            discarded += 1  # Same instant sent twice
+            continue
+        fixes[recorded_at] = (lat, lon)
+
+    if not fixes:
+        return {'accepted': 0, 'discarded': discarded, 'applied': None}
+
+    ordered = sorted(fixes.items())
+    newest_at, (newest_lat, newest_lon) = ordered[-1]
+
+    # The cached fix expires after LOCATION_TTL_SECONDS; the flushed column does not
+    current_at = Driver.objects.filter(id=driver_id).values_list('location_updated_at', flat=True).first()
+    current = get(driver_id)
+    if current and (current_at is None or current[2] > current_at):
+        current_at = current[2]
+
+    applied = None
+    if current_at is None or newest_at > current_at:
+        ordered.pop()
+        applied = (newest_lat, newest_lon, newest_at)
+
+    # Older fixes first, so the trip meter sees the whole batch in time order
+    points = [(recorded_at.timestamp(), lat, lon) for recorded_at, (lat, lon) in ordered]
+    booking_id = trip_trail.append(driver_id, points, flush=True)
+    trip_meter.add_fixes(booking_id, points)
+    if ordered:
+        location_cadence.record_ingest(len(ordered))
+
+    if applied:
+        record(driver_id, newest_lat, newest_lon, newest_at)
+
+    return {'accepted': len(fixes), 'discarded': discarded, 'applied': applied}
+
+
+atexit.register(flush)
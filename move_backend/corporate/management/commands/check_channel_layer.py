@@ -0,0 +1,41 @@
+import asyncio
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Send a message through the configured channel layer group and read it back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=5, help='Seconds to wait for the message')
+
+    def handle(self, *args, **options):
+        layer = get_channel_layer()
+        if layer is None:
+            raise CommandError('CHANNEL_LAYERS is not configured')
+        self.stdout.write(f"Backend: {settings.CHANNEL_LAYERS['default']['BACKEND']}")
+
+        try:
+            elapsed = async_to_sync(self._round_trip)(layer, options['timeout'])
+        except Exception as e:
+            raise CommandError(f"Channel layer round trip failed: {e!r}")
+        self.stdout.write(self.style.SUCCESS(f"Group send delivered in {elapsed * 1000:.1f} ms"))
+
+    async def _round_trip(self, layer, timeout):
+        group = f"layer_check_{uuid.uuid4().hex}"
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        try:
+            started = time.monotonic()
+            await layer.group_send(group, {'type': 'layer.check', 'group': group})
+            message = await asyncio.wait_for(layer.receive(channel), timeout)
+            if message.get('group') != group:
+                raise CommandError(f"Unexpected message {message!r}")
+            return time.monotonic() - started
+        finally:
+            await layer.group_discard(group, channel)
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from corporate.models import ServiceZone
+from corporate.zone_index import validate_polygon
+from provider_service.models import ProviderService
+from service_provider.models import ServiceProvider
+
+
+def _city_names(value):
+    return {city.strip().lower() for city in (value or '').split(',') if city.strip()}
+
+
+class Command(BaseCommand):
+    help = 'Create or update service zones from a GeoJSON FeatureCollection of named polygons'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='GeoJSON file; each feature needs a "name" property')
+        parser.add_argument(
+            '--link-cities',
+            action='store_true',
+            help='Link provider services and providers whose city lists mention a zone by name',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path']) as f:
+                features = json.load(f).get('features', [])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+
+        zones = []
+        for feature in features:
+            properties = feature.get('properties') or {}
+            geometry = feature.get('geometry') or {}
+            name = properties.get('name')
+            if not name or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+                self.stderr.write(f"Skipping feature without a name or polygon: {properties}")
+                continue
+
+            # Outer ring of every polygon; GeoJSON positions are [longitude, latitude]
+            polygons = geometry.get('coordinates') or []
+            if geometry['type'] == 'Polygon':
+                polygons = [polygons]
+            try:
+                parts = [
+                    [[lat, lon] for lat, lon in validate_polygon([[p[1], p[0]] for p in rings[0]])]
+                    for rings in polygons
+                ]
+                if not parts:
+                    raise ValueError('no polygons')
+            except (ValueError, IndexError, TypeError) as e:
+                self.stderr.write(f"Skipping zone {name}: {e}")
+                continue
+            polygon = parts[0] if len(parts) == 1 else parts
+
+            zone, _ = ServiceZone.objects.update_or_create(
+                name=name,
+                defaults={'polygon': polygon, 'priority': properties.get('priority', 0), 'is_active': True}
+            )
+            zones.append(zone)
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(zones)} service zone(s)"))
+
+        if options['link_cities']:
+            links = 0
+            for zone in zones:
+                name = zone.name.lower()
+                services = [
+                    service for service in ProviderService.objects.exclude(available_cities='')
+                    if name in _city_names(service.available_cities)
+                ]
+                providers = [
+                    provider for provider in ServiceProvider.objects.all()
+                    if name in _city_names(provider.operating_cities) or name == provider.city.strip().lower()
+                ]
+                zone.provider_services.add(*services)
+                zone.service_providers.add(*providers)
+                links += len(services) + len(providers)
+            self.stdout.write(self.style.SUCCESS(f"Linked {links} service(s)/provider(s) by city name"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from corporate.eta_service import LEARNING_WINDOW_DAYS, learn_speeds
+
+
+class Command(BaseCommand):
+    help = 'Learn average travel speeds per grid cell and hour of week from completed trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=LEARNING_WINDOW_DAYS,
+            help='How many days of completed trips to learn from',
+        )
+
+    def handle(self, *args, **options):
+        count = learn_speeds(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Stored speeds for {count} cell/hour bucket(s)"))
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from corporate.batch_dispatch import run_batch_cycle
+
+
+class Command(BaseCommand):
+    help = 'Match pending bookings to free drivers in periodic batch cycles'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'DISPATCH_BATCH_INTERVAL_SECONDS', 5),
+            help='Seconds between cycles',
+        )
+        parser.add_argument('--once', action='store_true', help='Run a single cycle and exit')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            started = time.monotonic()
+            try:
+                offers = run_batch_cycle()
+                if offers:
+                    self.stdout.write(self.style.SUCCESS(f"Created {len(offers)} offer(s)"))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Batch dispatch cycle failed: {e}"))
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from corporate import dispatch_queue
+
+
+class Command(BaseCommand):
+    help = 'Consume the dispatch queue and dispatch new bookings to drivers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=dispatch_queue.WORKER_POLL_SECONDS,
+            help='Seconds to wait when the queue is empty',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=dispatch_queue.WORKER_BATCH_SIZE,
+            help='Jobs claimed per poll',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Dispatch worker started'))
+        dispatch_queue.run_worker(
+            poll_interval=options['poll_interval'],
+            batch_size=options['batch_size'],
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from corporate.offer_scheduler import OfferExpiryScheduler
+
+
+class Command(BaseCommand):
+    help = 'Expire ride offers at their deadline and re-dispatch the booking'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Offer expiry scheduler started'))
+        OfferExpiryScheduler().run_forever()
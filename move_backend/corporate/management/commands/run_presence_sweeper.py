@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from corporate.driver_presence import SWEEP_INTERVAL_SECONDS, sweep
+
+
+class Command(BaseCommand):
+    help = 'Switch online drivers without a recent heartbeat offline, and back online when they return'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=SWEEP_INTERVAL_SECONDS,
+            help='Seconds between sweeps',
+        )
+        parser.add_argument('--once', action='store_true', help='Run a single sweep and exit')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            started = time.monotonic()
+            try:
+                offline, restored = sweep()
+                if offline or restored:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{offline} driver(s) switched offline, {restored} restored"
+                    ))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Presence sweep failed: {e}"))
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
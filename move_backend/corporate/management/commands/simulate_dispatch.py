@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from corporate.dispatch_simulator import (
+    DEFAULT_CENTER_LAT,
+    DEFAULT_CENTER_LON,
+    DEFAULT_RADIUS_KM,
+    DispatchSimulation,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark dispatch against a synthetic fleet and a Poisson booking stream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=500, help='Synthetic drivers to seed')
+        parser.add_argument('--bookings', type=int, default=200, help='Bookings to replay')
+        parser.add_argument('--rate', type=float, default=30, help='Bookings per minute')
+        parser.add_argument('--accept', type=float, default=0.7, help='Probability a driver accepts')
+        parser.add_argument('--decline', type=float, default=0.2, help='Probability a driver declines')
+        parser.add_argument('--lat', type=float, default=DEFAULT_CENTER_LAT, help='City centre latitude')
+        parser.add_argument('--lon', type=float, default=DEFAULT_CENTER_LON, help='City centre longitude')
+        parser.add_argument('--radius-km', type=float, default=DEFAULT_RADIUS_KM, help='City radius')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for repeatable runs')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        simulation = DispatchSimulation(
+            drivers=options['drivers'],
+            bookings=options['bookings'],
+            bookings_per_minute=options['rate'],
+            accept_probability=options['accept'],
+            decline_probability=options['decline'],
+            center_lat=options['lat'],
+            center_lon=options['lon'],
+            radius_km=options['radius_km'],
+            seed=options['seed'],
+        )
+        report = simulation.run(keep=options['keep'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        latency = report['dispatch_latency_ms']
+        queries = report['queries_per_dispatch']
+        assignment = report['time_to_assignment_s']
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['bookings']} bookings, {report['drivers']} drivers: "
+            f"{report['assigned']} assigned, {report['unassigned']} unassigned"
+        ))
+        self.stdout.write(
+            f"Dispatch latency (ms): p50={latency['p50']:.2f} p90={latency['p90']:.2f} "
+            f"p99={latency['p99']:.2f} max={latency['max']:.2f} over {report['dispatch_calls']} calls"
+        )
+        self.stdout.write(f"Queries per dispatch: mean={queries['mean']:.1f} max={queries['max']}")
+        self.stdout.write(f"Offers per booking: {report['offers_per_booking']:.2f}")
+        self.stdout.write(
+            f"Time to assignment (s): p50={assignment['p50']:.1f} p90={assignment['p90']:.1f} "
+            f"max={assignment['max']:.1f}"
+        )
@@ -11,6 +11,13 @@ class Migration(migrations.Migration):
         ('corporate', '0001_initial'),
     ]
 
+    # Customer is AUTH_USER_MODEL; the swappable dependency of other apps'
+    # first migrations resolves to corporate 0001, which does not create it
+    run_before = [
+        ('admin', '0001_initial'),
+        ('authtoken', '0001_initial'),
+    ]
+
     operations = [
         migrations.CreateModel(
             name='Customer',
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0022_sitesetting'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='rideoffer',
+            name='unique_pending_offer_per_booking',
+        ),
+        migrations.AddConstraint(
+            model_name='rideoffer',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('booking', 'driver'), name='unique_pending_offer_per_booking_driver'),
+        ),
+    ]
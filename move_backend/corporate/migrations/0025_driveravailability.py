@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+ACTIVE_TRIP_STATUSES = ['driver_assigned', 'driver_arrived', 'picked_up']
+
+
+def populate_availability(apps, schema_editor):
+    """
+    Derive each driver's state from the old is_online flag and active bookings.
+    Drivers that were switched offline only because they were busy get
+    is_online back, since the flag no longer doubles as "busy".
+    """
+    Driver = apps.get_model('corporate', 'Driver')
+    Booking = apps.get_model('corporate', 'Booking')
+    DriverAvailability = apps.get_model('corporate', 'DriverAvailability')
+
+    on_trip_ids = set(
+        Booking.objects.filter(status__in=ACTIVE_TRIP_STATUSES, driver__isnull=False)
+        .values_list('driver_id', flat=True)
+    )
+    Driver.objects.filter(id__in=on_trip_ids).update(is_online=True)
+
+    rows = []
+    for driver_id, is_online in Driver.objects.values_list('id', 'is_online'):
+        if driver_id in on_trip_ids:
+            state = 'on_trip'
+        elif is_online:
+            state = 'idle'
+        else:
+            state = 'offline'
+        rows.append(DriverAvailability(driver_id=driver_id, state=state))
+    DriverAvailability.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0024_dispatchjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverAvailability',
+            fields=[
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='availability', serialize=False, to='corporate.driver')),
+                ('state', models.CharField(choices=[('offline', 'Offline'), ('idle', 'Idle'), ('offered', 'Offered'), ('on_trip', 'On Trip')], db_index=True, default='offline', max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'driver availability',
+            },
+        ),
+        migrations.RunPython(populate_availability, migrations.RunPython.noop),
+    ]
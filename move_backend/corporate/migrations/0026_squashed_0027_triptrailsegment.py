@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:36
+# Squashes 0026_driverlocationfix and 0027_triptrailsegment, so a fresh
+# database never creates the per-point DriverLocationFix table that 0027
+# replaced with trail segments. The replaced migrations stay until every
+# deployment has applied them.
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    replaces = [
+        ('corporate', '0026_driverlocationfix'),
+        ('corporate', '0027_triptrailsegment'),
+    ]
+
+    dependencies = [
+        ('corporate', '0025_driveravailability'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTrailSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trail_segments', to='corporate.booking')),
+                ('driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trail_segments', to='corporate.driver')),
+            ],
+            options={
+                'ordering': ['booking', 'started_at'],
+                'indexes': [models.Index(fields=['booking', 'started_at'], name='trailsegment_booking_started')],
+            },
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+COORD_SCALE = 100000   # Trail codec of corporate.trip_trail, frozen for this migration
+TIME_SCALE = 10
+
+
+def _write_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_points(points, base_epoch):
+    out = bytearray()
+    prev_t, prev_lat, prev_lon = round(base_epoch * TIME_SCALE), 0, 0
+    for epoch, lat, lon in points:
+        t, qlat, qlon = round(epoch * TIME_SCALE), round(lat * COORD_SCALE), round(lon * COORD_SCALE)
+        _write_varint(out, t - prev_t)
+        _write_varint(out, qlat - prev_lat)
+        _write_varint(out, qlon - prev_lon)
+        prev_t, prev_lat, prev_lon = t, qlat, qlon
+    return bytes(out)
+
+
+def fixes_to_segments(apps, schema_editor):
+    """Re-encode per-point trip fixes as one trail segment per booking."""
+    DriverLocationFix = apps.get_model('corporate', 'DriverLocationFix')
+    TripTrailSegment = apps.get_model('corporate', 'TripTrailSegment')
+
+    by_booking = {}
+    fixes = (
+        DriverLocationFix.objects.filter(booking__isnull=False)
+        .order_by('booking_id', 'recorded_at')
+        .values_list('booking_id', 'driver_id', 'recorded_at', 'latitude', 'longitude')
+    )
+    for booking_id, driver_id, recorded_at, lat, lon in fixes.iterator():
+        by_booking.setdefault(booking_id, (driver_id, []))[1].append((recorded_at, float(lat), float(lon)))
+
+    for booking_id, (driver_id, rows) in by_booking.items():
+        points = [(recorded_at.timestamp(), lat, lon) for recorded_at, lat, lon in rows]
+        TripTrailSegment.objects.create(
+            booking_id=booking_id,
+            driver_id=driver_id,
+            started_at=rows[0][0],
+            ended_at=rows[-1][0],
+            point_count=len(points),
+            data=encode_points(points, points[0][0]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0026_driverlocationfix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTrailSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trail_segments', to='corporate.booking')),
+                ('driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trail_segments', to='corporate.driver')),
+            ],
+            options={
+                'ordering': ['booking', 'started_at'],
+            },
+        ),
+        migrations.RunPython(fixes_to_segments, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='DriverLocationFix',
+        ),
+        migrations.AddIndex(
+            model_name='triptrailsegment',
+            index=models.Index(fields=['booking', 'started_at'], name='trailsegment_booking_started'),
+        ),
+    ]
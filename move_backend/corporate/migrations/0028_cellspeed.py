@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0026_squashed_0027_triptrailsegment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CellSpeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_row', models.IntegerField()),
+                ('cell_col', models.IntegerField()),
+                ('hour_of_week', models.PositiveSmallIntegerField()),
+                ('speed_kmh', models.FloatField()),
+                ('sample_seconds', models.PositiveIntegerField(help_text='Travel time the average is based on')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cell_row', 'cell_col', 'hour_of_week'), name='unique_cell_speed_per_hour')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0028_cellspeed'),
+        ('provider_service', '0002_riderequest'),
+        ('service_provider', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('polygon', models.JSONField(help_text='List of [latitude, longitude] vertices')),
+                ('priority', models.IntegerField(default=0, help_text='Wins over lower-priority zones it overlaps')),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('provider_services', models.ManyToManyField(blank=True, related_name='service_zones', to='provider_service.providerservice')),
+                ('service_providers', models.ManyToManyField(blank=True, related_name='service_zones', to='service_provider.serviceprovider')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='service_zone',
+            field=models.ForeignKey(blank=True, help_text='Zone containing the pickup, set on creation', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bookings', to='corporate.servicezone'),
+        ),
+    ]
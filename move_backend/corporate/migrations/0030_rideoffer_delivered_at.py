@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0029_servicezone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rideoffer',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, help_text="When the driver's app acknowledged the pushed offer", null=True),
+        ),
+    ]
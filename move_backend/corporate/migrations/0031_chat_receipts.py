@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0030_rideoffer_delivered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, help_text="When the recipient's app received it", null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
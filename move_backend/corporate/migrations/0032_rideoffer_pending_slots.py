@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+from django.db import migrations, models
+
+
+def number_pending_offers(apps, schema_editor):
+    """
+    Make existing pending offers satisfy the new constraints: a driver keeps
+    only their newest pending offer (older ones are expired), and the pending
+    offers of each booking are numbered 0..n-1 in offer order.
+    """
+    RideOffer = apps.get_model('corporate', 'RideOffer')
+
+    pending = RideOffer.objects.filter(status='pending')
+    seen_drivers = set()
+    duplicate_ids = []
+    for offer_id, driver_id in pending.order_by('-offered_at', '-id').values_list('id', 'driver_id'):
+        if driver_id in seen_drivers:
+            duplicate_ids.append(offer_id)
+        seen_drivers.add(driver_id)
+    RideOffer.objects.filter(id__in=duplicate_ids).update(status='expired')
+
+    slots = {}
+    for offer_id, booking_id in pending.order_by('offer_order', 'id').values_list('id', 'booking_id'):
+        slot = slots.get(booking_id, 0)
+        slots[booking_id] = slot + 1
+        if slot:
+            RideOffer.objects.filter(id=offer_id).update(slot=slot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0031_chat_receipts'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='rideoffer',
+            name='unique_pending_offer_per_booking_driver',
+        ),
+        migrations.AddField(
+            model_name='rideoffer',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Position within its dispatch round (always 0 in sequential mode)'),
+        ),
+        migrations.RunPython(number_pending_offers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rideoffer',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('driver',), name='unique_pending_offer_per_driver'),
+        ),
+        migrations.AddConstraint(
+            model_name='rideoffer',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('booking', 'slot'), name='unique_pending_offer_per_booking_slot'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corporate', '0032_rideoffer_pending_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driveravailability',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, help_text='Last heartbeat from the driver app', null=True),
+        ),
+        migrations.AddField(
+            model_name='driveravailability',
+            name='presence_lost_at',
+            field=models.DateTimeField(blank=True, help_text='Switched offline by the presence sweep for missing heartbeats', null=True),
+        ),
+    ]
@@ -164,6 +164,34 @@ class Driver(AbstractBaseUser, PermissionsMixin):
         """Check if driver is eligible to receive ride requests"""
         return self.has_uploaded_documents() and self.is_approved and self.otp_verified
     
+class DriverAvailability(models.Model):
+    """
+    Compact "can this driver take a ride right now" record, one row per driver.
+    Kept separate from the wide Driver row and changed only through the
+    conditional transitions in corporate.driver_state.
+    """
+    STATE_CHOICES = [
+        ('offline', 'Offline'),   # Not working
+        ('idle', 'Idle'),         # Online and free for offers
+        ('offered', 'Offered'),   # Holding a pending ride offer
+        ('on_trip', 'On Trip'),   # Assigned to a booking
+    ]
+    
+    driver = models.OneToOneField(Driver, on_delete=models.CASCADE, primary_key=True, related_name='availability')
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='offline', db_index=True)
+    last_seen_at = models.DateTimeField(null=True, blank=True, help_text='Last heartbeat from the driver app')
+    presence_lost_at = models.DateTimeField(
+        null=True, blank=True, help_text='Switched offline by the presence sweep for missing heartbeats'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'driver availability'
+    
+    def __str__(self):
+        return f"Driver #{self.driver_id} - {self.state}"
+
+
 from django.db import models
 
 class Advert(models.Model):
@@ -224,6 +252,51 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.username
 
+
+class ServiceZone(models.Model):
+    """
+    Geographic service area. Looked up by coordinate through the in-memory
+    grid in corporate.zone_index rather than queried directly.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    polygon = models.JSONField(help_text='List of [latitude, longitude] vertices')
+    priority = models.IntegerField(default=0, help_text='Wins over lower-priority zones it overlaps')
+    is_active = models.BooleanField(default=True)
+    provider_services = models.ManyToManyField(
+        'provider_service.ProviderService', related_name='service_zones', blank=True
+    )
+    service_providers = models.ManyToManyField(
+        'service_provider.ServiceProvider', related_name='service_zones', blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        from .zone_index import validate_polygons
+
+        try:
+            validate_polygons(self.polygon)
+        except ValueError as e:
+            raise ValidationError({'polygon': str(e)})
+
+    def save(self, *args, **kwargs):
+        from .zone_index import invalidate
+
+        super().save(*args, **kwargs)
+        invalidate()
+
+    def delete(self, *args, **kwargs):
+        from .zone_index import invalidate
+
+        result = super().delete(*args, **kwargs)
+        invalidate()
+        return result
+
+    def __str__(self):
+        return self.name
+
+
 class Booking(models.Model):
     RIDE_TYPE_CHOICES = [
         ('standard', 'MOVE Standard'),
@@ -262,6 +335,10 @@ class Booking(models.Model):
     pickup_longitude = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
     destination_latitude = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
     destination_longitude = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
+    service_zone = models.ForeignKey(
+        ServiceZone, on_delete=models.SET_NULL, related_name='bookings', null=True, blank=True,
+        help_text='Zone containing the pickup, set on creation'
+    )
     
     fare = models.DecimalField(max_digits=10, decimal_places=2)
     distance = models.DecimalField(max_digits=10, decimal_places=2, help_text='Distance in kilometers')
@@ -331,6 +408,8 @@ class ChatMessage(models.Model):
     
     message = models.TextField()
     is_read = models.BooleanField(default=False)
+    delivered_at = models.DateTimeField(null=True, blank=True, help_text="When the recipient's app received it")
+    read_at = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -344,7 +423,8 @@ class ChatMessage(models.Model):
 class RideOffer(models.Model):
     """
     Tracks individual ride offers sent to drivers.
-    Implements sequential offer dispatch - one driver at a time with timeout.
+    Implements sequential offer dispatch - one driver at a time with timeout -
+    or parallel top-K offers with first-accept-wins (settings.DISPATCH_MODE).
     """
     STATUS_CHOICES = [
         ('pending', 'Pending'),      # Offer sent, waiting for response
@@ -363,22 +443,32 @@ class RideOffer(models.Model):
     driver_score = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True,
                                         help_text='Calculated score for this driver')
     offer_order = models.IntegerField(default=1, help_text='Order in which this offer was sent (1=first)')
+    slot = models.PositiveSmallIntegerField(default=0, help_text='Position within its dispatch round (always 0 in sequential mode)')
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
     offered_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(help_text='When this offer expires')
     responded_at = models.DateTimeField(null=True, blank=True, help_text='When driver responded')
+    delivered_at = models.DateTimeField(null=True, blank=True, help_text="When the driver's app acknowledged the pushed offer")
     
     class Meta:
         ordering = ['-offered_at']
-        # Ensure only one pending offer per booking at a time
+        # A driver holds at most one pending offer. A booking holds at most
+        # one pending offer per slot: sequential mode only uses slot 0, so it
+        # gets one outstanding offer per booking, and parallel mode numbers
+        # the offers of a round 0..K-1.
         constraints = [
             models.UniqueConstraint(
-                fields=['booking'],
+                fields=['driver'],
                 condition=models.Q(status='pending'),
-                name='unique_pending_offer_per_booking'
-            )
+                name='unique_pending_offer_per_driver'
+            ),
+            models.UniqueConstraint(
+                fields=['booking', 'slot'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_offer_per_booking_slot'
+            ),
         ]
     
     def __str__(self):
@@ -398,6 +488,91 @@ class RideOffer(models.Model):
         return max(0, int(remaining))
 
 
+class DispatchJob(models.Model):
+    """
+    Queue entry asking the dispatch worker to dispatch a booking.
+    Created by booking creation; consumed by `manage.py run_dispatch_worker`.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),          # Waiting for a worker
+        ('processing', 'Processing'),  # Claimed by a worker
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='dispatch_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['enqueued_at']
+        indexes = [
+            models.Index(fields=['status', 'enqueued_at'], name='dispatchjob_status_enqueued'),
+        ]
+    
+    def __str__(self):
+        return f"Dispatch job #{self.id} for Booking #{self.booking_id} - {self.status}"
+
+
+class TripTrailSegment(models.Model):
+    """
+    A stretch of the path a booking took, as delta/varint encoded points.
+    Written and decoded by corporate.trip_trail.
+    """
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='trail_segments')
+    driver = models.ForeignKey(
+        Driver,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='trail_segments'
+    )
+    started_at = models.DateTimeField()  # Time of the first point
+    ended_at = models.DateTimeField()    # Time of the last point
+    point_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['booking', 'started_at']
+        indexes = [
+            models.Index(fields=['booking', 'started_at'], name='trailsegment_booking_started'),
+        ]
+
+    def __str__(self):
+        return f"Trail segment for Booking #{self.booking_id} ({self.point_count} points)"
+
+
+class CellSpeed(models.Model):
+    """
+    Average observed travel speed in one dispatch grid cell for one hour of
+    the week, learned from completed trips by corporate.eta_service.
+    """
+    cell_row = models.IntegerField()
+    cell_col = models.IntegerField()
+    hour_of_week = models.PositiveSmallIntegerField()  # 0 = Monday 00:00, local time
+    speed_kmh = models.FloatField()
+    sample_seconds = models.PositiveIntegerField(help_text='Travel time the average is based on')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cell_row', 'cell_col', 'hour_of_week'],
+                name='unique_cell_speed_per_hour'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Cell ({self.cell_row}, {self.cell_col}) h{self.hour_of_week}: {self.speed_kmh:.1f} km/h"
+
+
 class DriverNotification(models.Model):
     """
     Notifications for drivers (cancellations, updates, etc.)
@@ -0,0 +1,90 @@
+"""
+Nearby Vehicles
+
+Cars shown around the customer on the home-screen map.
+
+- The requested point is snapped to a map tile of TILE_SIZE_DEG degrees and
+  the answer is computed for the tile centre, so everyone idling in the same
+  tile shares one cached response for TILE_TTL_SECONDS.
+- Candidates come from the driver spatial index (live positions). A cache
+  miss costs one query, to keep only drivers free for rides and to read
+  their vehicle type.
+- Responses carry positions and vehicle types only, never driver ids.
+"""
+
+from math import floor
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TILE_SIZE_DEG = 0.01          # ~1.1 km tiles
+TILE_TTL_SECONDS = 5
+NEARBY_RADIUS_KM = 3
+MAX_VEHICLES = 30
+CACHE_KEY_PREFIX = 'nearby_vehicles:'
+
+
+def tile_for(lat, lon):
+    return int(floor(lat / TILE_SIZE_DEG)), int(floor(lon / TILE_SIZE_DEG))
+
+
+def tile_center(tile):
+    return (tile[0] + 0.5) * TILE_SIZE_DEG, (tile[1] + 0.5) * TILE_SIZE_DEG
+
+
+def _vehicles_for_tile(tile):
+    from .dispatch_service import haversine_distance
+    from .models import Driver
+    from .spatial_index import driver_index, find_nearby_driver_ids
+
+    center_lat, center_lon = tile_center(tile)
+    positions = {}
+    for driver_id in find_nearby_driver_ids(center_lat, center_lon, NEARBY_RADIUS_KM):
+        position = driver_index.position(driver_id)
+        if position is None:
+            continue
+        distance = haversine_distance(center_lat, center_lon, *position)
+        if distance <= NEARBY_RADIUS_KM:
+            positions[driver_id] = (distance, position)
+
+    nearest = sorted(positions, key=lambda driver_id: positions[driver_id][0])[:MAX_VEHICLES * 2]
+    if not nearest:
+        return []
+
+    vehicle_types = dict(
+        Driver.objects.filter(id__in=nearest, availability__state__in=['idle', 'offered'])
+        .values_list('id', 'vehicle_type')
+    )
+    return [
+        {
+            'latitude': round(positions[driver_id][1][0], 5),
+            'longitude': round(positions[driver_id][1][1], 5),
+            'vehicle_type': vehicle_types[driver_id] or 'standard',
+        }
+        for driver_id in nearest
+        if driver_id in vehicle_types
+    ][:MAX_VEHICLES]
+
+
+def nearby_vehicles(lat, lon):
+    """
+    Free vehicles around a point, served from the tile cache.
+    Returns: dict with the tile, its vehicles and the cache TTL
+    """
+    tile = tile_for(lat, lon)
+    key = f"{CACHE_KEY_PREFIX}{tile[0]}:{tile[1]}"
+
+    vehicles = cache.get(key)
+    if vehicles is None:
+        vehicles = _vehicles_for_tile(tile)
+        cache.set(key, vehicles, TILE_TTL_SECONDS)
+
+    return {
+        'tile': f"{tile[0]}:{tile[1]}",
+        'vehicles': vehicles,
+        'count': len(vehicles),
+        'refresh_seconds': TILE_TTL_SECONDS,
+    }
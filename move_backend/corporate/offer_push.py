@@ -0,0 +1,97 @@
+"""
+Ride Offer Push
+
+Delivers ride offers to the driver's WebSocket (group driver_<id>) the
+moment they are created, instead of waiting for the next poll of
+DriverRideRequestsAPIView.
+
+- Offers are pushed from transaction.on_commit, so a driver never sees an
+  offer that was rolled back.
+- The payload is the same ride dict the polling endpoint returns, plus
+  server_time so the app can run the countdown against the server clock.
+- The app answers {"type": "offer_ack", "offer_id": ...}; acknowledge()
+  records RideOffer.delivered_at, which shows how long delivery took and
+  which offers never reached the device.
+
+Polling stays as a safety net at OFFER_SAFETY_POLL_SECONDS.
+"""
+
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+OFFER_SAFETY_POLL_SECONDS = getattr(settings, 'OFFER_SAFETY_POLL_SECONDS', 30)
+
+
+def offer_payload(offer):
+    """Ride dict for a pending offer, as shown to the driver."""
+    booking = offer.booking
+    customer = booking.customer
+    return {
+        'id': booking.id,
+        'offer_id': offer.id,
+        'pickup_address': booking.pickup_location,
+        'destination_address': booking.destination,
+        'pickup_latitude': float(booking.pickup_latitude) if booking.pickup_latitude else None,
+        'pickup_longitude': float(booking.pickup_longitude) if booking.pickup_longitude else None,
+        'destination_latitude': float(booking.destination_latitude) if booking.destination_latitude else None,
+        'destination_longitude': float(booking.destination_longitude) if booking.destination_longitude else None,
+        'fare': str(booking.fare) if booking.fare else '0',
+        'distance': str(booking.distance) if booking.distance else '0',
+        'duration': booking.duration,
+        'ride_type': booking.ride_type,
+        'status': 'pending_offer',
+        'customer_id': booking.customer_id,
+        'customer_name': customer.full_name if customer else 'Customer',
+        'customer_phone': booking.contact_phone or (customer.phone if customer else ''),
+        'created_at': booking.created_at.isoformat() if booking.created_at else None,
+        'is_assigned_to_me': False,
+        'is_offer': True,
+        'seconds_remaining': offer.seconds_remaining,
+        'expires_at': offer.expires_at.isoformat(),
+        'distance_to_pickup_km': float(offer.distance_km) if offer.distance_km else None,
+    }
+
+
+def _send(offers):
+    channel_layer = get_channel_layer()
+    server_time = timezone.now().isoformat()
+    for offer in offers:
+        try:
+            async_to_sync(channel_layer.group_send)(
+                f"driver_{offer.driver_id}",
+                {
+                    "type": "send_ride_notification",
+                    "data": {"type": "ride_offer", "server_time": server_time, "ride": offer_payload(offer)},
+                }
+            )
+        except Exception as e:
+            # The driver still finds the offer on the next safety-net poll
+            logger.error(f"Push of ride offer #{offer.id} to driver #{offer.driver_id} failed: {e}")
+
+
+def push_offers(offers):
+    """Push newly created offers to their drivers once the transaction commits."""
+    offers = [offer for offer in offers if offer.id is not None]
+    if offers:
+        transaction.on_commit(lambda: _send(offers))
+
+
+def acknowledge(driver_id, offer_id):
+    """
+    Record that the driver's app received an offer.
+    Returns: True if the offer belongs to the driver (repeated acks are fine)
+    """
+    from .models import RideOffer
+
+    offers = RideOffer.objects.filter(id=offer_id, driver_id=driver_id)
+    if offers.filter(delivered_at__isnull=True).update(delivered_at=timezone.now()):
+        return True
+    return offers.exists()
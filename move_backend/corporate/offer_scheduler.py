@@ -0,0 +1,147 @@
+"""
+Offer Expiry Scheduler
+
+Long-running scheduler that expires pending RideOffers at their
+`expires_at` and re-dispatches the booking, so read endpoints never have to
+expire offers themselves.
+
+- Pending offers are kept in a min-heap keyed on expires_at.
+- New offers are picked up every NEW_OFFER_POLL_SECONDS by id watermark.
+- The full set of pending offers is reloaded every RESYNC_SECONDS to catch
+  anything the watermark missed or offers answered elsewhere.
+
+Expiry latency is bounded by NEW_OFFER_POLL_SECONDS regardless of how often
+drivers poll. Run it with `python manage.py run_offer_scheduler`.
+"""
+
+import heapq
+import logging
+import time
+
+from django.utils import timezone
+
+from . import dispatch_service, driver_state
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+NEW_OFFER_POLL_SECONDS = 1   # How often to look for newly created offers
+RESYNC_SECONDS = 30          # How often to reload every pending offer
+
+
+class OfferExpiryScheduler:
+    """
+    Min-heap of (expires_at, offer_id) for pending offers.
+    Entries for offers answered before their deadline are dropped lazily
+    when they come due (the conditional expire simply matches no row).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = set()
+        self._last_offer_id = 0
+        self._last_resync = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, offer_id, expires_at):
+        if offer_id in self._scheduled:
+            return
+        self._scheduled.add(offer_id)
+        heapq.heappush(self._heap, (expires_at, offer_id))
+
+    def load_new_offers(self):
+        """Schedule pending offers created since the last load."""
+        from .models import RideOffer
+
+        rows = RideOffer.objects.filter(
+            status='pending',
+            id__gt=self._last_offer_id
+        ).values_list('id', 'expires_at')
+
+        for offer_id, expires_at in rows:
+            self.schedule(offer_id, expires_at)
+            self._last_offer_id = max(self._last_offer_id, offer_id)
+
+    def resync(self):
+        """Rebuild the heap from every pending offer in the database."""
+        from .models import RideOffer
+
+        rows = list(RideOffer.objects.filter(status='pending').values_list('id', 'expires_at'))
+
+        self._heap = [(expires_at, offer_id) for offer_id, expires_at in rows]
+        heapq.heapify(self._heap)
+        self._scheduled = {offer_id for offer_id, _ in rows}
+        if rows:
+            self._last_offer_id = max(self._last_offer_id, max(offer_id for offer_id, _ in rows))
+        self._last_resync = time.monotonic()
+
+    def pop_due(self, now=None):
+        """Remove and return ids of offers whose deadline has passed."""
+        now = now or timezone.now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, offer_id = heapq.heappop(self._heap)
+            self._scheduled.discard(offer_id)
+            due.append(offer_id)
+        return due
+
+    def seconds_until_next(self, now=None):
+        if not self._heap:
+            return None
+        now = now or timezone.now()
+        return max(0.0, (self._heap[0][0] - now).total_seconds())
+
+    def tick(self):
+        """
+        One scheduler step: pick up new offers and fire every due expiry.
+        Returns: number of offers expired
+        """
+        if self._last_resync is None or time.monotonic() - self._last_resync > RESYNC_SECONDS:
+            self.resync()
+        else:
+            self.load_new_offers()
+
+        expired = 0
+        for offer_id in self.pop_due():
+            if expire_offer(offer_id):
+                expired += 1
+        return expired
+
+    def run_forever(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Offer expiry scheduler tick failed: {e}")
+            wait = self.seconds_until_next()
+            time.sleep(NEW_OFFER_POLL_SECONDS if wait is None else min(wait, NEW_OFFER_POLL_SECONDS))
+
+
+def expire_offer(offer_id):
+    """
+    Expire a single offer if it is still pending and past its deadline, then
+    re-dispatch its booking when no other offer for it is outstanding.
+    Returns: True if the offer was expired by this call
+    """
+    from .models import RideOffer, Booking
+
+    updated = RideOffer.objects.filter(
+        id=offer_id,
+        status='pending',
+        expires_at__lte=timezone.now()
+    ).update(status='expired')
+
+    if not updated:
+        return False
+
+    booking_id, driver_id = RideOffer.objects.filter(id=offer_id).values_list('booking_id', 'driver_id').first()
+    driver_state.release_offered([driver_id])
+    logger.info(f"Expired offer #{offer_id} for booking #{booking_id}")
+
+    booking = Booking.objects.filter(id=booking_id, status='searching_driver').first()
+    if booking and not RideOffer.objects.filter(booking=booking, status='pending').exists():
+        dispatch_service.request_dispatch(booking)
+
+    return True
@@ -105,13 +105,13 @@ class BookingSerializer(serializers.ModelSerializer):
             'id', 'customer', 'customer_name', 'driver', 'driver_id', 'driver_name',
             'pickup_location', 'destination', 'ride_type',
             'pickup_latitude', 'pickup_longitude',
-            'destination_latitude', 'destination_longitude',
+            'destination_latitude', 'destination_longitude', 'service_zone',
             'contact_name', 'contact_phone',
             'fare', 'distance', 'duration',
             'payment_method', 'payment_completed', 'status',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'customer_name', 'driver_name', 'driver']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'customer_name', 'driver_name', 'driver', 'service_zone']
 
 
 class ServiceBookingSerializer(serializers.ModelSerializer):
@@ -138,9 +138,9 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         model = ChatMessage
         fields = [
             'id', 'booking', 'sender_type', 'sender_customer', 'sender_driver',
-            'sender_name', 'message', 'is_read', 'created_at'
+            'sender_name', 'message', 'is_read', 'delivered_at', 'read_at', 'created_at'
         ]
-        read_only_fields = ['id', 'created_at', 'sender_name']
+        read_only_fields = ['id', 'created_at', 'sender_name', 'delivered_at', 'read_at']
     
     def get_sender_name(self, obj):
         if obj.sender_type == 'customer' and obj.sender_customer:
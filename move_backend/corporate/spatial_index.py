@@ -0,0 +1,191 @@
+"""
+Driver Spatial Index
+
+Keeps an in-process uniform grid of online driver positions so dispatch can
+look up candidates near a pickup point without scanning every online driver.
+
+- The grid is keyed on (row, col) cells of GRID_CELL_SIZE_DEG degrees.
+- Location and online/offline updates write through to the grid.
+- The grid is rebuilt from the database and the live location store every
+  INDEX_REFRESH_SECONDS so that updates handled by other worker processes
+  are picked up.
+
+The index only narrows the candidate set. Dispatch still applies the
+database filters and the exact haversine check to whatever it returns.
+"""
+
+from contextlib import contextmanager
+from math import cos, floor, radians
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+GRID_CELL_SIZE_DEG = 0.05     # ~5.5 km of latitude per cell
+INDEX_REFRESH_SECONDS = 30    # Rebuild from the database at most this often
+KM_PER_DEGREE_LAT = 111.32
+
+
+class DriverGridIndex:
+    """
+    Uniform grid of driver positions.
+    Each driver lives in exactly one cell; moving a driver re-buckets it.
+    """
+
+    def __init__(self, cell_size_deg=GRID_CELL_SIZE_DEG):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}       # (row, col) -> set of driver ids
+        self._positions = {}   # driver id -> (lat, lon, cell)
+        self._lock = threading.RLock()
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell_for(self, lat, lon):
+        return (
+            int(floor(lat / self.cell_size_deg)),
+            int(floor(lon / self.cell_size_deg)),
+        )
+
+    def update(self, driver_id, lat, lon):
+        """Insert or move a driver."""
+        lat, lon = float(lat), float(lon)
+        cell = self._cell_for(lat, lon)
+        with self._lock:
+            previous = self._positions.get(driver_id)
+            if previous and previous[2] != cell:
+                self._discard_from_cell(driver_id, previous[2])
+            self._cells.setdefault(cell, set()).add(driver_id)
+            self._positions[driver_id] = (lat, lon, cell)
+
+    def remove(self, driver_id):
+        """Drop a driver from the index (no-op if not present)."""
+        with self._lock:
+            previous = self._positions.pop(driver_id, None)
+            if previous:
+                self._discard_from_cell(driver_id, previous[2])
+
+    def _discard_from_cell(self, driver_id, cell):
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.discard(driver_id)
+            if not bucket:
+                del self._cells[cell]
+
+    def position(self, driver_id):
+        """Return (lat, lon) for a driver, or None."""
+        entry = self._positions.get(driver_id)
+        return (entry[0], entry[1]) if entry else None
+
+    def candidates_within(self, lat, lon, radius_km):
+        """
+        Return ids of drivers in every cell overlapping the bounding box
+        of a circle of radius_km around (lat, lon).
+        Results may include drivers slightly outside the radius.
+        """
+        lat, lon = float(lat), float(lon)
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        lon_span = radius_km / (KM_PER_DEGREE_LAT * max(cos(radians(lat)), 0.01))
+
+        min_row, min_col = self._cell_for(lat - lat_span, lon - lon_span)
+        max_row, max_col = self._cell_for(lat + lat_span, lon + lon_span)
+
+        found = set()
+        with self._lock:
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    bucket = self._cells.get((row, col))
+                    if bucket:
+                        found.update(bucket)
+        return found
+
+    def rebuild(self, rows):
+        """Replace the whole index with (driver_id, lat, lon) rows."""
+        cells = {}
+        positions = {}
+        for driver_id, lat, lon in rows:
+            lat, lon = float(lat), float(lon)
+            cell = self._cell_for(lat, lon)
+            cells.setdefault(cell, set()).add(driver_id)
+            positions[driver_id] = (lat, lon, cell)
+        with self._lock:
+            self._cells = cells
+            self._positions = positions
+            self.loaded_at = time.monotonic()
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > INDEX_REFRESH_SECONDS
+
+
+# Process-wide index used by dispatch and the driver endpoints
+driver_index = DriverGridIndex()
+_restricted_ids = None   # Only these drivers are indexed while set (see restricted_to)
+
+
+def rebuild_driver_index():
+    """
+    Load all online, approved drivers with a known position into the index.
+    Fixes in the live location store take precedence over the flushed columns.
+    """
+    from .models import Driver
+    from . import location_store
+
+    drivers = Driver.objects.filter(
+        is_online=True,
+        is_approved=True,
+        current_latitude__isnull=False,
+        current_longitude__isnull=False
+    )
+    if _restricted_ids is not None:
+        drivers = drivers.filter(id__in=_restricted_ids)
+    rows = list(drivers.values_list('id', 'current_latitude', 'current_longitude'))
+
+    fixes = location_store.get_many(driver_id for driver_id, _, _ in rows)
+    driver_index.rebuild(
+        (driver_id, *fixes[driver_id][:2]) if driver_id in fixes else (driver_id, lat, lon)
+        for driver_id, lat, lon in rows
+    )
+    logger.debug(f"Rebuilt driver spatial index with {len(driver_index)} driver(s)")
+
+
+@contextmanager
+def restricted_to(driver_ids):
+    """
+    Index only the given drivers for the duration of the block, so dispatch
+    in this process cannot pick anyone else (used by the dispatch simulator
+    to keep offers away from real drivers).
+    """
+    global _restricted_ids
+    _restricted_ids = set(driver_ids)
+    try:
+        rebuild_driver_index()
+        yield
+    finally:
+        _restricted_ids = None
+        driver_index.loaded_at = None   # Rebuild in full on next use
+
+
+def ensure_index_loaded():
+    if driver_index.is_stale():
+        rebuild_driver_index()
+
+
+def sync_driver(driver):
+    """
+    Bring the index in line with a driver row after it was saved.
+    Online drivers with a position are indexed; everyone else is removed.
+    """
+    if driver.is_online and driver.is_approved and driver.current_latitude is not None \
+            and driver.current_longitude is not None:
+        driver_index.update(driver.id, driver.current_latitude, driver.current_longitude)
+    else:
+        driver_index.remove(driver.id)
+
+
+def find_nearby_driver_ids(lat, lon, radius_km):
+    """Candidate driver ids around a point, refreshing the index if stale."""
+    ensure_index_loaded()
+    return driver_index.candidates_within(lat, lon, radius_km)
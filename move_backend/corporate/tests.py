@@ -0,0 +1,488 @@
+import importlib
+import itertools
+import random
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from corporate import (
+    batch_dispatch, dispatch_service, driver_presence, driver_state, location_store, scoring_kernel, trip_trail,
+    zone_index,
+)
+from corporate.models import Booking, Customer, Driver, DriverAvailability, RideOffer, TripTrailSegment
+
+NOW = timezone.now()
+PICKUP = (0.3476, 32.5825)   # Kampala
+
+
+def random_driver(rng, driver_id):
+    return SimpleNamespace(
+        id=driver_id,
+        current_latitude=PICKUP[0] + rng.uniform(-0.2, 0.2),
+        current_longitude=PICKUP[1] + rng.uniform(-0.2, 0.2),
+        rating=rng.choice([None, 0, 3.2, 4.0, 4.5, 5.0, round(rng.uniform(1, 5), 2)]),
+    )
+
+
+def random_stats(rng):
+    total = rng.choice([0, 0, 1, 5, rng.randint(1, 40)])
+    return {
+        'total_offers': total,
+        'accepted_offers': rng.randint(0, total),
+        'last_completed_at': rng.choice([None, NOW - timedelta(minutes=rng.uniform(0, 180))]),
+    }
+
+
+@skipUnless(scoring_kernel.HAS_NUMPY, 'NumPy is not installed')
+class ScoringKernelEquivalenceTests(SimpleTestCase):
+    """The vectorized kernel must score and rank exactly like calculate_driver_score."""
+
+    def setUp(self):
+        patcher = mock.patch('django.utils.timezone.now', return_value=NOW)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def kernel_scores(self, drivers, stats, factors=None):
+        packed = scoring_kernel.pack_candidates(drivers, stats, now=NOW)
+        return scoring_kernel.score_candidates(
+            packed, PICKUP[0], PICKUP[1], dispatch_service.MAX_SEARCH_RADIUS_KM,
+            time_factors=None if factors is None else scoring_kernel.np.array(factors)
+        )
+
+    def assert_matches_scalar(self, drivers, stats, factors=None):
+        scores, distances = self.kernel_scores(drivers, stats, factors)
+        for i, driver in enumerate(drivers):
+            expected_score, expected_distance = dispatch_service.calculate_driver_score(
+                driver, PICKUP[0], PICKUP[1],
+                stats=stats[driver.id],
+                time_factor=1.0 if factors is None else factors[i]
+            )
+            self.assertAlmostEqual(float(distances[i]), expected_distance, places=9)
+            self.assertAlmostEqual(float(scores[i]), expected_score, places=9)
+
+    def test_random_inputs(self):
+        rng = random.Random(20240501)
+        for _ in range(20):
+            drivers = [random_driver(rng, driver_id) for driver_id in range(1, 60)]
+            stats = {driver.id: random_stats(rng) for driver in drivers}
+            self.assert_matches_scalar(drivers, stats)
+
+    def test_random_time_factors(self):
+        rng = random.Random(7)
+        drivers = [random_driver(rng, driver_id) for driver_id in range(1, 200)]
+        stats = {driver.id: random_stats(rng) for driver in drivers}
+        factors = [rng.choice([1.0, 0.5, rng.uniform(0.3, 4.0)]) for _ in drivers]
+        self.assert_matches_scalar(drivers, stats, factors)
+
+    def test_missing_stats_and_position(self):
+        empty = {'total_offers': 0, 'accepted_offers': 0, 'last_completed_at': None}
+        drivers = [
+            SimpleNamespace(id=1, current_latitude=PICKUP[0], current_longitude=PICKUP[1], rating=None),
+            SimpleNamespace(id=2, current_latitude=None, current_longitude=None, rating=4.9),
+            SimpleNamespace(id=3, current_latitude=PICKUP[0] + 0.5, current_longitude=PICKUP[1], rating=5),
+        ]
+        self.assert_matches_scalar(drivers, {driver.id: dict(empty) for driver in drivers})
+
+    def test_ties_rank_in_candidate_order(self):
+        rng = random.Random(3)
+        twins = []
+        for driver_id in range(1, 31):
+            base = random_driver(rng, 0)
+            for offset in range(3):
+                # Identical inputs give identical scores
+                twins.append(SimpleNamespace(
+                    id=driver_id * 10 + offset,
+                    current_latitude=base.current_latitude,
+                    current_longitude=base.current_longitude,
+                    rating=base.rating,
+                ))
+        rng.shuffle(twins)
+        stats = {driver.id: {'total_offers': 4, 'accepted_offers': 3, 'last_completed_at': None} for driver in twins}
+
+        with mock.patch('corporate.eta_service.time_factors', side_effect=lambda lats, lons, *a, **k: [1.0] * len(lats)):
+            with mock.patch.object(scoring_kernel, 'HAS_NUMPY', False):
+                scalar = dispatch_service.score_drivers(twins, stats, PICKUP[0], PICKUP[1])
+            vectorized = dispatch_service.score_drivers(twins, stats, PICKUP[0], PICKUP[1])
+            vectorized_top = dispatch_service.score_drivers(twins, stats, PICKUP[0], PICKUP[1], limit=7)
+
+        self.assertEqual([d.id for d, _, _ in vectorized], [d.id for d, _, _ in scalar])
+        self.assertEqual([d.id for d, _, _ in vectorized_top], [d.id for d, _, _ in scalar[:7]])
+
+
+class OfferClaimTests(TestCase):
+    """Pending offers are unique per driver and per round slot; the first accept wins."""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(email='rider@example.com', full_name='Rider')
+        self.booking = self.make_booking()
+        self.drivers = []
+        for i in range(3):
+            driver = Driver.objects.create(
+                phone=f'+25670000000{i}', email=f'driver{i}@example.com', full_name=f'Driver {i}',
+                is_online=True, is_approved=True,
+                current_latitude=PICKUP[0], current_longitude=PICKUP[1]
+            )
+            DriverAvailability.objects.create(driver=driver, state='idle')
+            self.drivers.append(driver)
+
+    def make_booking(self):
+        return Booking.objects.create(
+            customer=self.customer, pickup_location='A', destination='B', ride_type='standard',
+            pickup_latitude=PICKUP[0], pickup_longitude=PICKUP[1],
+            fare=10, distance=5, duration=10, payment_method='cash', status='searching_driver'
+        )
+
+    def test_first_accept_wins(self):
+        offers = [
+            dispatch_service.create_ride_offer(self.booking, driver, offer_order=i + 1, slot=i)
+            for i, driver in enumerate(self.drivers)
+        ]
+        self.assertTrue(all(offers))
+
+        accepted, _ = dispatch_service.accept_offer(offers[1])
+        self.assertTrue(accepted)
+        for offer in (offers[0], offers[2]):
+            accepted, message = dispatch_service.accept_offer(offer)
+            self.assertFalse(accepted, message)
+
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.driver_id, self.drivers[1].id)
+        self.assertEqual(
+            list(RideOffer.objects.filter(booking=self.booking).order_by('slot').values_list('status', flat=True)),
+            ['cancelled', 'accepted', 'cancelled']
+        )
+        self.assertEqual(
+            dict(DriverAvailability.objects.values_list('driver_id', 'state')),
+            {self.drivers[0].id: 'idle', self.drivers[1].id: 'on_trip', self.drivers[2].id: 'idle'}
+        )
+
+    def test_one_pending_offer_per_slot(self):
+        self.assertIsNotNone(dispatch_service.create_ride_offer(self.booking, self.drivers[0]))
+        # A racing sequential dispatch for the same booking gets no second offer
+        self.assertIsNone(dispatch_service.create_ride_offer(self.booking, self.drivers[1]))
+        self.assertEqual(RideOffer.objects.filter(booking=self.booking, status='pending').count(), 1)
+
+    def test_one_pending_offer_per_driver(self):
+        other = self.make_booking()
+        self.assertIsNotNone(dispatch_service.create_ride_offer(self.booking, self.drivers[0]))
+        self.assertIsNone(dispatch_service.create_ride_offer(other, self.drivers[0]))
+        self.assertFalse(RideOffer.objects.filter(booking=other).exists())
+
+    def test_driver_claimed_before_offer(self):
+        DriverAvailability.objects.filter(driver=self.drivers[0]).update(state='offered')
+        self.assertIsNone(dispatch_service.create_ride_offer(self.booking, self.drivers[0]))
+        self.assertFalse(RideOffer.objects.exists())
+
+    def test_accept_rolled_back_when_driver_unavailable(self):
+        offer = dispatch_service.create_ride_offer(self.booking, self.drivers[0])
+        DriverAvailability.objects.filter(driver=self.drivers[0]).update(state='offline')
+
+        accepted, _ = dispatch_service.accept_offer(offer)
+        self.assertFalse(accepted)
+        self.booking.refresh_from_db()
+        offer.refresh_from_db()
+        self.assertIsNone(self.booking.driver_id)
+        self.assertEqual(offer.status, 'pending')
+
+    def test_direct_accept_retry_succeeds(self):
+        self.addCleanup(cache.clear)  # Trip trail routing for the driver
+        url = f'/api/corporate/driver/{self.drivers[0].id}/accept-ride/'
+        client = APIClient()
+        for _ in range(2):
+            response = client.post(url, {'ride_request_id': self.booking.id}, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.driver_id, self.drivers[0].id)
+        self.assertEqual(driver_state.get_state(self.drivers[0].id), 'on_trip')
+
+
+class ZoneIndexTests(SimpleTestCase):
+    """Zones imported from a MultiPolygon are found in every one of their parts."""
+
+    def test_every_part_of_a_multipolygon_is_indexed(self):
+        square = lambda lat, lon: [[lat, lon], [lat + 0.05, lon], [lat + 0.05, lon + 0.05], [lat, lon + 0.05]]
+        index = zone_index.ZoneGridIndex()
+        index.rebuild([
+            (1, 'Islands', 0, zone_index.validate_polygons([square(0.0, 32.0), square(0.5, 32.5)])),
+            (2, 'Mainland', 0, zone_index.validate_polygons(square(1.0, 33.0))),
+        ])
+        self.assertEqual(index.lookup(0.02, 32.02), 1)
+        self.assertEqual(index.lookup(0.52, 32.52), 1)
+        self.assertEqual(index.lookup(1.02, 33.02), 2)
+        self.assertIsNone(index.lookup(0.3, 32.3))
+
+
+class DriverPresenceTests(TestCase):
+    """Presence lives in the database, so a sweeper in another process sees every heartbeat."""
+
+    def setUp(self):
+        self.drivers = []
+        for i in range(2):
+            driver = Driver.objects.create(
+                phone=f'+25671000000{i}', email=f'present{i}@example.com', full_name=f'Driver {i}',
+                is_online=True, is_approved=True
+            )
+            DriverAvailability.objects.create(driver=driver, state='idle')
+            self.drivers.append(driver)
+        DriverAvailability.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        driver_presence._last_write.clear()
+
+    def online_ids(self):
+        return set(Driver.objects.filter(is_online=True).values_list('id', flat=True))
+
+    def test_heartbeat_survives_a_process_local_cache(self):
+        driver_presence.heartbeat(self.drivers[0].id)
+        cache.clear()
+        self.assertEqual(driver_presence.sweep(), (1, 0))
+        self.assertEqual(self.online_ids(), {self.drivers[0].id})
+
+    def test_ghost_restored_unless_it_went_offline(self):
+        driver_presence.sweep()
+        driver_presence.went_offline(self.drivers[1].id)
+        for driver in self.drivers:
+            driver_presence.heartbeat(driver.id)
+        self.assertEqual(driver_presence.sweep(), (0, 1))
+        self.assertEqual(self.online_ids(), {self.drivers[0].id})
+
+
+class TripMeterTests(TestCase):
+    """Completion only uses metered totals for the ride after the pickup."""
+
+    def setUp(self):
+        customer = Customer.objects.create(email='meter@example.com', full_name='Rider')
+        self.driver = Driver.objects.create(
+            phone='+256720000000', email='meter-driver@example.com', full_name='Driver',
+            is_online=True, is_approved=True
+        )
+        DriverAvailability.objects.create(driver=self.driver, state='on_trip')
+        self.booking = Booking.objects.create(
+            customer=customer, driver=self.driver, pickup_location='A', destination='B', ride_type='standard',
+            pickup_latitude=PICKUP[0], pickup_longitude=PICKUP[1],
+            fare=10, distance=5, duration=10, payment_method='cash', status='driver_assigned'
+        )
+        trip_trail.start_trip(self.booking.id, self.driver.id)
+        self.addCleanup(trip_trail.end_trip, self.booking.id, self.driver.id)
+        for patcher in (
+            mock.patch.object(location_store, '_start_flusher'),
+            # Keep fixes out of the exit-time flush, which would hit the real database
+            mock.patch.object(location_store, '_pending', {}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def drive(self, count):
+        now = timezone.now()
+        for i in range(count):
+            # ~110 m every 10 s
+            location_store.record(
+                self.driver.id, PICKUP[0] + 0.001 * i, PICKUP[1], now + timedelta(seconds=10 * i)
+            )
+
+    def complete(self):
+        response = self.client.patch(f'/api/corporate/bookings/{self.booking.id}/complete/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_approach_leg_is_not_metered(self):
+        self.drive(20)
+        result = self.complete()
+        self.assertFalse(result['metered'])
+        self.assertEqual((result['distance'], result['duration']), (5.0, 10))
+
+    def test_ride_after_pickup_is_metered(self):
+        self.drive(5)
+        response = self.client.patch(
+            f'/api/corporate/bookings/{self.booking.id}/', {'status': 'picked_up'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.drive(10)
+        result = self.complete()
+        self.assertTrue(result['metered'])
+        self.assertAlmostEqual(result['distance'], 1.0, delta=0.05)
+
+
+class BatchDispatchClaimTests(TestCase):
+    """A batch cycle that collides with a concurrent offer leaves no driver claimed without an offer."""
+
+    setUp = OfferClaimTests.setUp
+    make_booking = OfferClaimTests.make_booking
+
+    def run_cycle(self, after_matching):
+        real_solve = batch_dispatch.solve_assignment
+
+        def solve_assignment(cost):
+            # Runs once the candidates are loaded, before any driver is claimed
+            pairs = real_solve(cost)
+            after_matching()
+            return pairs
+
+        self.other = self.make_booking()
+        nearby = {driver.id for driver in self.drivers}
+        with mock.patch('corporate.spatial_index.find_nearby_driver_ids', return_value=nearby), \
+                mock.patch.object(batch_dispatch, 'solve_assignment', side_effect=solve_assignment):
+            return batch_dispatch.run_batch_cycle([self.booking.id, self.other.id])
+
+    def test_bulk_insert(self):
+        offers = self.run_cycle(lambda: None)
+        self.assertEqual(len(offers), 2)
+        self.assertEqual(RideOffer.objects.filter(status='pending').count(), 2)
+
+    def test_concurrent_offer_for_same_booking(self):
+        # A sequential dispatch offers the first booking to the third driver mid-cycle
+        def concurrent_offer():
+            DriverAvailability.objects.filter(driver=self.drivers[2]).update(state='offered')
+            RideOffer.objects.create(
+                booking=self.booking, driver=self.drivers[2], status='pending',
+                expires_at=timezone.now() + timedelta(seconds=30)
+            )
+
+        offers = self.run_cycle(concurrent_offer)
+        self.assertEqual([offer.booking_id for offer in offers], [self.other.id])
+        pending = set(RideOffer.objects.filter(status='pending').values_list('driver_id', flat=True))
+        offered = set(DriverAvailability.objects.filter(state='offered').values_list('driver_id', flat=True))
+        self.assertEqual(offered, pending)
+
+
+class SolveAssignmentTests(SimpleTestCase):
+    """The pure-Python Hungarian fallback finds a minimum-cost assignment."""
+
+    def setUp(self):
+        patcher = mock.patch.object(batch_dispatch, 'linear_sum_assignment', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def brute_force(self, cost):
+        rows, cols = len(cost), len(cost[0])
+        if rows <= cols:
+            return min(
+                sum(cost[row][col] for row, col in enumerate(columns))
+                for columns in itertools.permutations(range(cols), rows)
+            )
+        return min(
+            sum(cost[row][col] for col, row in enumerate(assigned_rows))
+            for assigned_rows in itertools.permutations(range(rows), cols)
+        )
+
+    def assert_optimal(self, cost):
+        pairs = batch_dispatch.solve_assignment(cost)
+        self.assertEqual(len(pairs), min(len(cost), len(cost[0])))
+        self.assertEqual(len({row for row, _ in pairs}), len(pairs))
+        self.assertEqual(len({col for _, col in pairs}), len(pairs))
+        self.assertAlmostEqual(sum(cost[row][col] for row, col in pairs), self.brute_force(cost), places=9)
+
+    def test_random_rectangular_matrices(self):
+        rng = random.Random(11)
+        for _ in range(300):
+            rows, cols = rng.randint(1, 6), rng.randint(1, 6)
+            cost = [[-round(rng.uniform(0, 100), 3) for _ in range(cols)] for _ in range(rows)]
+            self.assert_optimal(cost)
+
+    def test_rows_without_candidates(self):
+        # Non-candidate pairs cost 0, as in run_batch_cycle
+        rng = random.Random(5)
+        for _ in range(300):
+            rows, cols = rng.randint(1, 6), rng.randint(1, 6)
+            cost = [
+                [0.0 if empty or rng.random() < 0.4 else -rng.choice([10.0, 20.0, rng.uniform(1, 50)])
+                 for _ in range(cols)]
+                for empty in (rng.random() < 0.3 for _ in range(rows))
+            ]
+            self.assert_optimal(cost)
+
+    def test_empty(self):
+        self.assertEqual(batch_dispatch.solve_assignment([]), [])
+        self.assertEqual(batch_dispatch.solve_assignment([[]]), [])
+
+
+class TripTrailCodecTests(TestCase):
+    """
+    Stored trail segments depend on the codec byte for byte, and migration
+    0027 carries a frozen copy of the encoder; the format must not drift.
+    """
+
+    BASE = 1700000000.0
+    POINTS = [
+        (1700000000.0, 0.34761, 32.58252),
+        (1700000003.4, 0.34755, 32.58249),      # Negative deltas
+        (1700007203.4, -0.00002, -32.5),        # Two-hour gap, sign changes
+    ]
+    ENCODED = bytes.fromhex('00929f0498de8d03440b0580e508899f04b1bb9a06')
+
+    def test_encoding_is_frozen(self):
+        self.assertEqual(trip_trail.encode_points(self.POINTS, self.BASE), self.ENCODED)
+        frozen = importlib.import_module('corporate.migrations.0027_triptrailsegment')
+        self.assertEqual(frozen.encode_points(self.POINTS, self.BASE), self.ENCODED)
+
+    def test_round_trip(self):
+        rng = random.Random(14)
+        epoch, lat, lon = self.BASE + 0.3, -1.2, 179.9
+        points = []
+        for _ in range(500):
+            epoch += rng.choice([0.1, 1, 4.7, 600, 3 * 24 * 60 * 60])
+            lat = max(-90, min(90, lat + rng.uniform(-0.5, 0.5)))
+            lon = max(-180, min(180, lon + rng.uniform(-0.5, 0.5)))
+            points.append((round(epoch, 1), round(lat, 5), round(lon, 5)))
+
+        decoded = list(trip_trail.decode_points(trip_trail.encode_points(points, self.BASE), self.BASE))
+        self.assertEqual(len(decoded), len(points))
+        for (epoch, lat, lon), (got_epoch, got_lat, got_lon) in zip(points, decoded):
+            self.assertAlmostEqual(got_epoch, epoch, places=6)
+            self.assertAlmostEqual(got_lat, lat, places=9)
+            self.assertAlmostEqual(got_lon, lon, places=9)
+
+    def test_trail_across_segment_boundaries(self):
+        customer = Customer.objects.create(email='trail@example.com', full_name='Rider')
+        driver = Driver.objects.create(phone='+256730000000', email='trail-driver@example.com', full_name='Driver')
+        booking = Booking.objects.create(
+            customer=customer, driver=driver, pickup_location='A', destination='B', ride_type='standard',
+            fare=10, distance=5, duration=10, payment_method='cash', status='driver_assigned'
+        )
+        trip_trail.start_trip(booking.id, driver.id)
+        points = [(self.BASE + 5 * i, PICKUP[0] - 0.0003 * i, PICKUP[1] + 0.0002 * i) for i in range(25)]
+        with mock.patch.object(trip_trail, 'SEGMENT_MAX_POINTS', 7):
+            for point in points:
+                trip_trail.append(driver.id, [point])
+        trip_trail.end_trip(booking.id, driver.id)
+
+        segments = TripTrailSegment.objects.filter(booking=booking)
+        self.assertEqual(segments.count(), 4)
+        self.assertEqual(sum(segment.point_count for segment in segments), len(points))
+        trail = [(recorded_at.timestamp(), lat, lon) for recorded_at, lat, lon in trip_trail.iter_trail(booking.id)]
+        self.assertEqual(len(trail), len(points))
+        for expected, got in zip(points, trail):
+            for a, b in zip(expected, got):
+                self.assertAlmostEqual(a, b, places=5)
+
+
+class LocationFlushTests(TestCase):
+    """A flush never replaces a newer stored position with an older buffered one."""
+
+    def setUp(self):
+        patcher = mock.patch.object(location_store, '_pending', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_newer_fixes_are_written(self):
+        now = timezone.now()
+        drivers = Driver.objects.bulk_create([
+            Driver(
+                phone=f'+2567400{i:05d}', email=f'flush{i}@example.com', full_name=f'Driver {i}',
+                current_latitude=1, current_longitude=1,
+                location_updated_at=None if i % 3 == 0 else now + timedelta(seconds=-60 if i % 3 == 1 else 60)
+            )
+            for i in range(location_store.FLUSH_BATCH_SIZE + 20)
+        ])
+        for driver in drivers:
+            location_store._pending[driver.id] = (PICKUP[0], PICKUP[1], now.timestamp())
+
+        expected = [driver.id for i, driver in enumerate(drivers) if i % 3 != 2]
+        self.assertEqual(location_store.flush(), len(expected))
+        moved = Driver.objects.filter(current_latitude=round(PICKUP[0], 7)).values_list('id', flat=True)
+        self.assertEqual(sorted(moved), expected)
+        self.assertEqual(Driver.objects.filter(location_updated_at__gt=now).count(), len(drivers) - len(expected))
@@ -0,0 +1,193 @@
+"""
+Trip Meter
+
+Measures the distance and time of a trip on the server, from the driver's
+location fixes, so completion does not have to trust the client-supplied
+Booking.distance and Booking.duration.
+
+- The meter of a booking is started by start() when the booking moves to
+  picked_up and is advanced by every fix afterwards. Fixes from the drive
+  to the pickup arrive too (the trail records from assignment) but are
+  ignored while no meter is running, so they never reach the fare. Totals
+  are updated incrementally; completion reads them with a single cache get
+  and never replays the trail.
+- Jitter: while the driver stays within JITTER_RADIUS_M of the last
+  accepted fix nothing is added, so a parked car does not drift up
+  distance; only the time of that fix is moved forward.
+- Outliers: a fix implying more than MAX_SPEED_KMH from the last accepted
+  fix is dropped. After OUTLIER_RESET_FIXES dropped fixes in a row the last
+  accepted fix is assumed to be the bad one and the meter re-anchors on the
+  new position without adding the jump.
+- Fixes older than the newest one seen, or than the pickup, are ignored.
+- Totals are only trusted when at least MIN_METERED_FIXES fixes were used
+  and they span MIN_TIME_COVERAGE of the trip; otherwise `reliable` is
+  False and completion keeps the client's figures.
+
+State is kept in the Django cache per booking. Fixes for one booking can
+arrive on several workers at once (live socket and batch upload), so every
+read-modify-write holds a short cache lock taken with cache.add().
+"""
+
+from contextlib import contextmanager
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JITTER_RADIUS_M = 15              # Moves smaller than this are GPS noise
+MAX_SPEED_KMH = 160               # Faster implied moves are outliers
+OUTLIER_RESET_FIXES = 3
+MIN_METERED_FIXES = 5             # Fewer accepted fixes than this = not metered
+MIN_TIME_COVERAGE = 0.5           # Share of the trip time the fixes must span
+METER_TTL_SECONDS = 12 * 60 * 60
+LOCK_TTL_SECONDS = 5              # Outlives any single update
+LOCK_WAIT_SECONDS = 1
+LOCK_RETRY_SECONDS = 0.01
+CACHE_KEY_PREFIX = 'trip_meter:'
+LOCK_CACHE_KEY_PREFIX = 'trip_meter_lock:'
+
+
+def _key(booking_id):
+    return f"{CACHE_KEY_PREFIX}{booking_id}"
+
+
+@contextmanager
+def _locked(booking_id):
+    """
+    Hold the booking's meter lock.
+    Yields: True once the lock is held, False if it could not be taken in
+    LOCK_WAIT_SECONDS
+    """
+    key = f"{LOCK_CACHE_KEY_PREFIX}{booking_id}"
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while not cache.add(key, True, LOCK_TTL_SECONDS):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(LOCK_RETRY_SECONDS)
+    try:
+        yield True
+    finally:
+        cache.delete(key)
+
+
+def _new_state(started_at):
+    return {
+        'started_at': started_at,
+        'anchor': None,           # (epoch, lat, lon) of the last accepted fix
+        'first_at': None,         # Epoch of the first accepted fix
+        'seen_at': None,          # Newest fix epoch, accepted or not
+        'distance_m': 0.0,
+        'fixes_used': 0,
+        'fixes_rejected': 0,
+        'outlier_run': 0,
+    }
+
+
+def _advance(state, epoch, lat, lon):
+    from .dispatch_service import haversine_distance
+
+    if epoch < state['started_at']:
+        return  # Buffered fix from before the pickup
+    if state['seen_at'] is not None and epoch <= state['seen_at']:
+        return
+    state['seen_at'] = epoch
+
+    anchor = state['anchor']
+    if anchor is None:
+        state['anchor'] = (epoch, lat, lon)
+        state['first_at'] = epoch
+        state['fixes_used'] += 1
+        return
+
+    meters = haversine_distance(anchor[1], anchor[2], lat, lon) * 1000
+    if meters < JITTER_RADIUS_M:
+        # Still at the anchor; keep its position but not its age, or a later
+        # glitch would look like a slow drive from where the car was parked
+        state['anchor'] = (epoch, anchor[1], anchor[2])
+        return
+
+    seconds = epoch - anchor[0]
+    if seconds <= 0 or meters / seconds * 3.6 > MAX_SPEED_KMH:
+        state['fixes_rejected'] += 1
+        state['outlier_run'] += 1
+        if state['outlier_run'] >= OUTLIER_RESET_FIXES:
+            state['anchor'] = (epoch, lat, lon)
+            state['outlier_run'] = 0
+        return
+
+    state['distance_m'] += meters
+    state['anchor'] = (epoch, lat, lon)
+    state['fixes_used'] += 1
+    state['outlier_run'] = 0
+
+
+def add_fixes(booking_id, points):
+    """
+    Advance the booking's meter with (epoch, lat, lon) points in time order.
+    Does nothing until start() has run for the booking.
+    """
+    if booking_id is None or not points:
+        return
+    key = _key(booking_id)
+    if cache.get(key) is None:
+        return  # Not picked up yet; skip the lock on the approach leg
+    with _locked(booking_id) as locked:
+        if not locked:
+            # The next fix covers the gap; skipping beats a lost update
+            logger.warning(f"Trip meter for booking #{booking_id} is busy; {len(points)} fix(es) skipped")
+            return
+        state = cache.get(key)
+        if state is None:
+            return  # Finished or discarded meanwhile
+        for epoch, lat, lon in points:
+            _advance(state, epoch, lat, lon)
+        cache.set(key, state, METER_TTL_SECONDS)
+
+
+def start(booking_id, at=None):
+    """(Re)start the meter, e.g. when the passenger is picked up."""
+    with _locked(booking_id):
+        cache.set(_key(booking_id), _new_state(at or time.time()), METER_TTL_SECONDS)
+
+
+def discard(booking_id):
+    """Drop the meter of a trip that will not be completed."""
+    with _locked(booking_id):
+        cache.delete(_key(booking_id))
+
+
+def _totals(state, ended_at):
+    elapsed = ended_at - state['started_at']
+    first_at = state.get('first_at')
+    covered = (state['seen_at'] - first_at) if first_at is not None else 0
+    coverage = min(1.0, covered / elapsed) if elapsed > 0 else 0.0
+    return {
+        'distance_km': round(state['distance_m'] / 1000, 2),
+        'duration_minutes': max(1, round(elapsed / 60)),
+        'fixes_used': state['fixes_used'],
+        'fixes_rejected': state['fixes_rejected'],
+        'coverage': round(coverage, 2),
+        'reliable': state['fixes_used'] >= MIN_METERED_FIXES and coverage >= MIN_TIME_COVERAGE,
+    }
+
+
+def totals(booking_id, ended_at=None):
+    """
+    Running totals of a trip.
+    Returns: dict with distance_km, duration_minutes, fix counts, coverage
+    and reliable, or None when the booking has no meter
+    """
+    state = cache.get(_key(booking_id))
+    return _totals(state, ended_at or time.time()) if state else None
+
+
+def finish(booking_id, ended_at=None):
+    """Final totals of a trip; the meter is discarded."""
+    with _locked(booking_id):
+        result = totals(booking_id, ended_at)
+        cache.delete(_key(booking_id))
+    return result
@@ -0,0 +1,195 @@
+"""
+Push-Based Trip Tracking
+
+Pushes the driver's position to the customer while a trip is active, so the
+customer app does not have to poll BookingTrackingAPIView.
+
+- Every stored fix of an on-trip driver is passed to on_fix(). A tracking
+  update is sent to the customer_<id> Channels group only when the driver
+  moved at least PUSH_MIN_DISTANCE_M since the last update.
+- Updates carry a per-booking sequence number. The resume token
+  "<booking_id>.<seq>" lets a reconnecting client ask for whatever changed
+  since the last update it saw instead of refetching the full snapshot.
+- The last pushed position and sequence live in the Django cache, so every
+  ingest process pushes from the same state.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PUSH_MIN_DISTANCE_M = 20           # Smaller moves are not pushed
+TRACKING_TTL_SECONDS = 12 * 60 * 60
+CACHE_KEY_PREFIX = 'trip_tracking:'
+
+
+def _key(booking_id):
+    return f"{CACHE_KEY_PREFIX}{booking_id}"
+
+
+def make_resume_token(booking_id, seq):
+    return f"{booking_id}.{seq}"
+
+
+def parse_resume_token(token):
+    """
+    Returns: (booking_id, seq), or None for a malformed token
+    """
+    try:
+        booking_id, seq = str(token).split('.')
+        return int(booking_id), int(seq)
+    except (TypeError, ValueError):
+        return None
+
+
+def _update_message(booking_id, state):
+    return {
+        'type': 'tracking',
+        'booking_id': booking_id,
+        'seq': state['seq'],
+        'resume_token': make_resume_token(booking_id, state['seq']),
+        'driver_location': {'latitude': state['lat'], 'longitude': state['lon']},
+        'recorded_at': datetime.fromtimestamp(state['recorded_at'], tz=dt_timezone.utc).isoformat(),
+    }
+
+
+def on_fix(booking_id, driver_id, lat, lon, recorded_epoch):
+    """
+    Push the driver's new position to the booking's customer if it moved
+    meaningfully since the last push.
+    Returns: True if an update was sent
+    """
+    from .dispatch_service import haversine_distance
+    from .models import Booking
+
+    state = cache.get(_key(booking_id))
+    if state and state['driver_id'] == driver_id:
+        if haversine_distance(state['lat'], state['lon'], lat, lon) * 1000 < PUSH_MIN_DISTANCE_M:
+            return False
+        customer_id = state['customer_id']
+        seq = state['seq'] + 1
+    else:
+        customer_id = Booking.objects.filter(id=booking_id).values_list('customer_id', flat=True).first()
+        seq = (state or {}).get('seq', 0) + 1
+
+    state = {
+        'driver_id': driver_id,
+        'customer_id': customer_id,
+        'seq': seq,
+        'lat': lat,
+        'lon': lon,
+        'recorded_at': recorded_epoch,
+        'pushed_at': time.time(),
+    }
+    cache.set(_key(booking_id), state, TRACKING_TTL_SECONDS)
+
+    if customer_id is None:
+        return False
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"customer_{customer_id}",
+            {"type": "send_ride_notification", "data": _update_message(booking_id, state)}
+        )
+    except Exception as e:
+        logger.error(f"Tracking push for booking #{booking_id} failed: {e}")
+        return False
+    return True
+
+
+def current_seq(booking_id):
+    state = cache.get(_key(booking_id))
+    return state['seq'] if state else 0
+
+
+def snapshot(booking):
+    """
+    Full tracking view of a booking: static pickup/destination blocks, the
+    driver and their live position, plus the resume token for pushes.
+    """
+    from . import location_store
+
+    seq = current_seq(booking.id)
+    data = {
+        'booking_id': booking.id,
+        'status': booking.status,
+        'pickup': {
+            'address': booking.pickup_location,
+            'latitude': float(booking.pickup_latitude) if booking.pickup_latitude else None,
+            'longitude': float(booking.pickup_longitude) if booking.pickup_longitude else None,
+        },
+        'destination': {
+            'address': booking.destination,
+            'latitude': float(booking.destination_latitude) if booking.destination_latitude else None,
+            'longitude': float(booking.destination_longitude) if booking.destination_longitude else None,
+        },
+        'seq': seq,
+        'resume_token': make_resume_token(booking.id, seq),
+    }
+
+    if booking.driver:
+        location_store.apply_to([booking.driver])
+        data['driver_location'] = {
+            'latitude': float(booking.driver.current_latitude) if booking.driver.current_latitude else None,
+            'longitude': float(booking.driver.current_longitude) if booking.driver.current_longitude else None,
+        }
+        data['eta_seconds'] = _eta_for(booking)
+        data['driver'] = {
+            'id': booking.driver.id,
+            'name': booking.driver.full_name,
+            'phone': booking.driver.phone,
+            'vehicle_type': booking.driver.vehicle_type,
+            'vehicle_number': booking.driver.vehicle_number or 'MOV-0000',
+            'rating': float(booking.driver.rating) if booking.driver.rating else 5.0,
+        }
+
+    return data
+
+
+def _eta_for(booking):
+    """
+    Seconds until the driver reaches the pickup (before pickup) or the
+    destination (on board), or None when it cannot be estimated.
+    """
+    from . import eta_service
+
+    driver = booking.driver
+    if booking.status == 'driver_assigned':
+        target = (booking.pickup_latitude, booking.pickup_longitude)
+    elif booking.status == 'picked_up':
+        target = (booking.destination_latitude, booking.destination_longitude)
+    else:
+        return None
+    if None in target or driver.current_latitude is None or driver.current_longitude is None:
+        return None
+    return round(eta_service.eta_seconds(driver.current_latitude, driver.current_longitude, *target))
+
+
+def resume(booking_id, token):
+    """
+    What a client holding `token` is missing.
+    Returns: the latest tracking update, {'type': 'tracking_up_to_date', ...}
+    if nothing changed, or None if the token cannot be used (wrong booking,
+    malformed, or newer than the server state) and a snapshot is needed
+    """
+    parsed = parse_resume_token(token)
+    if parsed is None or parsed[0] != booking_id:
+        return None
+
+    state = cache.get(_key(booking_id))
+    seq = state['seq'] if state else 0
+    if parsed[1] > seq:
+        return None  # Server state was lost; start over
+    if parsed[1] == seq:
+        return {
+            'type': 'tracking_up_to_date',
+            'booking_id': booking_id,
+            'resume_token': make_resume_token(booking_id, seq),
+        }
+    return _update_message(booking_id, state)
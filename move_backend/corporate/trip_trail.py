@@ -0,0 +1,217 @@
+"""
+Trip Trail Store
+
+Records the path a booking actually took, from driver assignment until the
+trip is completed or cancelled, as compact encoded segments rather than one
+row per GPS fix.
+
+Encoding (one TripTrailSegment.data blob per segment):
+- every point is (time, lat, lon) quantised to 0.1 s and 1e-5 degrees (~1 m)
+- each value is stored as the zigzag varint of its delta to the previous
+  point; the first point is relative to (segment.started_at, 0, 0)
+- a fix every few seconds at city speeds costs ~3-4 bytes, so a trip-hour
+  stays in the low kilobytes
+
+Points are buffered per booking in the process that received them and
+written as a segment once SEGMENT_MAX_POINTS or SEGMENT_MAX_SECONDS is
+reached, when the trip ends, or when the process exits. Several processes
+may write segments for the same trip; iter_trail() merges them by time.
+
+The booking a driver is serving is kept in the Django cache so that every
+ingest path (HTTP, WebSocket, batch upload) can find it without a query.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+import atexit
+import heapq
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SEGMENT_MAX_POINTS = 300          # Write a segment once this many points are buffered
+SEGMENT_MAX_SECONDS = 60          # ... or once the oldest buffered point is this old
+TRIP_CACHE_TTL_SECONDS = 12 * 60 * 60
+COORD_SCALE = 100000              # 1e-5 degrees
+TIME_SCALE = 10                   # 0.1 seconds
+CACHE_KEY_PREFIX = 'driver_trip:'
+
+
+# ------------------------------------------------------------
+# Codec
+# ------------------------------------------------------------
+
+def _write_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data):
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield (value >> 1) ^ -(value & 1)
+        value = shift = 0
+
+
+def encode_points(points, base_epoch):
+    """
+    Encode (epoch, lat, lon) points, sorted by time, relative to base_epoch.
+    Returns: bytes
+    """
+    out = bytearray()
+    prev_t, prev_lat, prev_lon = round(base_epoch * TIME_SCALE), 0, 0
+    for epoch, lat, lon in points:
+        t, qlat, qlon = round(epoch * TIME_SCALE), round(lat * COORD_SCALE), round(lon * COORD_SCALE)
+        _write_varint(out, t - prev_t)
+        _write_varint(out, qlat - prev_lat)
+        _write_varint(out, qlon - prev_lon)
+        prev_t, prev_lat, prev_lon = t, qlat, qlon
+    return bytes(out)
+
+
+def decode_points(data, base_epoch):
+    """
+    Inverse of encode_points.
+    Yields: (epoch, lat, lon)
+    """
+    t, lat, lon = round(base_epoch * TIME_SCALE), 0, 0
+    values = _read_varints(data)
+    for dt in values:
+        t += dt
+        lat += next(values)
+        lon += next(values)
+        yield t / TIME_SCALE, lat / COORD_SCALE, lon / COORD_SCALE
+
+
+# ------------------------------------------------------------
+# Active trips
+# ------------------------------------------------------------
+
+def start_trip(booking_id, driver_id):
+    """Start recording fixes from driver_id into booking_id's trail."""
+    cache.set(f"{CACHE_KEY_PREFIX}{driver_id}", booking_id, TRIP_CACHE_TTL_SECONDS)
+
+
+def end_trip(booking_id, driver_id):
+    """Stop recording and write out what this process still buffers."""
+    cache.delete(f"{CACHE_KEY_PREFIX}{driver_id}")
+    _flush_booking(booking_id)
+
+
+def active_booking_id(driver_id):
+    return cache.get(f"{CACHE_KEY_PREFIX}{driver_id}")
+
+
+# ------------------------------------------------------------
+# Buffering
+# ------------------------------------------------------------
+
+class _TrailBuffer:
+    def __init__(self, driver_id):
+        self.driver_id = driver_id
+        self.points = []
+        self.opened_at = time.monotonic()
+
+    def is_due(self):
+        return (
+            len(self.points) >= SEGMENT_MAX_POINTS
+            or time.monotonic() - self.opened_at >= SEGMENT_MAX_SECONDS
+        )
+
+
+_buffers = {}       # booking id -> _TrailBuffer
+_lock = threading.Lock()
+
+
+def append(driver_id, points, flush=False):
+    """
+    Buffer (epoch, lat, lon) points for the driver's active trip, if any,
+    then write out every buffer that is due. With flush=True the trip's
+    buffer is written immediately (batch uploads).
+    Returns: booking id the points were added to, or None
+    """
+    booking_id = active_booking_id(driver_id)
+    if booking_id is not None and points:
+        with _lock:
+            buffer = _buffers.get(booking_id)
+            if buffer is None:
+                buffer = _buffers[booking_id] = _TrailBuffer(driver_id)
+            buffer.points.extend(points)
+
+    with _lock:
+        due = [
+            key for key, buffer in _buffers.items()
+            if buffer.is_due() or (flush and key == booking_id)
+        ]
+    for key in due:
+        _flush_booking(key)
+    return booking_id
+
+
+def _flush_booking(booking_id):
+    from .models import TripTrailSegment
+
+    with _lock:
+        buffer = _buffers.pop(booking_id, None)
+    if buffer is None or not buffer.points:
+        return None
+
+    points = sorted(buffer.points)
+    started, ended = points[0][0], points[-1][0]
+    try:
+        return TripTrailSegment.objects.create(
+            booking_id=booking_id,
+            driver_id=buffer.driver_id,
+            started_at=datetime.fromtimestamp(started, tz=dt_timezone.utc),
+            ended_at=datetime.fromtimestamp(ended, tz=dt_timezone.utc),
+            point_count=len(points),
+            data=encode_points(points, started),
+        )
+    except Exception as e:
+        logger.error(f"Could not write trail segment for booking #{booking_id}: {e}")
+        return None
+
+
+def flush_all():
+    """Write out every buffered trail (process shutdown)."""
+    with _lock:
+        booking_ids = list(_buffers)
+    for booking_id in booking_ids:
+        _flush_booking(booking_id)
+
+
+atexit.register(flush_all)
+
+
+# ------------------------------------------------------------
+# Reading
+# ------------------------------------------------------------
+
+def iter_trail(booking_id):
+    """
+    Stream a booking's trail in time order, one segment decoded at a time
+    per source, merging segments written by different processes.
+    Yields: (recorded_at, lat, lon)
+    """
+    from .models import TripTrailSegment
+
+    segments = (
+        TripTrailSegment.objects.filter(booking_id=booking_id)
+        .order_by('started_at')
+        .values_list('started_at', 'data')
+        .iterator()
+    )
+    streams = [decode_points(bytes(data), started_at.timestamp()) for started_at, data in segments]
+    for epoch, lat, lon in heapq.merge(*streams):
+        yield datetime.fromtimestamp(epoch, tz=dt_timezone.utc), lat, lon
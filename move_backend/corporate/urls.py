@@ -10,10 +10,11 @@ from .api_views import (
     DriverNotificationsAPIView, DriverUpdateVehicleAPIView,
     BookingListCreateAPIView, BookingDetailAPIView, CustomerBookingsAPIView, 
     DriverBookingsAPIView, CompleteBookingAPIView, AssignNearestDriverAPIView,
-    UpdateDriverLocationAPIView, CustomerProfilePictureUploadAPIView, CustomerProfileAPIView,
+    UpdateDriverLocationAPIView, DriverLocationBatchAPIView, LocationIngestStatsAPIView, NearbyVehiclesAPIView,
+    CustomerProfilePictureUploadAPIView, CustomerProfileAPIView,
     ServiceBookingListCreateAPIView, CustomerServiceBookingsAPIView,
     ChatSendMessageAPIView, ChatMessagesAPIView, ChatMarkReadAPIView, ChatUnreadCountAPIView,
-    BookingTrackingAPIView, CancelBookingAPIView
+    BookingTrackingAPIView, BookingTrailAPIView, CancelBookingAPIView, DispatchQueueStatsAPIView
 )
 
 from .api_views_provider_service import ProviderServiceListView
@@ -41,6 +42,8 @@ urlpatterns = [
     path('driver/<int:driver_id>/accept-ride/', DriverAcceptRideAPIView.as_view(), name='driver-accept-ride'),
     path('driver/<int:driver_id>/reject-ride/', DriverRejectRideAPIView.as_view(), name='driver-reject-ride'),
     path('driver/<int:driver_id>/location/', UpdateDriverLocationAPIView.as_view(), name='driver-update-location'),
+    path('driver/<int:driver_id>/location/batch/', DriverLocationBatchAPIView.as_view(), name='driver-location-batch'),
+    path('drivers/nearby/', NearbyVehiclesAPIView.as_view(), name='nearby-vehicles'),
     path('driver/<int:driver_id>/update-vehicle/', DriverUpdateVehicleAPIView.as_view(), name='driver-update-vehicle'),
     path('customer/register/', CustomerRegisterAPIView.as_view(), name='customer-register'),
     path('customer/login/', CustomerLoginAPIView.as_view(), name='customer-login'),
@@ -56,8 +59,11 @@ urlpatterns = [
     path('bookings/<int:booking_id>/cancel/', CancelBookingAPIView.as_view(), name='booking-cancel'),
     path('bookings/<int:booking_id>/assign-driver/', AssignNearestDriverAPIView.as_view(), name='booking-assign-driver'),
     path('bookings/<int:booking_id>/tracking/', BookingTrackingAPIView.as_view(), name='booking-tracking'),
+    path('bookings/<int:booking_id>/trail/', BookingTrailAPIView.as_view(), name='booking-trail'),
     path('customer/<int:customer_id>/bookings/', CustomerBookingsAPIView.as_view(), name='customer-bookings'),
     path('driver/<int:driver_id>/bookings/', DriverBookingsAPIView.as_view(), name='driver-bookings'),
+    path('dispatch/queue/', DispatchQueueStatsAPIView.as_view(), name='dispatch-queue-stats'),
+    path('locations/ingest/', LocationIngestStatsAPIView.as_view(), name='location-ingest-stats'),
     
     # Service Booking endpoints
     path('service-bookings/', ServiceBookingListCreateAPIView.as_view(), name='service-booking-list-create'),
@@ -0,0 +1,252 @@
+"""
+Service Zone Index
+
+Maps a coordinate to the ServiceZone polygon containing it, without a
+database query or string matching.
+
+- Active zones are loaded into a uniform grid of ZONE_CELL_SIZE_DEG cells.
+  Each cell lists the zones whose bounding box covers it, highest priority
+  (then smallest area) first.
+- Cells crossed by a polygon edge are "boundary" cells and need a
+  point-in-polygon test; every other covered cell is entirely inside or
+  entirely outside the zone, decided once at build time.
+- A lookup is one dict access plus, on boundary cells only, a ray-casting
+  test against one or two polygons.
+- A zone's polygon is either one [[lat, lon], ...] vertex list or a list of
+  them (an imported MultiPolygon); every part is indexed under the zone.
+
+Saving or deleting a ServiceZone bumps a version key in the cache so every
+process rebuilds its grid within VERSION_CHECK_SECONDS. The grid is also
+rebuilt every INDEX_REFRESH_SECONDS regardless.
+"""
+
+from math import floor
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ZONE_CELL_SIZE_DEG = 0.01        # ~1.1 km cells
+INDEX_REFRESH_SECONDS = 10 * 60
+VERSION_CHECK_SECONDS = 5
+MIN_POLYGON_VERTICES = 3
+VERSION_CACHE_KEY = 'service_zones:version'
+
+
+def validate_polygon(polygon):
+    """
+    Check a [[lat, lon], ...] vertex list.
+    Returns: the polygon as a list of (lat, lon) float tuples
+    Raises: ValueError with a message fit for the admin form
+    """
+    if not isinstance(polygon, (list, tuple)) or len(polygon) < MIN_POLYGON_VERTICES:
+        raise ValueError(f"A zone needs at least {MIN_POLYGON_VERTICES} [latitude, longitude] vertices")
+    vertices = []
+    for vertex in polygon:
+        try:
+            lat, lon = float(vertex[0]), float(vertex[1])
+        except (TypeError, ValueError, IndexError):
+            raise ValueError(f"Invalid vertex {vertex!r}; expected [latitude, longitude]")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Vertex {vertex!r} is out of range")
+        vertices.append((lat, lon))
+    if vertices[0] == vertices[-1]:
+        vertices.pop()  # Closed ring; the last edge is implied
+    if len(vertices) < MIN_POLYGON_VERTICES:
+        raise ValueError(f"A zone needs at least {MIN_POLYGON_VERTICES} distinct vertices")
+    return vertices
+
+
+def validate_polygons(polygon):
+    """
+    Check a zone polygon: one vertex list or a list of vertex lists.
+    Returns: list of parts, each a list of (lat, lon) float tuples
+    Raises: ValueError with a message fit for the admin form
+    """
+    is_multi = (
+        isinstance(polygon, (list, tuple)) and polygon
+        and isinstance(polygon[0], (list, tuple)) and polygon[0]
+        and isinstance(polygon[0][0], (list, tuple))
+    )
+    if not is_multi:
+        return [validate_polygon(polygon)]
+    return [validate_polygon(part) for part in polygon]
+
+
+def point_in_polygon(lat, lon, vertices):
+    """Ray casting along the latitude axis; points on an edge may fall either way."""
+    inside = False
+    previous_lat, previous_lon = vertices[-1]
+    for vertex_lat, vertex_lon in vertices:
+        if (vertex_lon > lon) != (previous_lon > lon):
+            crossing = (previous_lat - vertex_lat) * (lon - vertex_lon) / (previous_lon - vertex_lon) + vertex_lat
+            if lat < crossing:
+                inside = not inside
+        previous_lat, previous_lon = vertex_lat, vertex_lon
+    return inside
+
+
+def polygon_area(vertices):
+    """Shoelace area in square degrees, used only to rank overlapping zones."""
+    area = 0.0
+    previous_lat, previous_lon = vertices[-1]
+    for vertex_lat, vertex_lon in vertices:
+        area += previous_lon * vertex_lat - vertex_lon * previous_lat
+        previous_lat, previous_lon = vertex_lat, vertex_lon
+    return abs(area) / 2
+
+
+class ZoneGridIndex:
+    """
+    Uniform grid over zone polygons.
+    Cell entries are (zone_id, vertices or None); None means the whole cell
+    is inside the zone.
+    """
+
+    def __init__(self, cell_size_deg=ZONE_CELL_SIZE_DEG):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}   # (row, col) -> tuple of (zone_id, vertices or None)
+        self._names = {}   # zone_id -> name
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.version = None
+        self.checked_at = None
+
+    def __len__(self):
+        return len(self._names)
+
+    def _cell_for(self, lat, lon):
+        return (
+            int(floor(lat / self.cell_size_deg)),
+            int(floor(lon / self.cell_size_deg)),
+        )
+
+    def _cover(self, vertices):
+        """
+        Grid cells covered by a polygon.
+        Returns: {cell: True if it needs a point-in-polygon test}
+        """
+        size = self.cell_size_deg
+        boundary = set()
+        previous = vertices[-1]
+        for vertex in vertices:
+            first = self._cell_for(min(previous[0], vertex[0]), min(previous[1], vertex[1]))
+            last = self._cell_for(max(previous[0], vertex[0]), max(previous[1], vertex[1]))
+            for row in range(first[0], last[0] + 1):
+                for col in range(first[1], last[1] + 1):
+                    boundary.add((row, col))
+            previous = vertex
+
+        first = self._cell_for(min(v[0] for v in vertices), min(v[1] for v in vertices))
+        last = self._cell_for(max(v[0] for v in vertices), max(v[1] for v in vertices))
+        covered = {}
+        for row in range(first[0], last[0] + 1):
+            for col in range(first[1], last[1] + 1):
+                if (row, col) in boundary:
+                    covered[(row, col)] = True
+                elif point_in_polygon((row + 0.5) * size, (col + 0.5) * size, vertices):
+                    covered[(row, col)] = False
+        return covered
+
+    def rebuild(self, zones, version=None):
+        """Replace the grid with (zone_id, name, priority, parts) rows; parts is a list of vertex lists."""
+        ranked = sorted(zones, key=lambda zone: (-zone[2], sum(polygon_area(part) for part in zone[3])))
+        cells = {}
+        names = {}
+        for zone_id, name, _, parts in ranked:
+            names[zone_id] = name
+            for vertices in parts:
+                for cell, needs_test in self._cover(vertices).items():
+                    cells.setdefault(cell, []).append((zone_id, vertices if needs_test else None))
+
+        with self._lock:
+            self._cells = {cell: tuple(entries) for cell, entries in cells.items()}
+            self._names = names
+            self.version = version
+            self.loaded_at = self.checked_at = time.monotonic()
+        logger.info(f"Zone index rebuilt: {len(names)} zone(s) over {len(cells)} cell(s)")
+
+    def lookup(self, lat, lon):
+        """Returns: id of the highest-priority zone containing the point, or None"""
+        lat, lon = float(lat), float(lon)
+        for zone_id, vertices in self._cells.get(self._cell_for(lat, lon), ()):
+            if vertices is None or point_in_polygon(lat, lon, vertices):
+                return zone_id
+        return None
+
+    def name(self, zone_id):
+        return self._names.get(zone_id)
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.loaded_at > INDEX_REFRESH_SECONDS:
+            return True
+        if now - self.checked_at > VERSION_CHECK_SECONDS:
+            self.checked_at = now
+            return cache.get(VERSION_CACHE_KEY) != self.version
+        return False
+
+
+# Process-wide index used by bookings, provider services and dispatch
+zone_index = ZoneGridIndex()
+
+
+def rebuild_zone_index():
+    from .models import ServiceZone
+
+    version = cache.get(VERSION_CACHE_KEY)
+    zones = []
+    for zone_id, name, priority, polygon in ServiceZone.objects.filter(is_active=True).values_list(
+        'id', 'name', 'priority', 'polygon'
+    ):
+        try:
+            zones.append((zone_id, name, priority, validate_polygons(polygon)))
+        except ValueError as e:
+            logger.error(f"Service zone #{zone_id} ({name}) skipped: {e}")
+    zone_index.rebuild(zones, version)
+
+
+def ensure_index_loaded():
+    if zone_index.is_stale():
+        rebuild_zone_index()
+
+
+def invalidate():
+    """Make every process rebuild its grid; called when zones change."""
+    cache.set(VERSION_CACHE_KEY, time.time(), None)
+    zone_index.loaded_at = None
+
+
+def zone_for(lat, lon):
+    """
+    Service zone containing a coordinate.
+    Returns: ServiceZone id, or None when outside every zone or lat/lon is missing
+    """
+    if lat is None or lon is None:
+        return None
+    ensure_index_loaded()
+    return zone_index.lookup(lat, lon)
+
+
+def has_zones():
+    """True when at least one active zone is configured."""
+    ensure_index_loaded()
+    return len(zone_index) > 0
+
+
+def zones_for_points(points):
+    """
+    Zone of every (lat, lon) in `points`.
+    Returns: list of zone ids (None where outside every zone)
+    """
+    ensure_index_loaded()
+    return [
+        zone_index.lookup(lat, lon) if lat is not None and lon is not None else None
+        for lat, lon in points
+    ]
@@ -14,7 +14,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'move_backend.settings')
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
-from provider_service.consumers import RideNotificationConsumer
+from provider_service.consumers import ChatConsumer, RideNotificationConsumer
 from django.urls import path
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'move_backend.settings')
@@ -24,6 +24,7 @@ application = ProtocolTypeRouter({
 	"websocket": AuthMiddlewareStack(
 		URLRouter([
 			path("ws/ride-notifications/", RideNotificationConsumer.as_asgi()),
+			path("ws/chat/<int:booking_id>/", ChatConsumer.as_asgi()),
 		])
 	),
 })
@@ -32,6 +32,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -99,14 +100,78 @@ TEMPLATES = [
 
 # Channels
 ASGI_APPLICATION = 'move_backend.asgi.application'
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+# Channel layer
+# InMemoryChannelLayer only reaches sockets held by the same process. With more
+# than one ASGI worker (or host) set CHANNEL_LAYER_URL to a Redis-compatible
+# server, e.g. redis://localhost:6379/0 or unix:///var/run/redis/redis.sock
+# (needs the channels_redis package), so group sends reach every worker.
+# Check the wiring with `python manage.py check_channel_layer`.
+CHANNEL_LAYER_URL = os.environ.get('CHANNEL_LAYER_URL', '')
+CHANNEL_GROUP_EXPIRY_SECONDS = int(os.environ.get('CHANNEL_GROUP_EXPIRY_SECONDS', 24 * 60 * 60))
+CHANNEL_LAYER_CONFIG = {
+    'group_expiry': CHANNEL_GROUP_EXPIRY_SECONDS,   # Sockets re-join their groups before this runs out
+    'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', 1000)),  # Queued messages per channel
+    'expiry': 60,                                   # Seconds an undelivered message is kept
 }
+if CHANNEL_LAYER_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_LAYER_URL], 'prefix': 'move', **CHANNEL_LAYER_CONFIG},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': CHANNEL_LAYER_CONFIG,
+        },
+    }
 WSGI_APPLICATION = 'move_backend.wsgi.application'
 
 
+# Cache
+# Shared dispatch and trip state lives in the default cache: the live driver
+# location store, trip trails and trip meters, ranked candidate queues, chat
+# unread counters and the service zone index version. (Driver presence is kept
+# in the database, so run_presence_sweeper works with either cache.)
+# LocMemCache is private to each process, so it is only correct when a single
+# process serves HTTP, WebSockets and runs every management command. Set
+# CACHE_URL to a Redis server, e.g. redis://localhost:6379/1 (needs the redis
+# package), for any deployment with more than one process - the separate
+# run_dispatch_worker / run_offer_scheduler commands included.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': 'move',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        },
+    }
+
+
+# Ride dispatch
+# New bookings are queued and dispatched by `python manage.py run_dispatch_worker`.
+# Set DISPATCH_USE_WORKER = False to dispatch inside the booking request instead.
+DISPATCH_USE_WORKER = True
+# With batch mode on, bookings are matched to drivers in global batches by
+# `python manage.py run_batch_dispatch` instead of one booking at a time.
+DISPATCH_BATCH_MODE = False
+DISPATCH_BATCH_INTERVAL_SECONDS = 5
+# 'sequential' offers a booking to one driver at a time; 'parallel' offers it
+# to the top DISPATCH_PARALLEL_OFFER_COUNT drivers at once, first accept wins.
+DISPATCH_MODE = 'sequential'
+DISPATCH_PARALLEL_OFFER_COUNT = 3
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
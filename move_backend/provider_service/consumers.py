@@ -1,8 +1,19 @@
+import asyncio
 import json
+import time
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from .models_ride_request import RideRequest
 from corporate.models import Driver, Customer
 
+# Configuration
+LOCATION_COALESCE_SECONDS = 2          # At most one stored fix per driver per window
+LOCATION_MAX_FRAMES_PER_MINUTE = 120   # Frames beyond this are dropped
+# Re-join the user's group well before the channel layer's group_expiry drops it
+GROUP_REFRESH_SECONDS = getattr(settings, 'CHANNEL_GROUP_EXPIRY_SECONDS', 24 * 60 * 60) / 2
+
+
 class RideNotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope["user"]
@@ -16,6 +27,18 @@ class RideNotificationConsumer(AsyncWebsocketConsumer):
                 group_name = f"customer_{user.id}"
             await self.channel_layer.group_add(group_name, self.channel_name)
             await self.accept()
+            self._group_refresh_task = asyncio.create_task(self._refresh_group(group_name))
+            if hasattr(user, "is_online"):
+                await self._heartbeat()
+
+            # Location streaming state (drivers only)
+            self._pending_fix = None        # Latest fix not yet stored
+            self._last_fix_at = None        # Device timestamp of the newest accepted fix
+            self._last_store = 0.0          # Monotonic time of the last store write
+            self._flush_task = None
+            self._frame_window_start = time.monotonic()
+            self._frames_in_window = 0
+            self._cadence = None            # Last cadence recommendation sent
         else:
             await self.close()
 
@@ -24,13 +47,294 @@ class RideNotificationConsumer(AsyncWebsocketConsumer):
         if user.is_authenticated:
             if hasattr(user, "is_online"):
                 group_name = f"driver_{user.id}"
+                if self._flush_task:
+                    self._flush_task.cancel()
+                await self._store_pending_fix()
             else:
                 group_name = f"customer_{user.id}"
+            self._group_refresh_task.cancel()
             await self.channel_layer.group_discard(group_name, self.channel_name)
 
-    async def receive(self, text_data):
-        # Optionally handle incoming messages
-        pass
+    async def _refresh_group(self, group_name):
+        """Keep a long-lived socket (e.g. a driver's whole shift) in its group."""
+        while True:
+            await asyncio.sleep(GROUP_REFRESH_SECONDS)
+            await self.channel_layer.group_add(group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or "")
+        except ValueError:
+            await self._send_error("invalid_json", "Frames must be JSON objects")
+            return
+        if not isinstance(message, dict):
+            await self._send_error("invalid_json", "Frames must be JSON objects")
+            return
+
+        # Any frame from a driver's app proves it is alive; "heartbeat" frames exist just for that
+        if hasattr(self.scope["user"], "is_online"):
+            await self._heartbeat()
+
+        if message.get("type") == "location":
+            await self._receive_location(message)
+        elif message.get("type") == "track":
+            await self._receive_track(message)
+        elif message.get("type") == "offer_ack":
+            await self._receive_offer_ack(message)
+
+    async def _heartbeat(self):
+        from corporate import driver_presence
+
+        await database_sync_to_async(driver_presence.heartbeat)(self.scope["user"].id)
 
     async def send_ride_notification(self, event):
         await self.send(text_data=json.dumps(event["data"]))
+
+    # ------------------------------------------------------------
+    # Location streaming
+    # ------------------------------------------------------------
+
+    async def _receive_location(self, message):
+        """
+        Handle a {"type": "location", "latitude", "longitude", "timestamp"?}
+        frame. Fixes are validated, rate limited and coalesced: only the
+        newest fix of each LOCATION_COALESCE_SECONDS window is stored.
+        """
+        from corporate import location_store
+
+        if not hasattr(self.scope["user"], "is_online"):
+            await self._send_error("forbidden", "Only drivers can send location")
+            return
+
+        now = time.monotonic()
+        if now - self._frame_window_start >= 60:
+            self._frame_window_start = now
+            self._frames_in_window = 0
+        self._frames_in_window += 1
+        if self._frames_in_window > LOCATION_MAX_FRAMES_PER_MINUTE:
+            if self._frames_in_window == LOCATION_MAX_FRAMES_PER_MINUTE + 1:
+                await self._send_error("rate_limited", "Too many location frames, slow down")
+            return
+
+        try:
+            fix = location_store.parse_fix(message)
+        except (AttributeError, TypeError, ValueError) as e:
+            # Same guard as DriverLocationBatchAPIView; a bad frame must not close the socket
+            await self._send_error("invalid_location", str(e) if isinstance(e, ValueError) else "Invalid location frame")
+            return
+
+        # Ignore fixes older than the newest one already accepted
+        if self._last_fix_at and fix[2] <= self._last_fix_at:
+            return
+        self._last_fix_at = fix[2]
+        self._pending_fix = fix
+
+        wait = LOCATION_COALESCE_SECONDS - (now - self._last_store)
+        if wait <= 0:
+            await self._store_pending_fix()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._store_after(wait))
+
+    async def _store_after(self, delay):
+        await asyncio.sleep(delay)
+        await self._store_pending_fix()
+
+    async def _store_pending_fix(self):
+        fix, self._pending_fix = self._pending_fix, None
+        if fix is None:
+            return
+        self._last_store = time.monotonic()
+        cadence = await database_sync_to_async(_store_driver_fix)(self.scope["user"].id, *fix)
+        if cadence != self._cadence:
+            self._cadence = cadence
+            await self.send(text_data=json.dumps({"type": "cadence", **cadence}))
+
+    # ------------------------------------------------------------
+    # Trip tracking subscription
+    # ------------------------------------------------------------
+
+    async def _receive_track(self, message):
+        """
+        Handle {"type": "track", "booking_id", "resume_token"?} from a customer.
+        Updates for the customer's active trips are pushed to their group
+        anyway; this answers with what the client is missing: nothing, the
+        latest position, or a full snapshot if the token cannot be used.
+        """
+        if hasattr(self.scope["user"], "is_online"):
+            await self._send_error("forbidden", "Only customers can track a booking")
+            return
+
+        try:
+            booking_id = int(message.get("booking_id"))
+        except (TypeError, ValueError):
+            await self._send_error("invalid_booking", "booking_id is required")
+            return
+
+        reply = await database_sync_to_async(_tracking_reply)(
+            self.scope["user"].id, booking_id, message.get("resume_token")
+        )
+        if reply is None:
+            await self._send_error("not_found", "Booking not found")
+            return
+        await self.send(text_data=json.dumps(reply))
+
+    # ------------------------------------------------------------
+    # Ride offers
+    # ------------------------------------------------------------
+
+    async def _receive_offer_ack(self, message):
+        """
+        Handle {"type": "offer_ack", "offer_id"} from a driver whose app
+        received a pushed ride_offer.
+        """
+        from corporate import offer_push
+
+        if not hasattr(self.scope["user"], "is_online"):
+            await self._send_error("forbidden", "Only drivers can acknowledge offers")
+            return
+
+        try:
+            offer_id = int(message.get("offer_id"))
+        except (TypeError, ValueError):
+            await self._send_error("invalid_offer", "offer_id is required")
+            return
+
+        if not await database_sync_to_async(offer_push.acknowledge)(self.scope["user"].id, offer_id):
+            await self._send_error("not_found", "Offer not found")
+
+    async def _send_error(self, code, message):
+        await self.send(text_data=json.dumps({"type": "error", "code": code, "message": message}))
+
+
+def _tracking_reply(customer_id, booking_id, resume_token):
+    from corporate import trip_tracking
+    from corporate.models import Booking
+
+    if resume_token:
+        # Ownership check without loading the booking
+        if not Booking.objects.filter(id=booking_id, customer_id=customer_id).exists():
+            return None
+        reply = trip_tracking.resume(booking_id, resume_token)
+        if reply is not None:
+            return reply
+
+    booking = Booking.objects.select_related("driver").filter(id=booking_id, customer_id=customer_id).first()
+    if booking is None:
+        return None
+    return {"type": "tracking_snapshot", **trip_tracking.snapshot(booking)}
+
+
+def _store_driver_fix(driver_id, lat, lon, recorded_at):
+    """Store a fix and return the cadence the device should report at."""
+    from corporate import location_cadence, location_store
+    from corporate.spatial_index import driver_index
+
+    location_store.record(driver_id, lat, lon, recorded_at)
+    flags = Driver.objects.filter(id=driver_id).values_list("is_online", "is_approved").first()
+    if flags and all(flags):
+        driver_index.update(driver_id, lat, lon)
+    return location_cadence.recommend(driver_id, lat, lon)
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Booking chat at ws/chat/<booking_id>/ for the booking's customer and driver.
+
+    Client frames:
+        {"type": "chat_send", "message", "client_id"?}
+        {"type": "chat_read", "up_to_id"}
+        {"type": "chat_sync", "after_id"}   -> {"type": "chat_history", "messages": [...]}
+    Messages from the other party are marked delivered as they are sent down
+    this socket; receipts come back as chat_receipt frames.
+    """
+
+    async def connect(self):
+        from corporate import chat_service
+
+        user = self.scope["user"]
+        self.booking_id = self.scope["url_route"]["kwargs"]["booking_id"]
+        self.participant = None
+        if user.is_authenticated:
+            self.participant = await database_sync_to_async(chat_service.participant_type)(self.booking_id, user)
+        if self.participant is None:
+            await self.close()
+            return
+
+        self.group_name = chat_service.group_name(self.booking_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.participant is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or "")
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            await self._send_error("invalid_json", "Frames must be JSON objects")
+            return
+
+        frame_type = message.get("type")
+        if frame_type == "chat_send":
+            await self._receive_send(message)
+        elif frame_type == "chat_read":
+            await self._receive_read(message)
+        elif frame_type == "chat_sync":
+            await self._receive_sync(message)
+
+    async def _receive_send(self, message):
+        from corporate import chat_service
+
+        try:
+            await database_sync_to_async(chat_service.send_message)(
+                self.booking_id, self.participant, self.scope["user"].id,
+                message.get("message"), message.get("client_id")
+            )
+        except ValueError as e:
+            await self._send_error("invalid_message", str(e))
+
+    async def _receive_read(self, message):
+        from corporate import chat_service
+
+        try:
+            up_to_id = int(message.get("up_to_id"))
+        except (TypeError, ValueError):
+            await self._send_error("invalid_message", "up_to_id is required")
+            return
+        await database_sync_to_async(chat_service.mark_read)(self.booking_id, self.participant, up_to_id)
+
+    async def _receive_sync(self, message):
+        try:
+            after_id = int(message.get("after_id") or 0)
+        except (TypeError, ValueError):
+            await self._send_error("invalid_message", "after_id must be a message id")
+            return
+        messages = await database_sync_to_async(_chat_history)(self.booking_id, self.participant, after_id)
+        await self.send(text_data=json.dumps({"type": "chat_history", "messages": messages}))
+
+    async def chat_event(self, event):
+        from corporate import chat_service
+
+        data = event["data"]
+        await self.send(text_data=json.dumps(data))
+        if data["type"] == "chat_message" and data["message"]["sender_type"] != self.participant:
+            await database_sync_to_async(chat_service.mark_delivered)(
+                self.booking_id, self.participant, data["message"]["id"]
+            )
+
+    async def _send_error(self, code, message):
+        await self.send(text_data=json.dumps({"type": "error", "code": code, "message": message}))
+
+
+def _chat_history(booking_id, participant, after_id):
+    """Messages after `after_id`; what the other party sent is now delivered."""
+    from corporate import chat_service
+    from corporate.serializers import ChatMessageSerializer
+
+    messages = chat_service.messages_after(booking_id, after_id)
+    if messages:
+        chat_service.mark_delivered(booking_id, participant, messages[-1].id)
+    return ChatMessageSerializer(messages, many=True).data
@@ -1,9 +1,13 @@
+import math
+
 from rest_framework import status
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from .models import ProviderService
 from .serializers import ProviderServiceSerializer
+from corporate.zone_index import has_zones, zone_for
 
 @api_view(['GET', 'POST'])
 def provider_services_by_category(request):
@@ -12,6 +16,21 @@ def provider_services_by_category(request):
         if not category_id:
             return Response({'error': 'service_category parameter is required'}, status=400)
         services = ProviderService.objects.filter(service_category_id=category_id, is_active=True)
+        # Optional customer position: only services offered in the zone containing it.
+        # Services not linked to any zone are offered everywhere.
+        lat, lon = request.GET.get('lat'), request.GET.get('lon')
+        if lat and lon:
+            try:
+                lat, lon = float(lat), float(lon)
+            except ValueError:
+                return Response({'error': 'lat and lon must be numbers'}, status=400)
+            if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+                return Response({'error': 'lat or lon out of range'}, status=400)
+            zone_id = zone_for(lat, lon)
+            if zone_id:
+                services = services.filter(Q(service_zones=zone_id) | Q(service_zones__isnull=True)).distinct()
+            elif has_zones():
+                services = services.filter(service_zones__isnull=True)
         serializer = ProviderServiceSerializer(services, many=True, context={'request': request})
         return Response(serializer.data)
     elif request.method == 'POST':